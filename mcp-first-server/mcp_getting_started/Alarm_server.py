@@ -2,36 +2,561 @@
 闹钟 MCP 服务器
 提供创建、查询、更新和删除闹钟的功能
 通过 HTTP 请求调用远程闹钟服务 API
+
+所有工具均为异步函数，共用一个支持 HTTP/2 多路复用的 httpx.AsyncClient，
+后端变慢时不会阻塞 FastMCP 事件循环，多个工具调用可在同一连接上并发。
+
+每个工具调用共享一个总时限预算，重试与退避都不会超出预算；
+GET 请求在超过 p95 延迟仍未返回时发出对冲请求；后端持续失败时熔断，直接快速失败。
+
+传输方式由环境变量 ALARM_MCP_TRANSPORT 决定：
+- remote（默认）：通过 HTTPS 访问 API_BASE_URL
+- inprocess：与 server/app.py 部署在一起时，直接在进程内调用 Flask 应用，不经过网络。
+  需要服务端的依赖（Flask、PyMySQL 等），用 `uv sync --extra inprocess` 安装，
+  并按 server/README.md 配置数据库环境变量
 """
-import requests
+import asyncio
+import functools
+import httpx
+import logging
+import msgpack
+import os
+import sys
+import time
+import uuid
 from datetime import datetime
-from typing import Optional
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
 from mcp.server.fastmcp import FastMCP
 
 # 远程闹钟服务 API 基础 URL (仅支持 HTTPS)
 API_BASE_URL = "https://alarm.name666.top"
 
+# 传输方式: remote / inprocess
+TRANSPORT_MODE = os.getenv('ALARM_MCP_TRANSPORT', 'remote')
+# inprocess 模式下 Flask 服务端代码所在目录
+SERVER_DIR = os.getenv(
+    'ALARM_SERVER_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'server')
+)
+
 # 请求配置
-REQUEST_TIMEOUT = 30  # 增加超时时间到 30 秒
+CALL_DEADLINE = 10  # 单次工具调用的总时限（秒），包含所有重试与退避
+ATTEMPT_TIMEOUT = 4  # 单次请求超时，需明显小于总时限，才能留出重试余量
 MAX_RETRIES = 3  # 最大重试次数
+RETRY_BACKOFF = 0.25  # 指数退避的初始等待秒数
+RETRY_STATUS = {500, 502, 503, 504}
+RETRY_METHODS = {"GET", "PUT", "DELETE"}  # 只重试幂等请求
+# 服务端限流：429 表示请求未被执行，任何方法都可以按 Retry-After 等待后重试
+RATE_LIMITED_STATUS = 429
+# 客户端发送速率，与服务端对每个调用方的限流 (RATE_LIMIT_PER_SECOND / RATE_LIMIT_BURST) 一致，
+# 批量工具的并发请求按此节奏发出，而不是一次打满突发量后收到 429
+CLIENT_RATE_LIMIT = float(os.getenv('ALARM_MCP_RATE_LIMIT', 5))
+CLIENT_RATE_BURST = float(os.getenv('ALARM_MCP_RATE_BURST', 20))
+# POST 请求携带幂等键，服务端对相同键的重试返回首次执行的结果，因此也可以重试
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# 把本次请求的剩余时限告诉服务端，服务端据此限制数据库查询的执行时间
+TIMEOUT_HEADER = "X-Request-Timeout"
+# 优先请求 MessagePack 响应：体积更小，对象列表按列编码，时间戳为原生类型
+MSGPACK_TYPE = "application/msgpack"
+ACCEPT = f"{MSGPACK_TYPE}, application/json;q=0.9"
+MSGPACK_TABLE_EXT = 1  # 列式表扩展类型，与 server/codec.py 的 TABLE_EXT 一致
+
+# 对冲请求配置：GET 超过 p95 延迟仍未返回时再发一份
+HEDGE_DEFAULT_DELAY = 0.5  # 样本不足时使用的对冲延迟（秒）
+HEDGE_MIN_DELAY = 0.05  # 对冲延迟下限，避免后端很快时成倍放大请求
+HEDGE_MIN_SAMPLES = 20  # 开始使用 p95 的最少样本数
+
+# 熔断配置
+BREAKER_FAILURE_THRESHOLD = 5  # 连续失败次数达到该值后熔断
+BREAKER_COOLDOWN = 15  # 熔断持续秒数，之后放行一个探测请求
+
+# 本地读缓存配置
+CACHE_TTL = 30  # 新鲜期（秒），期内直接返回缓存
+CACHE_STALE_TTL = 300  # 过期后仍可返回旧值、同时后台刷新的时长（秒）
+
+# 批量工具配置
+BULK_MAX_ITEMS = 100  # 单次批量调用的最大条目数
+BULK_CONCURRENCY = 8  # 批量请求的最大并发数
+BULK_CALL_DEADLINE = 30  # 批量工具的总时限（秒）
+
+# list_alarms 每页的条数与字节预算，避免闹钟很多时撑爆对话上下文
+LIST_MAX_ITEMS = 50
+LIST_MAX_BYTES = 4096
+
+# 人设目录不可用时的兜底列表
+DEFAULT_PERSONAS = ['gentle', 'energetic', 'informative', 'humorous', 'strict']
 
 # 创建 MCP 服务器实例
 mcp = FastMCP("Alarm Manager")
 
-# 配置请求会话,启用连接池和重试
-session = requests.Session()
-adapter = requests.adapters.HTTPAdapter(
-    max_retries=requests.adapters.Retry(
-        total=MAX_RETRIES,
-        backoff_factor=1,
-        status_forcelist=[500, 502, 503, 504]
+# stdio 传输占用 stdout，日志写到 stderr
+logger = logging.getLogger("alarm_mcp")
+
+
+class InProcessTransport(httpx.AsyncBaseTransport):
+    """在进程内调用 Flask 应用的 httpx 传输层，请求不经过网络"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        headers = {
+            key: value for key, value in request.headers.items()
+            if key.lower() not in ('host', 'content-length')
+        }
+        # Flask 处理函数是同步的（会访问数据库），放到线程中执行避免阻塞事件循环
+        response = await asyncio.to_thread(
+            self._call, request.method, request.url.raw_path.decode(), headers, body
+        )
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers.to_wsgi_list(),
+            content=response.get_data()
+        )
+    
+    def _call(self, method: str, path: str, headers: Dict[str, str], body: bytes):
+        # 每次调用使用独立的 test_client，线程间不共享状态
+        return self.app.test_client().open(path, method=method, headers=headers, data=body)
+
+
+def create_client() -> httpx.AsyncClient:
+    """按 TRANSPORT_MODE 创建 HTTP 客户端"""
+    if TRANSPORT_MODE == 'inprocess':
+        sys.path.insert(0, os.path.abspath(SERVER_DIR))
+        try:
+            from app import app as flask_app
+        except ImportError as e:
+            if e.name == 'app':
+                raise ImportError(f"inprocess 模式未找到服务端代码 {SERVER_DIR}，请设置 ALARM_SERVER_DIR") from e
+            raise ImportError(
+                f"inprocess 模式缺少服务端依赖 {e.name}，请运行 uv sync --extra inprocess，"
+                f"或将 ALARM_MCP_TRANSPORT 设为 remote"
+            ) from e
+        return httpx.AsyncClient(
+            base_url="http://inprocess",
+            transport=InProcessTransport(flask_app),
+            timeout=httpx.Timeout(ATTEMPT_TIMEOUT)
+        )
+    
+    # 异步 HTTP/2 客户端：连接池与 keep-alive 复用同一条 TLS 连接
+    return httpx.AsyncClient(
+        base_url=API_BASE_URL,
+        http2=True,
+        verify=True,  # 验证 SSL 证书
+        timeout=httpx.Timeout(ATTEMPT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=10,
+            max_keepalive_connections=5,
+            keepalive_expiry=60
+        )
     )
-)
-session.mount('https://', adapter)
+
+
+client = create_client()
+
+
+# 当前工具调用的截止时间（事件循环时间），由 deadline_budget 设置
+call_deadline: ContextVar[Optional[float]] = ContextVar('call_deadline', default=None)
+
+
+def deadline_budget(seconds: float):
+    """为工具调用设置总时限，调用内的所有请求共享同一预算"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            token = call_deadline.set(asyncio.get_running_loop().time() + seconds)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                call_deadline.reset(token)
+        return wrapper
+    return decorator
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """熔断期间直接拒绝请求"""
+
+
+class CircuitBreaker:
+    """
+    熔断器
+    
+    - closed: 正常放行，连续失败达到阈值后转为 open
+    - open: 直接拒绝，冷却时间过后转为 half_open
+    - half_open: 只放行一个探测请求，成功则恢复，失败则重新熔断
+    """
+    
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = 0.0
+    
+    def allow(self) -> bool:
+        """当前是否允许发出请求"""
+        now = time.monotonic()
+        if self.state == 'open' and now - self.opened_at >= self.cooldown:
+            self.state = 'half_open'
+            self.probe_started_at = now
+            return True
+        if self.state == 'half_open' and now - self.probe_started_at >= ATTEMPT_TIMEOUT:
+            # 上一个探测请求被取消，没有结果，重新放行一个
+            self.probe_started_at = now
+            return True
+        return self.state == 'closed'
+    
+    def record(self, ok: bool) -> None:
+        """记录一次请求结果"""
+        if ok:
+            self.state = 'closed'
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+
+
+class RequestPacer:
+    """
+    客户端令牌桶：所有请求共享，按服务端的限流速率发出。
+    收到 429 时按 Retry-After 暂停所有请求，而不是让并发的请求继续撞上限流。
+    """
+    
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.waits = 0
+    
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """
+        取出一个令牌（可以透支），返回需要等待的秒数。
+        需要等待 max_wait 秒及以上时不取令牌并返回 None，放弃的请求不会占用后续请求的配额。
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        wait = max((1 - self.tokens) / self.rate, self.paused_until - now, 0.0)
+        if wait > 0 and wait >= max_wait:
+            return None
+        self.tokens -= 1
+        if wait > 0:
+            self.waits += 1
+        return wait
+    
+    def pause(self, seconds: float) -> None:
+        """服务端要求等待 seconds 秒"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    """Retry-After 响应头（秒），没有或无法解析时为 None"""
+    try:
+        return max(float(response.headers.get("retry-after", "")), 0.0)
+    except ValueError:
+        return None
+
+
+class LatencyTracker:
+    """记录最近的 GET 延迟，计算对冲请求的等待时间"""
+    
+    def __init__(self, size: int = 200):
+        self.samples: deque = deque(maxlen=size)
+        self.hedges = 0
+    
+    def record(self, elapsed: float) -> None:
+        self.samples.append(elapsed)
+    
+    def hedge_delay(self) -> float:
+        """p95 延迟，样本不足时使用默认值"""
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        ordered = sorted(self.samples)
+        return max(HEDGE_MIN_DELAY, ordered[int(len(ordered) * 0.95) - 1])
+
+
+breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN)
+pacer = RequestPacer(CLIENT_RATE_LIMIT, CLIENT_RATE_BURST)
+latency = LatencyTracker()
+
+
+async def send_timed(
+    method: str,
+    path: str,
+    json: Optional[Any],
+    headers: Optional[Dict[str, str]] = None
+) -> httpx.Response:
+    """发送请求并记录成功 GET 的延迟"""
+    started = time.monotonic()
+    response = await client.request(method, path, json=json, headers=headers)
+    if method == "GET" and response.status_code < 500:
+        latency.record(time.monotonic() - started)
+    return response
+
+
+async def send_hedged(path: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    """GET 请求超过 p95 延迟仍未返回时再发一份，先返回者胜出，另一份被取消"""
+    pending = {asyncio.create_task(send_timed("GET", path, None, headers))}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=latency.hedge_delay())
+        if not done:
+            latency.hedges += 1
+            pending.add(asyncio.create_task(send_timed("GET", path, None, headers)))
+        error = None
+        while done or pending:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def api_request(method: str, path: str, json: Optional[Any] = None) -> httpx.Response:
+    """
+    在调用总时限内发送请求，失败时按指数退避重试。
+    POST 请求自动携带幂等键，重试不会重复创建。
+    请求按服务端的限流速率发出；收到 429 或带 Retry-After 的 503 时至少等待 Retry-After 秒再重试。
+    
+    Args:
+        method: HTTP 方法
+        path: API 路径，例如 "/api/alarms"
+        json: 请求体
+    
+    Returns:
+        最后一次请求的响应（5xx 重试耗尽时也会返回）
+    
+    Raises:
+        CircuitOpenError: 后端处于熔断状态
+        httpx.HTTPError: 网络错误或超出总时限
+    """
+    loop = asyncio.get_running_loop()
+    deadline = call_deadline.get() or loop.time() + CALL_DEADLINE
+    attempt = 0
+    # 同一次调用的所有重试共用一个幂等键
+    idempotency_key = uuid.uuid4().hex if method == "POST" else None
+    
+    while True:
+        if not breaker.allow():
+            raise CircuitOpenError("后端暂时不可用（已熔断），请稍后重试")
+        wait = pacer.reserve(deadline - loop.time())
+        if wait is None:
+            raise httpx.TimeoutException(f"超出调用时限（等待限流配额）: {method} {path}")
+        if wait > 0:
+            await asyncio.sleep(wait)
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise httpx.TimeoutException(f"超出调用时限: {method} {path}")
+        timeout = min(ATTEMPT_TIMEOUT, remaining)
+        headers = {TIMEOUT_HEADER: f"{timeout:.3f}", "Accept": ACCEPT}
+        if idempotency_key:
+            headers[IDEMPOTENCY_HEADER] = idempotency_key
+        try:
+            send = send_hedged(path, headers) if method == "GET" else send_timed(method, path, json, headers)
+            response = await asyncio.wait_for(send, timeout=timeout)
+            error = None
+        except asyncio.TimeoutError:
+            response, error = None, httpx.TimeoutException(f"请求超时: {method} {path}")
+        except httpx.TransportError as e:
+            response, error = None, e
+        
+        rate_limited = response is not None and response.status_code == RATE_LIMITED_STATUS
+        failed = response is None or response.status_code in RETRY_STATUS
+        if not rate_limited:
+            # 限流说明后端正常，不计入熔断
+            breaker.record(not failed)
+        if not failed and not rate_limited:
+            return response
+        
+        attempt += 1
+        delay = RETRY_BACKOFF * 2 ** (attempt - 1)
+        server_delay = retry_after(response) if response is not None else None
+        if server_delay is not None:
+            delay = max(delay, server_delay)
+            if rate_limited:
+                pacer.pause(server_delay)
+        if (
+            (method not in RETRY_METHODS and idempotency_key is None and not rate_limited)
+            or attempt > MAX_RETRIES
+            or loop.time() + delay >= deadline
+        ):
+            if response is not None:
+                return response
+            raise error
+        await asyncio.sleep(delay)
+
+
+class ApiError(Exception):
+    """后端返回了非成功响应"""
+
+
+def _msgpack_ext_hook(code: int, data: bytes) -> Any:
+    if code == MSGPACK_TABLE_EXT:
+        keys, rows = msgpack.unpackb(data, ext_hook=_msgpack_ext_hook, timestamp=3)
+        return [dict(zip(keys, row)) for row in rows]
+    return msgpack.ExtType(code, data)
+
+
+def decode_body(response: httpx.Response) -> Any:
+    """按 Content-Type 解码响应体，MessagePack 的列式表还原为对象列表"""
+    content_type = response.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == MSGPACK_TYPE:
+        return msgpack.unpackb(response.content, ext_hook=_msgpack_ext_hook, timestamp=3)
+    return response.json()
+
+
+async def fetch_data(path: str) -> Any:
+    """
+    GET 请求并返回响应中的 data 字段
+    
+    Returns:
+        data 字段，资源不存在 (404) 时返回 None
+    
+    Raises:
+        ApiError: 后端返回错误
+        httpx.HTTPError: 网络错误
+    """
+    response = await api_request("GET", path)
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise ApiError(f"HTTP {response.status_code}")
+    result = decode_body(response)
+    if not result.get('success'):
+        raise ApiError(result.get('message', '未知错误'))
+    return result.get('data')
+
+
+class TTLCache:
+    """
+    带后台刷新的本地 TTL 缓存
+    
+    - 新鲜期内直接返回缓存
+    - 过期但仍在 stale_ttl 内时返回旧值，并在后台刷新
+    - 并发未命中共享同一次请求
+    - invalidate 之后完成的旧请求不会写回缓存
+    """
+    
+    def __init__(self, ttl: float, stale_ttl: float):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: Dict[Hashable, tuple] = {}
+        self._pending: Dict[Hashable, asyncio.Task] = {}
+        self._versions: Dict[Hashable, int] = {}
+    
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """读取缓存，未命中时调用 fetch 加载"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                return value
+            if age < self.stale_ttl:
+                self._refresh(key, fetch)
+                return value
+        return await asyncio.shield(self._refresh(key, fetch))
+    
+    def _refresh(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key, fetch, self._versions.get(key, 0)))
+            task.add_done_callback(self._log_failure)
+            self._pending[key] = task
+        return task
+    
+    @staticmethod
+    def _log_failure(task: asyncio.Task) -> None:
+        # 后台刷新没有调用方等待结果，在这里取出异常并记录
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("缓存刷新失败: %r", task.exception())
+    
+    async def _load(self, key: Hashable, fetch: Callable[[], Awaitable[Any]], version: int) -> Any:
+        try:
+            value = await fetch()
+            if self._versions.get(key, 0) == version:
+                self._entries[key] = (value, time.monotonic())
+            return value
+        finally:
+            if self._pending.get(key) is asyncio.current_task():
+                del self._pending[key]
+    
+    def invalidate(self, *keys: Hashable) -> None:
+        """删除缓存条目，并丢弃进行中请求的结果"""
+        for key in keys:
+            self._entries.pop(key, None)
+            self._pending.pop(key, None)
+            self._versions[key] = self._versions.get(key, 0) + 1
+    
+    def invalidate_prefix(self, *prefix: Hashable) -> None:
+        """删除 key 以 prefix 开头的全部条目，例如某个用户的所有列表分页"""
+        keys = {
+            key for key in (*self._entries, *self._pending)
+            if key[:len(prefix)] == prefix
+        }
+        self.invalidate(*keys)
+
+
+# 闹钟详情、用户闹钟列表与人设目录的本地缓存
+cache = TTLCache(CACHE_TTL, CACHE_STALE_TTL)
+
+
+async def persona_catalog() -> Dict[str, dict]:
+    """获取人设目录 {persona_id: persona}，后端不可用时退回内置列表"""
+    try:
+        personas = await cache.get(('personas',), lambda: fetch_data("/api/personas"))
+        if personas:
+            return {persona['id']: persona for persona in personas}
+    except (ApiError, httpx.HTTPError):
+        pass
+    return {persona_id: {'id': persona_id} for persona_id in DEFAULT_PERSONAS}
+
+
+async def validate_persona(ai_persona_id: str) -> Optional[str]:
+    """校验人设ID，返回错误消息或 None"""
+    catalog = await persona_catalog()
+    if ai_persona_id not in catalog:
+        return f"错误：ai_persona_id 必须是以下之一: {', '.join(catalog)}"
+    return None
+
+
+def validate_schedule(alarm_time: Optional[str], repeat_days: Optional[str]) -> Optional[str]:
+    """校验闹钟时间与重复日期格式，返回错误消息或 None"""
+    if alarm_time:
+        try:
+            hour, minute = map(int, alarm_time.split(':'))
+            if not (0 <= hour < 24 and 0 <= minute < 60):
+                return "错误：时间格式无效，小时应在0-23之间，分钟应在0-59之间"
+        except ValueError:
+            return "错误：时间格式应为 HH:MM，例如 '08:00'"
+    
+    if repeat_days:
+        try:
+            days = [int(d.strip()) for d in repeat_days.split(',')]
+            if not all(1 <= d <= 7 for d in days):
+                return "错误：repeat_days 应包含1-7之间的数字，用逗号分隔"
+        except ValueError:
+            return "错误：repeat_days 格式无效，应为逗号分隔的数字，如 '1,2,3,4,5'"
+    
+    return None
 
 
 @mcp.tool()
-def create_alarm(
+@deadline_budget(CALL_DEADLINE)
+async def create_alarm(
     alarm_id: str,
     user_id: str,
     alarm_time: str,
@@ -57,26 +582,14 @@ def create_alarm(
     """
     try:
         # 验证 ai_persona_id
-        valid_personas = ['gentle', 'energetic', 'informative', 'humorous', 'strict']
-        if ai_persona_id not in valid_personas:
-            return f"错误：ai_persona_id 必须是以下之一: {', '.join(valid_personas)}"
+        persona_error = await validate_persona(ai_persona_id)
+        if persona_error:
+            return persona_error
         
-        # 验证时间格式
-        try:
-            hour, minute = map(int, alarm_time.split(':'))
-            if not (0 <= hour < 24 and 0 <= minute < 60):
-                return "错误：时间格式无效，小时应在0-23之间，分钟应在0-59之间"
-        except ValueError:
-            return "错误：时间格式应为 HH:MM，例如 '08:00'"
-        
-        # 验证 repeat_days 格式
-        if repeat_days:
-            try:
-                days = [int(d.strip()) for d in repeat_days.split(',')]
-                if not all(1 <= d <= 7 for d in days):
-                    return "错误：repeat_days 应包含1-7之间的数字，用逗号分隔"
-            except ValueError:
-                return "错误：repeat_days 格式无效，应为逗号分隔的数字，如 '1,2,3,4,5'"
+        # 验证时间与 repeat_days 格式
+        schedule_error = validate_schedule(alarm_time, repeat_days)
+        if schedule_error:
+            return schedule_error
         
         # 准备请求数据
         payload = {
@@ -90,16 +603,16 @@ def create_alarm(
         }
         
         # 发送 POST 请求到远程服务器 (HTTPS only)
-        response = session.post(
-            f"{API_BASE_URL}/api/alarms",
-            json=payload,
-            timeout=REQUEST_TIMEOUT,
-            verify=True  # 验证 SSL 证书
-        )
+        try:
+            response = await api_request("POST", "/api/alarms", json=payload)
+        finally:
+            # 超时或网络错误时写入可能已经生效，同样要让缓存失效
+            cache.invalidate(('alarm', alarm_id))
+            cache.invalidate_prefix('alarms', user_id)
         
-        # 检查响应
-        if response.status_code == 200:
-            result = response.json()
+        # 检查响应（服务端创建成功返回 201）
+        if response.status_code in (200, 201):
+            result = decode_body(response)
             if result.get('success'):
                 # 构造返回信息
                 repeat_info = ""
@@ -133,14 +646,15 @@ def create_alarm(
         else:
             return f"❌ 创建闹钟失败：HTTP {response.status_code} - {response.text}"
     
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return f"❌ 网络请求失败：{str(e)}"
     except Exception as e:
         return f"❌ 创建闹钟失败：{str(e)}"
 
 
 @mcp.tool()
-def get_alarm(alarm_id: str) -> str:
+@deadline_budget(CALL_DEADLINE)
+async def get_alarm(alarm_id: str) -> str:
     """
     根据ID获取闹钟详情
     
@@ -151,37 +665,33 @@ def get_alarm(alarm_id: str) -> str:
         闹钟详细信息或错误消息
     """
     try:
-        response = session.get(
-            f"{API_BASE_URL}/api/alarms/{alarm_id}",
-            timeout=REQUEST_TIMEOUT,
-            verify=True
+        alarm = await cache.get(
+            ('alarm', alarm_id),
+            lambda: fetch_data(f"/api/alarms/{alarm_id}")
         )
+        if alarm is None:
+            return f"❌ 未找到ID为 {alarm_id} 的闹钟"
         
-        if response.status_code == 200:
-            result = response.json()
-            if result.get('success'):
-                alarm = result.get('data')
-                
-                repeat_info = ""
-                if alarm.get('repeat_days'):
-                    day_names = {
-                        '1': '周一', '2': '周二', '3': '周三', 
-                        '4': '周四', '5': '周五', '6': '周六', '7': '周日'
-                    }
-                    days_list = [day_names[d.strip()] for d in alarm['repeat_days'].split(',')]
-                    repeat_info = f"\n  - 重复: {', '.join(days_list)}"
-                else:
-                    repeat_info = "\n  - 类型: 一次性闹钟"
-                
-                persona_names = {
-                    'gentle': '温柔',
-                    'energetic': '活力',
-                    'informative': '资讯',
-                    'humorous': '幽默',
-                    'strict': '严厉'
-                }
-                
-                return f"""📋 闹钟详情：
+        repeat_info = ""
+        if alarm.get('repeat_days'):
+            day_names = {
+                '1': '周一', '2': '周二', '3': '周三', 
+                '4': '周四', '5': '周五', '6': '周六', '7': '周日'
+            }
+            days_list = [day_names[d.strip()] for d in alarm['repeat_days'].split(',')]
+            repeat_info = f"\n  - 重复: {', '.join(days_list)}"
+        else:
+            repeat_info = "\n  - 类型: 一次性闹钟"
+        
+        persona_names = {
+            'gentle': '温柔',
+            'energetic': '活力',
+            'informative': '资讯',
+            'humorous': '幽默',
+            'strict': '严厉'
+        }
+        
+        return f"""📋 闹钟详情：
   - ID: {alarm.get('alarm_id')}
   - 名称: {alarm.get('alarm_name')}
   - 时间: {alarm.get('alarm_time')}
@@ -189,66 +699,63 @@ def get_alarm(alarm_id: str) -> str:
   - AI人设: {persona_names.get(alarm.get('ai_persona_id'), alarm.get('ai_persona_id'))}
   - 状态: {'✅ 已启用' if alarm.get('is_enabled') else '❌ 已禁用'}{repeat_info}
   - 创建时间: {alarm.get('created_at', '未知')}"""
-            else:
-                return f"❌ {result.get('message', '未找到闹钟')}"
-        elif response.status_code == 404:
-            return f"❌ 未找到ID为 {alarm_id} 的闹钟"
-        else:
-            return f"❌ 获取闹钟失败：HTTP {response.status_code}"
     
-    except requests.exceptions.RequestException as e:
+    except ApiError as e:
+        return f"❌ 获取闹钟失败：{str(e)}"
+    except httpx.HTTPError as e:
         return f"❌ 网络请求失败：{str(e)}"
     except Exception as e:
         return f"❌ 获取闹钟失败：{str(e)}"
 
 
 @mcp.tool()
-def list_alarms(user_id: str) -> str:
+@deadline_budget(CALL_DEADLINE)
+async def list_alarms(user_id: str, cursor: Optional[str] = None) -> str:
     """
-    获取指定用户的所有闹钟列表
+    获取指定用户的闹钟列表（分页）
     
     Args:
         user_id: 用户ID
+        cursor: 续传 token，查看下一页时传入上一页结果末尾给出的 cursor
     
     Returns:
         闹钟列表或错误消息
     """
     try:
-        response = session.get(
-            f"{API_BASE_URL}/api/alarms/user/{user_id}",
-            timeout=REQUEST_TIMEOUT,
-            verify=True
+        path = (
+            f"/api/alarms/user/{user_id}?format=text"
+            f"&max_items={LIST_MAX_ITEMS}&max_bytes={LIST_MAX_BYTES}"
         )
+        if cursor:
+            path += f"&cursor={cursor}"
+        page = await cache.get(('alarms', user_id, cursor), lambda: fetch_data(path))
         
-        if response.status_code == 200:
-            result = response.json()
-            if result.get('success'):
-                alarms = result.get('data', [])
-                
-                if not alarms:
-                    return f"📭 用户 {user_id} 还没有创建任何闹钟"
-                
-                alarm_list = f"📋 用户 {user_id} 的闹钟列表（共 {len(alarms)} 个）：\n\n"
-                
-                for i, alarm in enumerate(alarms, 1):
-                    status_icon = "✅" if alarm.get('is_enabled') else "❌"
-                    repeat_mark = "🔁" if alarm.get('repeat_days') else "1️⃣"
-                    alarm_list += f"{i}. {status_icon} {repeat_mark} {alarm.get('alarm_name')} - {alarm.get('alarm_time')} (ID: {alarm.get('alarm_id')})\n"
-                
-                return alarm_list
-            else:
-                return f"❌ {result.get('message', '获取闹钟列表失败')}"
-        else:
-            return f"❌ 获取闹钟列表失败：HTTP {response.status_code}"
+        if not page or not page.get('total'):
+            return f"📭 用户 {user_id} 还没有创建任何闹钟"
+        
+        total = page['total']
+        start = total - page['remaining'] - page['returned'] + 1
+        alarm_list = f"📋 用户 {user_id} 的闹钟列表（共 {total} 个，已启用 {page['enabled']} 个）：\n\n"
+        
+        for i, line in enumerate(page['lines'], start):
+            alarm_list += f"{i}. {line}\n"
+        
+        if page.get('next_cursor'):
+            alarm_list += f"\n…还有 {page['remaining']} 个，查看下一页请传入 cursor=\"{page['next_cursor']}\""
+        
+        return alarm_list
     
-    except requests.exceptions.RequestException as e:
+    except ApiError as e:
+        return f"❌ 获取闹钟列表失败：{str(e)}"
+    except httpx.HTTPError as e:
         return f"❌ 网络请求失败：{str(e)}"
     except Exception as e:
         return f"❌ 获取闹钟列表失败：{str(e)}"
 
 
 @mcp.tool()
-def update_alarm(
+@deadline_budget(CALL_DEADLINE)
+async def update_alarm(
     alarm_id: str,
     alarm_time: Optional[str] = None,
     alarm_name: Optional[str] = None,
@@ -271,26 +778,14 @@ def update_alarm(
         更新成功的消息
     """
     try:
-        if alarm_time:
-            try:
-                hour, minute = map(int, alarm_time.split(':'))
-                if not (0 <= hour < 24 and 0 <= minute < 60):
-                    return "错误：时间格式无效"
-            except ValueError:
-                return "错误：时间格式应为 HH:MM"
+        schedule_error = validate_schedule(alarm_time, repeat_days)
+        if schedule_error:
+            return schedule_error
         
         if ai_persona_id:
-            valid_personas = ['gentle', 'energetic', 'informative', 'humorous', 'strict']
-            if ai_persona_id not in valid_personas:
-                return f"错误：ai_persona_id 必须是以下之一: {', '.join(valid_personas)}"
-        
-        if repeat_days:
-            try:
-                days = [int(d.strip()) for d in repeat_days.split(',')]
-                if not all(1 <= d <= 7 for d in days):
-                    return "错误：repeat_days 应包含1-7之间的数字"
-            except ValueError:
-                return "错误：repeat_days 格式无效"
+            persona_error = await validate_persona(ai_persona_id)
+            if persona_error:
+                return persona_error
         
         payload = {}
         if alarm_time is not None:
@@ -307,15 +802,14 @@ def update_alarm(
         if not payload:
             return "❌ 没有提供任何要更新的字段"
         
-        response = session.put(
-            f"{API_BASE_URL}/api/alarms/{alarm_id}",
-            json=payload,
-            timeout=REQUEST_TIMEOUT,
-            verify=True
-        )
+        try:
+            response = await api_request("PUT", f"/api/alarms/{alarm_id}", json=payload)
+        finally:
+            cache.invalidate(('alarm', alarm_id))
+            cache.invalidate_prefix('alarms')
         
         if response.status_code == 200:
-            result = response.json()
+            result = decode_body(response)
             if result.get('success'):
                 return f"✅ 闹钟 {alarm_id} 更新成功！"
             else:
@@ -325,14 +819,15 @@ def update_alarm(
         else:
             return f"❌ 更新闹钟失败：HTTP {response.status_code}"
     
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return f"❌ 网络请求失败：{str(e)}"
     except Exception as e:
         return f"❌ 更新闹钟失败：{str(e)}"
 
 
 @mcp.tool()
-def delete_alarm(alarm_id: str) -> str:
+@deadline_budget(CALL_DEADLINE)
+async def delete_alarm(alarm_id: str) -> str:
     """
     删除指定的闹钟
     
@@ -343,14 +838,14 @@ def delete_alarm(alarm_id: str) -> str:
         删除成功的消息
     """
     try:
-        response = session.delete(
-            f"{API_BASE_URL}/api/alarms/{alarm_id}",
-            timeout=REQUEST_TIMEOUT,
-            verify=True
-        )
+        try:
+            response = await api_request("DELETE", f"/api/alarms/{alarm_id}")
+        finally:
+            cache.invalidate(('alarm', alarm_id))
+            cache.invalidate_prefix('alarms')
         
         if response.status_code == 200:
-            result = response.json()
+            result = decode_body(response)
             if result.get('success'):
                 return f"✅ 闹钟 {alarm_id} 已成功删除"
             else:
@@ -360,11 +855,188 @@ def delete_alarm(alarm_id: str) -> str:
         else:
             return f"❌ 删除闹钟失败：HTTP {response.status_code}"
     
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return f"❌ 网络请求失败：{str(e)}"
     except Exception as e:
         return f"❌ 删除闹钟失败：{str(e)}"
 
 
+async def send_write(method: str, path: str, payload: Optional[dict] = None) -> Optional[str]:
+    """发送写请求，成功返回 None，否则返回简短的错误原因"""
+    try:
+        response = await api_request(method, path, json=payload)
+    except httpx.HTTPError as e:
+        return f"网络请求失败：{str(e)}"
+    if response.status_code in (200, 201):
+        result = decode_body(response)
+        return None if result.get('success') else result.get('message', '未知错误')
+    if response.status_code == 404:
+        return "闹钟不存在"
+    return f"HTTP {response.status_code}"
+
+
+async def run_bulk(items: List[Any], worker: Callable[[Any], Awaitable[Optional[str]]]) -> List[Optional[str]]:
+    """以 BULK_CONCURRENCY 为上限并发执行，返回与 items 一一对应的错误列表"""
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+    
+    async def run(item):
+        async with semaphore:
+            return await worker(item)
+    
+    return await asyncio.gather(*(run(item) for item in items))
+
+
+def bulk_summary(action: str, ids: List[str], errors: List[Optional[str]]) -> str:
+    """生成批量操作的紧凑结果：一行统计，外加每个失败条目一行"""
+    succeeded = sum(1 for error in errors if error is None)
+    lines = [f"{action}：成功 {succeeded}/{len(ids)}"]
+    lines += [f"❌ {item_id}: {error}" for item_id, error in zip(ids, errors) if error]
+    return "\n".join(lines)
+
+
+def check_bulk_size(items: List[Any]) -> Optional[str]:
+    """校验批量条目数量，返回错误消息或 None"""
+    if not items:
+        return "❌ 列表为空"
+    if len(items) > BULK_MAX_ITEMS:
+        return f"❌ 单次最多处理 {BULK_MAX_ITEMS} 条，当前 {len(items)} 条"
+    return None
+
+
+@mcp.tool()
+@deadline_budget(BULK_CALL_DEADLINE)
+async def create_alarms(alarms: List[Dict[str, Any]]) -> str:
+    """
+    批量创建闹钟，适合一次性设置一周的日程
+    
+    Args:
+        alarms: 闹钟列表，每项字段与 create_alarm 参数相同：
+            alarm_id、user_id、alarm_time 必填；
+            alarm_name、ai_persona_id、repeat_days、is_enabled 可选
+    
+    Returns:
+        紧凑的汇总结果，只列出失败的条目
+    """
+    size_error = check_bulk_size(alarms)
+    if size_error:
+        return size_error
+    
+    # 先校验全部条目，任何一条不合法都不会发出请求
+    errors = []
+    seen = set()
+    for index, alarm in enumerate(alarms, 1):
+        missing = [field for field in ('alarm_id', 'user_id', 'alarm_time') if not alarm.get(field)]
+        if missing:
+            errors.append(f"第{index}项 缺少必填字段: {', '.join(missing)}")
+            continue
+        if alarm['alarm_id'] in seen:
+            errors.append(f"第{index}项 alarm_id 重复: {alarm['alarm_id']}")
+        seen.add(alarm['alarm_id'])
+        error = (
+            validate_schedule(alarm['alarm_time'], alarm.get('repeat_days'))
+            or await validate_persona(alarm.get('ai_persona_id', 'gentle'))
+        )
+        if error:
+            errors.append(f"第{index}项 ({alarm['alarm_id']}) {error}")
+    if errors:
+        return "❌ 校验失败，未创建任何闹钟：\n" + "\n".join(errors)
+    
+    async def create(alarm):
+        payload = {
+            "alarm_id": alarm['alarm_id'],
+            "user_id": alarm['user_id'],
+            "alarm_time": alarm['alarm_time'],
+            "alarm_name": alarm.get('alarm_name', "新闹钟"),
+            "ai_persona_id": alarm.get('ai_persona_id', "gentle"),
+            "repeat_days": alarm.get('repeat_days'),
+            "is_enabled": alarm.get('is_enabled', True)
+        }
+        try:
+            return await send_write("POST", "/api/alarms", payload)
+        finally:
+            cache.invalidate(('alarm', alarm['alarm_id']))
+            cache.invalidate_prefix('alarms', alarm['user_id'])
+    
+    results = await run_bulk(alarms, create)
+    return bulk_summary("批量创建闹钟", [alarm['alarm_id'] for alarm in alarms], results)
+
+
+@mcp.tool()
+@deadline_budget(BULK_CALL_DEADLINE)
+async def update_alarms(updates: List[Dict[str, Any]]) -> str:
+    """
+    批量更新闹钟
+    
+    Args:
+        updates: 更新列表，每项必须包含 alarm_id，其余字段与 update_alarm 参数相同：
+            alarm_time、alarm_name、ai_persona_id、repeat_days、is_enabled
+    
+    Returns:
+        紧凑的汇总结果，只列出失败的条目
+    """
+    size_error = check_bulk_size(updates)
+    if size_error:
+        return size_error
+    
+    fields = ('alarm_time', 'alarm_name', 'ai_persona_id', 'repeat_days', 'is_enabled')
+    errors = []
+    for index, update in enumerate(updates, 1):
+        if not update.get('alarm_id'):
+            errors.append(f"第{index}项 缺少必填字段: alarm_id")
+            continue
+        if not any(update.get(field) is not None for field in fields):
+            errors.append(f"第{index}项 ({update['alarm_id']}) 没有提供任何要更新的字段")
+            continue
+        error = validate_schedule(update.get('alarm_time'), update.get('repeat_days'))
+        if not error and update.get('ai_persona_id'):
+            error = await validate_persona(update['ai_persona_id'])
+        if error:
+            errors.append(f"第{index}项 ({update['alarm_id']}) {error}")
+    if errors:
+        return "❌ 校验失败，未更新任何闹钟：\n" + "\n".join(errors)
+    
+    async def apply(update):
+        payload = {field: update[field] for field in fields if update.get(field) is not None}
+        try:
+            return await send_write("PUT", f"/api/alarms/{update['alarm_id']}", payload)
+        finally:
+            cache.invalidate(('alarm', update['alarm_id']))
+    
+    try:
+        results = await run_bulk(updates, apply)
+    finally:
+        cache.invalidate_prefix('alarms')
+    return bulk_summary("批量更新闹钟", [update['alarm_id'] for update in updates], results)
+
+
+@mcp.tool()
+@deadline_budget(BULK_CALL_DEADLINE)
+async def delete_alarms(alarm_ids: List[str]) -> str:
+    """
+    批量删除闹钟
+    
+    Args:
+        alarm_ids: 要删除的闹钟ID列表
+    
+    Returns:
+        紧凑的汇总结果，只列出失败的条目
+    """
+    size_error = check_bulk_size(alarm_ids)
+    if size_error:
+        return size_error
+    
+    async def delete(alarm_id):
+        try:
+            return await send_write("DELETE", f"/api/alarms/{alarm_id}")
+        finally:
+            cache.invalidate(('alarm', alarm_id))
+    
+    try:
+        results = await run_bulk(alarm_ids, delete)
+    finally:
+        cache.invalidate_prefix('alarms')
+    return bulk_summary("批量删除闹钟", alarm_ids, results)
+
+
 if __name__ == "__main__":
     mcp.run()
\ No newline at end of file
@@ -0,0 +1,341 @@
+"""
+准入控制与过载保护
+
+- 按 API Key / 客户端 IP 的令牌桶限流，超限返回 429。只认服务端配置的 API Key (API_KEYS)；
+  请求里的 user_id 与未知的 Key 由调用方随意填写，换一个就能绕开限流，因此不作为限流 key。
+  部署在反向代理之后时由 PROXY_FIX_HOPS 还原真实客户端 IP，否则所有客户端共用代理的一个桶
+- 隔离舱 (bulkhead)：核心读取、普通读取、写入、搜索、管理/导出各有独立的并发名额、
+  排队队列与数据库连接配额，一类请求堆积（例如人设搜索的 LIKE 扫描、全表导出）
+  只会让这一类排队或被拒绝，不会占满其他类的名额
+- 预计排队时间超过延迟目标或队列已满时直接拒绝，返回 503 而不是堆积请求
+"""
+import hmac
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+from flask import g
+from config import Config
+from database import ConnectionQuota, Database
+
+
+# 请求类别
+CRITICAL = 'critical'  # 叫醒路径上的读取：单个闹钟、人设、音频
+READ = 'read'  # 其他读取：启动数据、人设列表、同步对账
+WRITE = 'write'
+SEARCH = 'search'  # 人设搜索
+ADMIN = 'admin'  # 管理接口与全表导出
+# 长连接推送只限流，不占用并发名额
+STREAM = 'stream'
+
+# 各类别占 DB_POOL_SIZE 的份额：(并发名额, 数据库连接配额)，各自合计不超过 1，互不挤占。
+# 连接配额高于并发名额的类别，单个请求可能并行使用多个连接（例如 /api/bootstrap）
+BULKHEAD_SHARES = {
+    CRITICAL: (0.35, 0.35),
+    READ: (0.15, 0.2),
+    WRITE: (0.2, 0.2),
+    SEARCH: (0.15, 0.15),
+    ADMIN: (0.1, 0.1)
+}
+
+# 每类最多排队的请求数为并发名额的倍数，避免一类请求占住所有工作线程
+QUEUE_FACTOR = 2
+# 每类保留的延迟样本数，用于计算分位数
+LATENCY_SAMPLES = 1024
+
+# 不受准入控制的路径前缀（健康检查与 Swagger 文档）
+EXEMPT_PREFIXES = ('/health', '/apidocs', '/apispec', '/flasgger_static')
+
+
+class TokenBucket:
+    """令牌桶"""
+
+    def __init__(self, rate: float, burst: float):
+        """
+        :param rate: 每秒补充的令牌数
+        :param burst: 桶容量
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def try_acquire(self, now: float, count: float = 1) -> Tuple[bool, float]:
+        """
+        尝试取出令牌
+        :param now: 当前单调时间
+        :param count: 需要的令牌数，不应超过桶容量
+        :return: (是否成功, 需要等待的秒数)
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= count:
+            self.tokens -= count
+            return True, 0.0
+        return False, (count - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """按 key 分桶的限流器，只保留最近活跃的 max_keys 个桶"""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.rejected = 0
+
+    def try_acquire(self, key: str) -> Tuple[bool, float]:
+        """
+        :param key: 限流 key
+        :return: (是否放行, 建议重试秒数)
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            allowed, wait = bucket.try_acquire(time.monotonic())
+            if not allowed:
+                self.rejected += 1
+            return allowed, wait
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Bulkhead:
+    """一类请求的隔离舱：独立的并发名额、有界排队队列与数据库连接配额"""
+
+    def __init__(self, name: str, capacity: int, connections: int, latency_target: float):
+        """
+        :param name: 类别
+        :param capacity: 最大并发数
+        :param connections: 可同时占用的数据库连接数
+        :param latency_target: 可接受的最长排队秒数
+        """
+        self.name = name
+        self.capacity = capacity
+        self.max_queue = capacity * QUEUE_FACTOR
+        self.latency_target = latency_target
+        self.connections = ConnectionQuota(name, connections)
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        # 请求平均耗时的指数移动平均，用于估算排队时间
+        self.avg_service_time = 0.05
+        self.queue_times: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.service_times: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def acquire(self) -> Optional[float]:
+        """
+        获取执行名额
+        :return: None 表示成功，否则为建议的重试秒数
+        """
+        started = time.monotonic()
+        deadline = started + self.latency_target
+        with self._cond:
+            if self.active >= self.capacity:
+                # 队列已满或预计排队时间超过目标时不再排队，直接拒绝
+                expected_wait = (self.waiting + 1) * self.avg_service_time / self.capacity
+                if self.waiting >= self.max_queue or expected_wait > self.latency_target:
+                    self.shed += 1
+                    return max(expected_wait, 1.0)
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+            try:
+                while self.active >= self.capacity:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.shed += 1
+                        return max(self.latency_target, 1.0)
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+            self.queue_times.append(time.monotonic() - started)
+            return None
+
+    def release(self, elapsed: float) -> None:
+        """
+        归还执行名额
+        :param elapsed: 本次请求耗时（秒）
+        """
+        with self._cond:
+            self.active -= 1
+            self.avg_service_time = 0.9 * self.avg_service_time + 0.1 * elapsed
+            self.service_times.append(elapsed)
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, object]:
+        """并发、排队深度与延迟统计（毫秒）"""
+        with self._cond:
+            queue_times = list(self.queue_times)
+            service_times = list(self.service_times)
+            data = {
+                'capacity': self.capacity,
+                'active': self.active,
+                'waiting': self.waiting,
+                'peak_waiting': self.peak_waiting,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'shed': self.shed,
+                'avg_service_time': round(self.avg_service_time, 4)
+            }
+        data['queue_ms'] = {
+            'p50': round(_percentile(queue_times, 0.5) * 1000, 1),
+            'p95': round(_percentile(queue_times, 0.95) * 1000, 1)
+        }
+        data['service_ms'] = {
+            'p50': round(_percentile(service_times, 0.5) * 1000, 1),
+            'p95': round(_percentile(service_times, 0.95) * 1000, 1),
+            'p99': round(_percentile(service_times, 0.99) * 1000, 1)
+        }
+        data['connections'] = self.connections.stats()
+        return data
+
+
+rate_limiter = RateLimiter(Config.RATE_LIMIT_PER_SECOND, Config.RATE_LIMIT_BURST)
+bulkheads = {
+    name: Bulkhead(
+        name,
+        max(1, int(Config.DB_POOL_SIZE * execution_share)),
+        max(1, int(Config.DB_POOL_SIZE * connection_share)),
+        Config.ADMISSION_LATENCY_TARGET
+    )
+    for name, (execution_share, connection_share) in BULKHEAD_SHARES.items()
+}
+
+
+def classify(request) -> Optional[str]:
+    """
+    判断请求类别
+    :param request: Flask 请求对象
+    :return: 类别，None 表示不受准入控制
+    """
+    path = request.path
+    if path.startswith(EXEMPT_PREFIXES):
+        return None
+    if path == '/api/alarms/stream':
+        return STREAM
+    if path.startswith('/api/admin'):
+        return ADMIN
+    if request.method == 'GET':
+        if path == '/api/personas':
+            return SEARCH if request.args.get('search', '').strip() else READ
+        if path == '/api/alarms':
+            # 不带 user_id 的查询是全表导出
+            return CRITICAL if request.args.get('user_id') else ADMIN
+        if path.startswith(('/api/alarms/', '/api/personas/', '/api/audio/')):
+            return CRITICAL
+        return READ
+    if path == '/api/sync':
+        # 对账只读取摘要
+        return READ
+    return WRITE
+
+
+def parse_api_keys(value: str) -> Dict[str, str]:
+    """
+    解析 API_KEYS 配置
+    :param value: 形如 "mcp=密钥1,ops=密钥2"
+    :return: {名称: 密钥}
+    :raises ValueError: 格式错误
+    """
+    keys = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, sep, secret = item.partition('=')
+        if not sep or not name.strip() or not secret.strip():
+            raise ValueError(f"API_KEYS 格式错误: {item!r}，应为 名称=密钥")
+        keys[name.strip()] = secret.strip()
+    return keys
+
+
+api_keys = parse_api_keys(Config.API_KEYS)
+
+
+def api_key_name(api_key: str) -> Optional[str]:
+    """校验 X-API-Key，返回对应的名称；逐个做常量时间比较，不泄露匹配到第几位"""
+    matched = None
+    for name, secret in api_keys.items():
+        if hmac.compare_digest(api_key.encode('utf-8'), secret.encode('utf-8')):
+            matched = name
+    return matched
+
+
+def client_key(request) -> str:
+    """
+    限流与幂等键的作用域：服务端认可的 API Key，其次是客户端 IP
+    （PROXY_FIX_HOPS 配置正确时 remote_addr 是经过反向代理还原的真实地址）
+    """
+    api_key = request.headers.get('X-API-Key')
+    if api_key:
+        name = api_key_name(api_key)
+        if name is not None:
+            return f'key:{name}'
+    return f'ip:{request.remote_addr}'
+
+
+def admit(request) -> Optional[Tuple[str, int, int]]:
+    """
+    对请求执行限流与所属隔离舱的并发控制
+    :param request: Flask 请求对象
+    :return: None 表示放行，否则为 (错误信息, 状态码, Retry-After 秒数)
+    """
+    category = classify(request)
+    if category is None:
+        return None
+
+    allowed, wait = rate_limiter.try_acquire(client_key(request))
+    if not allowed:
+        return "请求过于频繁，请稍后重试", 429, math.ceil(wait)
+    if category == STREAM:
+        return None
+
+    bulkhead = bulkheads[category]
+    retry_after = bulkhead.acquire()
+    if retry_after is not None:
+        return "服务繁忙，请稍后重试", 503, math.ceil(retry_after)
+
+    g.admission_bulkhead = bulkhead
+    g.admission_started_at = time.monotonic()
+    # 请求内（包括 copy_context 派生的线程）建立的数据库连接计入本类配额
+    g.connection_quota_token = Database.set_connection_quota(bulkhead.connections)
+    return None
+
+
+def release() -> None:
+    """请求结束时归还并发名额"""
+    token = g.pop('connection_quota_token', None)
+    if token is not None:
+        Database.reset_connection_quota(token)
+    bulkhead = g.pop('admission_bulkhead', None)
+    started_at = g.pop('admission_started_at', None)
+    if bulkhead is not None and started_at is not None:
+        bulkhead.release(time.monotonic() - started_at)
+
+
+def stats() -> Dict[str, object]:
+    """准入控制统计，按隔离舱分列"""
+    return {
+        'capacity': Config.DB_POOL_SIZE,
+        'active': sum(bulkhead.active for bulkhead in bulkheads.values()),
+        'waiting': sum(bulkhead.waiting for bulkhead in bulkheads.values()),
+        'shed': {name: bulkhead.shed for name, bulkhead in bulkheads.items()},
+        'bulkheads': {name: bulkhead.stats() for name, bulkhead in bulkheads.items()},
+        'rate_limited': rate_limiter.rejected
+    }
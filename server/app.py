@@ -1,12 +1,28 @@
 """
 Flask REST API 服务
 """
-from flask import Flask, request, jsonify
+from datetime import datetime, timedelta, timezone
+from flask import Flask, Response, g, request, jsonify, send_file
 from flask_cors import CORS
 from flasgger import Swagger
+from werkzeug.middleware.proxy_fix import ProxyFix
+from audio_cache import is_cacheable, opening_audio
 from config import Config
-from dao import AlarmDAO, AIPersonaDAO
-from models import Alarm, AIPersona
+from database import Database
+from dao import AlarmDAO, AIPersonaDAO, DeviceTokenDAO, alarm_cache, persona_flight
+from events import change_feed
+from idempotency import idempotency_store
+from models import Alarm, AIPersona, DeviceToken, PUSH_PROVIDERS
+import admission
+import bootstrap
+import codec
+import forecast
+import idempotency
+import listing
+import prompts
+import sync
+import functools
+import json
 import traceback
 
 
@@ -14,26 +30,168 @@ app = Flask(__name__)
 app.config.from_object(Config)
 CORS(app)  # 允许跨域请求
 
+# 部署在反向代理之后时按 X-Forwarded-* 还原客户端地址，限流才能区分客户端
+if Config.PROXY_FIX_HOPS:
+    app.wsgi_app = ProxyFix(
+        app.wsgi_app,
+        x_for=Config.PROXY_FIX_HOPS,
+        x_proto=Config.PROXY_FIX_HOPS,
+        x_host=Config.PROXY_FIX_HOPS
+    )
+
 # 初始化 Swagger
 swagger = Swagger(app)
 
 
+def response_media_type():
+    """当前请求的响应格式，按 Accept 协商（JSON / MessagePack / CBOR）"""
+    media_type = g.get('response_media_type')
+    if media_type is None:
+        media_type = g.response_media_type = codec.negotiate(request.accept_mimetypes)
+    return media_type
+
+
+def api_response(payload, status_code):
+    """按协商的格式编码响应信封"""
+    media_type = response_media_type()
+    if media_type == codec.JSON:
+        response = jsonify(payload)
+    else:
+        response = app.response_class(codec.encode(payload, media_type), mimetype=media_type)
+    response.vary.add('Accept')
+    return response, status_code
+
+
+def as_media_type(response, media_type):
+    """把 JSON 响应转换为指定格式"""
+    if media_type != codec.JSON and response.mimetype == codec.JSON:
+        response.set_data(codec.encode(json.loads(response.get_data()), media_type))
+        response.mimetype = media_type
+        response.vary.add('Accept')
+    return response
+
+
 def success_response(data=None, message="操作成功", status_code=200):
     """成功响应"""
-    return jsonify({
+    return api_response({
         'success': True,
         'message': message,
         'data': data
-    }), status_code
+    }, status_code)
 
 
 def error_response(message="操作失败", status_code=400):
     """错误响应"""
-    return jsonify({
+    return api_response({
         'success': False,
         'message': message,
         'data': None
-    }), status_code
+    }, status_code)
+
+
+def idempotent(view):
+    """
+    支持 Idempotency-Key 的写接口：相同 key 的重试返回首次执行的响应，进行中的重试等待其完成
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(idempotency.HEADER)
+        if key is None:
+            return view(*args, **kwargs)
+        if not key or len(key) > idempotency.MAX_KEY_LENGTH:
+            return error_response(f"{idempotency.HEADER} 长度须为 1-{idempotency.MAX_KEY_LENGTH} 个字符")
+
+        key = f'{admission.client_key(request)}:{key}'
+        fingerprint = idempotency.request_fingerprint(request.method, request.path, request.get_data())
+        media_type = response_media_type()
+        state, stored = idempotency_store.begin(key, fingerprint)
+        if state == idempotency.REPLAY:
+            response = app.response_class(stored.body, status=stored.status_code, headers=stored.headers)
+            response.headers[idempotency.REPLAYED_HEADER] = 'true'
+            return as_media_type(response, media_type)
+        if state == idempotency.MISMATCH:
+            return error_response(f"{idempotency.HEADER} 已用于内容不同的请求", 422)
+        if state == idempotency.IN_PROGRESS:
+            response, status_code = error_response("相同请求仍在处理中，请稍后重试", 409)
+            response.headers['Retry-After'] = '1'
+            return response, status_code
+
+        # 以 JSON 保存，重试时再按各自的 Accept 转换
+        g.response_media_type = codec.JSON
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except BaseException:
+            idempotency_store.abandon(key)
+            raise
+        finally:
+            g.response_media_type = media_type
+        headers = [(name, value) for name, value in response.headers.items() if name != 'Content-Length']
+        idempotency_store.complete(
+            key,
+            idempotency.StoredResponse(response.status_code, headers, response.get_data(), fingerprint)
+        )
+        return as_media_type(response, media_type)
+    return wrapper
+
+
+@app.before_request
+def admission_control():
+    """限流与过载保护，超限时快速失败并携带 Retry-After"""
+    rejection = admission.admit(request)
+    if rejection:
+        message, status_code, retry_after = rejection
+        response, status_code = error_response(message, status_code)
+        response.headers['Retry-After'] = str(retry_after)
+        return response, status_code
+
+
+@app.teardown_request
+def admission_release(error):
+    """归还并发名额"""
+    admission.release()
+
+
+@app.before_request
+def open_db_session():
+    """请求内的 DAO 调用共用一个数据库连接，首次查询时才建立"""
+    g.db_session = Database.open_session()
+
+
+@app.teardown_request
+def close_db_session(error):
+    """归还请求的数据库连接"""
+    Database.close_session(g.pop('db_session', None))
+
+
+@app.before_request
+def start_deadline():
+    """请求内数据库调用的总时限，客户端可通过 X-Request-Timeout（秒）缩短；推送长连接不设时限"""
+    if admission.classify(request) == admission.STREAM:
+        return
+    budget = Config.REQUEST_DEADLINE
+    try:
+        requested = float(request.headers.get('X-Request-Timeout', ''))
+        if requested > 0:
+            budget = min(budget, requested)
+    except ValueError:
+        pass
+    g.deadline_token = Database.set_deadline(budget)
+
+
+@app.after_request
+def deadline_status(response):
+    """因查询时限失败的请求返回 504，而不是普通的 500"""
+    deadline = Database.current_deadline()
+    if deadline is not None and deadline.exceeded and response.status_code == 500:
+        response.status_code = 504
+    return response
+
+
+@app.teardown_request
+def reset_deadline(error):
+    token = g.pop('deadline_token', None)
+    if token is not None:
+        Database.reset_deadline(token)
 
 
 @app.route('/health', methods=['GET'])
@@ -61,7 +219,83 @@ def health_check():
     return success_response(message="服务运行正常")
 
 
+@app.route('/api/bootstrap', methods=['GET'])
+def get_bootstrap():
+    """
+    应用启动数据
+    一次返回用户的闹钟、闹钟引用到的人设摘要、下一个闹钟、服务器时间与变更流游标，
+    闹钟与人设查询并行执行
+    ---
+    tags:
+      - 系统
+    parameters:
+      - in: query
+        name: user_id
+        type: string
+        required: true
+        description: 用户ID
+        example: "user_123"
+    responses:
+      200:
+        description: 获取成功
+        schema:
+          type: object
+          properties:
+            success:
+              type: boolean
+              example: true
+            data:
+              type: object
+              properties:
+                server_time:
+                  type: string
+                  example: "2025-10-13T06:58:12.345678+08:00"
+                utc_offset_minutes:
+                  type: integer
+                  example: 480
+                cursor:
+                  type: integer
+                  description: 变更流游标，可作为 /api/alarms/stream 的 cursor 参数
+                  example: 1024
+                alarms:
+                  type: array
+                  items:
+                    type: object
+                personas:
+                  type: array
+                  description: 人设摘要（不含提示词正文），prompt_hash 变化时再获取完整人设
+                  items:
+                    type: object
+                next_alarm:
+                  type: object
+                  properties:
+                    alarm_id:
+                      type: string
+                      example: "alarm_001"
+                    fire_at:
+                      type: string
+                      example: "2025-10-13T07:30:00+08:00"
+                    in_seconds:
+                      type: integer
+                      example: 1907
+      400:
+        description: 缺少 user_id
+      500:
+        description: 服务器内部错误
+    """
+    try:
+        user_id = request.args.get('user_id')
+        if not user_id:
+            return error_response("缺少必填参数: user_id")
+        return success_response(data=bootstrap.build_bootstrap(user_id))
+
+    except Exception as e:
+        print(f"获取启动数据错误: {traceback.format_exc()}")
+        return error_response(f"获取失败: {str(e)}", 500)
+
+
 @app.route('/api/alarms', methods=['POST'])
+@idempotent
 def create_alarm():
     """
     创建新闹钟
@@ -69,6 +303,11 @@ def create_alarm():
     tags:
       - 闹钟管理
     parameters:
+      - in: header
+        name: Idempotency-Key
+        type: string
+        required: false
+        description: 幂等键，重试时沿用同一值，24 小时内返回首次执行的响应
       - in: body
         name: alarm
         description: 闹钟信息
@@ -145,6 +384,10 @@ def create_alarm():
               example: "缺少必填字段: alarm_id"
             data:
               type: null
+      409:
+        description: 闹钟ID已存在，或相同幂等键的请求仍在处理中
+      422:
+        description: 幂等键已用于内容不同的请求
       500:
         description: 服务器内部错误
     """
@@ -167,6 +410,8 @@ def create_alarm():
         )
         
     except Exception as e:
+        if Database.is_duplicate_entry(e):
+            return error_response("闹钟ID已存在", 409)
         print(f"创建闹钟错误: {traceback.format_exc()}")
         return error_response(f"创建失败: {str(e)}", 500)
 
@@ -351,6 +596,183 @@ def get_alarms():
         return error_response(f"获取失败: {str(e)}", 500)
 
 
+@app.route('/api/alarms/user/<string:user_id>', methods=['GET'])
+def get_user_alarms_compact(user_id):
+    """
+    获取用户闹钟的紧凑分页列表（面向 LLM 工具）
+    ---
+    tags:
+      - 闹钟管理
+    parameters:
+      - in: path
+        name: user_id
+        type: string
+        required: true
+        description: 用户ID
+        example: "user_123"
+      - in: query
+        name: format
+        type: string
+        enum: [columns, text]
+        default: columns
+        description: columns 返回列名 + 行数组；text 返回预渲染的单行文本
+      - in: query
+        name: max_items
+        type: integer
+        default: 50
+        description: 本页最多条数 (上限 200)
+      - in: query
+        name: max_bytes
+        type: integer
+        default: 8192
+        description: 本页条目的最大字节数 (上限 65536)，至少返回一条
+      - in: query
+        name: cursor
+        type: string
+        required: false
+        description: 上一页返回的 next_cursor
+    responses:
+      200:
+        description: 获取成功
+        schema:
+          type: object
+          properties:
+            success:
+              type: boolean
+              example: true
+            message:
+              type: string
+              example: "操作成功"
+            data:
+              type: object
+              properties:
+                total:
+                  type: integer
+                  example: 3
+                enabled:
+                  type: integer
+                  example: 2
+                returned:
+                  type: integer
+                  example: 3
+                remaining:
+                  type: integer
+                  example: 0
+                next_cursor:
+                  type: string
+                  example: null
+                columns:
+                  type: array
+                  items:
+                    type: string
+                  example: ["alarm_id", "alarm_name", "alarm_time", "ai_persona_id", "repeat_days", "is_enabled"]
+                rows:
+                  type: array
+                  items:
+                    type: array
+                  example: [["550e8400-...", "早晨闹钟", "07:00", "gentle", "1,2,3,4,5", 1]]
+      400:
+        description: 请求参数错误
+      500:
+        description: 服务器内部错误
+    """
+    try:
+        fmt = request.args.get('format', 'columns')
+        if fmt not in listing.FORMATS:
+            return error_response(f"format 必须是以下之一: {', '.join(listing.FORMATS)}")
+        try:
+            max_items = int(request.args.get('max_items', listing.DEFAULT_MAX_ITEMS))
+            max_bytes = int(request.args.get('max_bytes', listing.DEFAULT_MAX_BYTES))
+        except ValueError:
+            return error_response("max_items 和 max_bytes 必须是整数")
+        max_items = min(max(max_items, 1), listing.MAX_ITEMS_LIMIT)
+        max_bytes = min(max(max_bytes, 1), listing.MAX_BYTES_LIMIT)
+
+        alarms = AlarmDAO.get_by_user(user_id)
+        try:
+            data = listing.build_page(alarms, fmt, request.args.get('cursor'), max_items, max_bytes)
+        except ValueError as e:
+            return error_response(str(e))
+        return success_response(data=data)
+
+    except Exception as e:
+        print(f"获取紧凑闹钟列表错误: {traceback.format_exc()}")
+        return error_response(f"获取失败: {str(e)}", 500)
+
+
+@app.route('/api/alarms/stream', methods=['GET'])
+def stream_alarm_changes():
+    """
+    订阅闹钟与人设变更 (Server-Sent Events)
+    ---
+    tags:
+      - 闹钟管理
+    produces:
+      - text/event-stream
+    parameters:
+      - in: query
+        name: user_id
+        type: string
+        required: true
+        description: 用户ID
+        example: "user_123"
+      - in: query
+        name: cursor
+        type: integer
+        required: false
+        description: 从该游标之后续传，也可通过 Last-Event-ID 请求头传入
+      - in: header
+        name: Last-Event-ID
+        type: string
+        required: false
+        description: 断线重连时由浏览器/客户端自动携带
+    responses:
+      200:
+        description: |
+          事件流。事件类型: ready (连接建立, id 为当前游标), alarm, persona,
+          reset (游标已失效, 客户端需全量同步)。空闲时每隔 STREAM_HEARTBEAT 秒发送心跳注释。
+      400:
+        description: 请求参数错误
+    """
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return error_response("缺少必填参数: user_id")
+
+    cursor_arg = request.headers.get('Last-Event-ID') or request.args.get('cursor')
+    try:
+        cursor = int(cursor_arg) if cursor_arg else change_feed.cursor
+    except ValueError:
+        return error_response("cursor 格式无效")
+
+    def sse(event, event_id, data):
+        return f"event: {event}\nid: {event_id}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    def generate(cursor):
+        waiter = change_feed.subscribe(user_id)
+        try:
+            yield f"retry: {int(Config.STREAM_HEARTBEAT * 1000)}\n"
+            yield sse('ready', cursor, {'cursor': cursor})
+            while True:
+                # 先清除再读取，读取之后发布的事件会重新置位，不会丢失唤醒
+                waiter.clear()
+                events, latest, reset = change_feed.read(user_id, cursor)
+                if reset:
+                    yield sse('reset', latest, {'cursor': latest})
+                for seq, payload in events:
+                    yield sse(payload['entity'], seq, payload)
+                cursor = latest
+                if not waiter.wait(Config.STREAM_HEARTBEAT):
+                    yield ": heartbeat\n\n"
+        finally:
+            change_feed.unsubscribe(user_id, waiter)
+
+    return Response(
+        generate(cursor),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/api/alarms/<string:alarm_id>', methods=['PUT'])
 def update_alarm(alarm_id):
     """
@@ -430,16 +852,17 @@ def update_alarm(alarm_id):
     try:
         data = request.get_json()
         
-        # 检查闹钟是否存在
-        existing_alarm = AlarmDAO.get_by_id(alarm_id)
-        if not existing_alarm:
-            return error_response("闹钟不存在", 404)
-        
-        # 更新数据
-        data['alarm_id'] = alarm_id
-        alarm = Alarm.from_dict(data)
-        
-        success = AlarmDAO.update(alarm)
+        # 检查与更新在同一事务中，期间闹钟不会被删除或修改
+        with Database.transaction():
+            existing_alarm = AlarmDAO.get_for_update(alarm_id)
+            if not existing_alarm:
+                return error_response("闹钟不存在", 404)
+            
+            # 更新数据
+            data['alarm_id'] = alarm_id
+            alarm = Alarm.from_dict(data)
+            
+            success = AlarmDAO.update(alarm)
         if success:
             return success_response(message="闹钟更新成功")
         else:
@@ -579,6 +1002,159 @@ def toggle_alarm(alarm_id):
         return error_response(f"操作失败: {str(e)}", 500)
 
 
+@app.route('/api/alarms/<string:alarm_id>/directive', methods=['GET'])
+def get_alarm_directive(alarm_id):
+    """
+    渲染闹钟接听后发送给 AI 的完整指示词
+    闹钟上下文 + 人设提示词 + 开场白建议 + 音色提示，格式与客户端 ALARM_CONTEXT_FLOW.md 一致。
+    人设部分使用预编译并缓存的模板，每次只格式化闹钟上下文。
+    ---
+    tags:
+      - 闹钟管理
+    parameters:
+      - in: path
+        name: alarm_id
+        type: string
+        required: true
+        description: 闹钟ID
+        example: "alarm_001"
+      - in: query
+        name: at
+        type: string
+        required: false
+        description: 到点时间 (ISO 8601)，不带时区时按 ALARM_UTC_OFFSET_MINUTES 解释，默认当前时间
+        example: "2025-10-13T07:30:00+08:00"
+    responses:
+      200:
+        description: 渲染成功
+        schema:
+          type: object
+          properties:
+            success:
+              type: boolean
+              example: true
+            data:
+              type: object
+              properties:
+                directive:
+                  type: string
+                  example: "【闹钟上下文信息】\n当前时间：2025年10月13日 周一 07:30\n..."
+                chars:
+                  type: integer
+                  example: 326
+                tokens:
+                  type: integer
+                  description: 估算的 token 数
+                  example: 245
+                persona_id:
+                  type: string
+                  example: "gentle"
+                persona_version:
+                  type: string
+                  description: 人设内容指纹，人设未变化时保持不变
+                  example: "9c1d2e3f4a5b"
+                voice_id:
+                  type: string
+                  example: "nova"
+                fire_at:
+                  type: string
+                  example: "2025-10-13T07:30:00+08:00"
+      400:
+        description: at 参数格式错误
+      404:
+        description: 闹钟不存在
+      500:
+        description: 服务器内部错误
+    """
+    try:
+        tz = timezone(timedelta(minutes=Config.ALARM_UTC_OFFSET_MINUTES))
+        at = request.args.get('at')
+        if at:
+            try:
+                fire_at = datetime.fromisoformat(at)
+            except ValueError:
+                return error_response("at 参数格式错误，应为 ISO 8601 时间", 400)
+            fire_at = fire_at.astimezone(tz) if fire_at.tzinfo else fire_at.replace(tzinfo=tz)
+        else:
+            fire_at = datetime.now(tz)
+
+        alarm = AlarmDAO.get_by_id(alarm_id)
+        if not alarm:
+            return error_response("闹钟不存在", 404)
+
+        template = prompts.persona_templates.get(alarm.ai_persona_id or 'gentle', AIPersonaDAO.get_by_id)
+        data = prompts.render_directive(alarm, template, fire_at).to_dict()
+        data['fire_at'] = fire_at.isoformat()
+        return success_response(data=data)
+
+    except Exception as e:
+        print(f"渲染指示词错误: {traceback.format_exc()}")
+        return error_response(f"渲染失败: {str(e)}", 500)
+
+
+@app.route('/api/sync', methods=['POST'])
+def sync_alarms():
+    """
+    基于摘要的闹钟同步对账
+    客户端只上报 {alarm_id: 内容指纹, 版本}，服务端返回客户端缺少的闹钟与需要上传/删除的ID。
+    闹钟较多时可先上报分桶摘要（不带 alarms），再只上报摘要不同的桶内闹钟（scope）。
+    指纹与分桶规则见 README。
+    ---
+    tags:
+      - 闹钟管理
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - user_id
+          properties:
+            user_id:
+              type: string
+              example: "user_123"
+            bucket_count:
+              type: integer
+              description: 分桶数，默认 SYNC_BUCKETS
+              example: 256
+            buckets:
+              type: object
+              description: "第一步：{桶号: 桶摘要}，只需包含非空桶"
+              example: {"17": "a1b2c3d4e5f60718"}
+            scope:
+              type: array
+              description: 第二步：只对账这些桶
+              items:
+                type: integer
+              example: [17]
+            alarms:
+              type: object
+              description: "{alarm_id: {hash, version, dirty}}，version 为本地副本基于的服务端版本，新建为 0"
+              example: {"alarm_001": {"hash": "913dc84d37e124ef", "version": 3, "dirty": false}}
+    responses:
+      200:
+        description: |
+          带 buckets 时返回 mismatched_buckets；带 alarms 时返回 download（完整闹钟）、
+          upload_ids、delete_ids、conflict_ids、versions、in_sync、compared，以及变更流游标 cursor
+      400:
+        description: 请求参数错误
+      500:
+        description: 服务器内部错误
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not data.get('user_id'):
+            return error_response("缺少必填参数: user_id")
+        return success_response(data=sync.sync(data['user_id'], data))
+
+    except ValueError as e:
+        return error_response(str(e))
+    except Exception as e:
+        print(f"同步对账错误: {traceback.format_exc()}")
+        return error_response(f"同步失败: {str(e)}", 500)
+
+
 # ====================
 # AI人设管理 API
 # ====================
@@ -701,6 +1277,7 @@ def get_persona(persona_id):
 
 
 @app.route('/api/personas', methods=['POST'])
+@idempotent
 def create_persona():
     """
     创建AI人设
@@ -708,6 +1285,11 @@ def create_persona():
     tags:
       - AI人设管理
     parameters:
+      - in: header
+        name: Idempotency-Key
+        type: string
+        required: false
+        description: 幂等键，重试时沿用同一值，24 小时内返回首次执行的响应
       - in: body
         name: persona
         description: AI人设信息
@@ -769,7 +1351,11 @@ def create_persona():
                   type: string
                   example: "custom_001"
       400:
-        description: 请求参数错误
+        description: 请求参数错误或人设 ID已存在
+      409:
+        description: 相同幂等键的请求仍在处理中
+      422:
+        description: 幂等键已用于内容不同的请求
       500:
         description: 服务器内部错误
     """
@@ -782,11 +1368,6 @@ def create_persona():
             if field not in data:
                 return error_response(f"缺少必填字段: {field}")
         
-        # 检查人设 ID是否已存在
-        existing = AIPersonaDAO.get_by_id(data['id'])
-        if existing:
-            return error_response("人设 ID已存在", 400)
-        
         persona = AIPersona.from_dict(data)
         persona_id = AIPersonaDAO.create(persona)
         
@@ -797,6 +1378,9 @@ def create_persona():
         )
         
     except Exception as e:
+        # 由主键约束判断重复，不再预先查询
+        if Database.is_duplicate_entry(e):
+            return error_response("人设 ID已存在", 400)
         print(f"创建AI人设错误: {traceback.format_exc()}")
         return error_response(f"创建失败: {str(e)}", 500)
 
@@ -859,16 +1443,17 @@ def update_persona(persona_id):
     try:
         data = request.get_json()
         
-        # 检查人设是否存在
-        existing_persona = AIPersonaDAO.get_by_id(persona_id)
-        if not existing_persona:
-            return error_response("AI人设不存在", 404)
-        
-        # 更新数据
-        data['id'] = persona_id
-        persona = AIPersona.from_dict(data)
-        
-        success = AIPersonaDAO.update(persona)
+        # 检查与更新在同一事务中
+        with Database.transaction():
+            existing_persona = AIPersonaDAO.get_for_update(persona_id)
+            if not existing_persona:
+                return error_response("AI人设不存在", 404)
+            
+            # 更新数据
+            data['id'] = persona_id
+            persona = AIPersona.from_dict(data)
+            
+            success = AIPersonaDAO.update(persona)
         if success:
             return success_response(message="AI人设更新成功")
         else:
@@ -902,12 +1487,13 @@ def delete_persona(persona_id):
         description: 服务器内部错误
     """
     try:
-        # 防止删除默认人设
-        persona = AIPersonaDAO.get_by_id(persona_id)
-        if persona and persona.is_default:
-            return error_response("不能删除默认AI人设", 400)
-        
-        success = AIPersonaDAO.delete(persona_id)
+        # 防止删除默认人设，检查与删除在同一事务中
+        with Database.transaction():
+            persona = AIPersonaDAO.get_for_update(persona_id)
+            if persona and persona.is_default:
+                return error_response("不能删除默认AI人设", 400)
+            
+            success = AIPersonaDAO.delete(persona_id)
         if success:
             return success_response(message="AI人设删除成功")
         else:
@@ -969,6 +1555,436 @@ def toggle_persona(persona_id):
         return error_response(f"操作失败: {str(e)}", 500)
 
 
+@app.route('/api/personas/<string:persona_id>/opening-audio', methods=['GET'])
+def get_persona_opening_audio(persona_id):
+    """
+    获取人设开场白的预合成音频信息
+    客户端可在闹钟响铃前预取 url 指向的音频，接听后立即播放，无需等待实时 TTS
+    ---
+    tags:
+      - AI人设管理
+    parameters:
+      - in: path
+        name: persona_id
+        type: string
+        required: true
+        description: AI人设 ID
+        example: "gentle"
+    responses:
+      200:
+        description: 获取成功
+        schema:
+          type: object
+          properties:
+            success:
+              type: boolean
+              example: true
+            data:
+              type: object
+              properties:
+                key:
+                  type: string
+                  description: 音频内容地址
+                url:
+                  type: string
+                  example: "/api/audio/3f1c...e9"
+                voice:
+                  type: string
+                  example: "nova"
+                codec:
+                  type: object
+                  example: {"format": "opus", "sample_rate": 16000, "channels": 1, "frame_duration": 60}
+                duration_ms:
+                  type: integer
+                  example: 8400
+      404:
+        description: AI人设不存在、开场白无法预合成，或服务端未配置语音合成器
+      500:
+        description: 服务器内部错误
+    """
+    if not opening_audio.enabled:
+        return error_response("服务端未启用开场白预合成音频", 404)
+    try:
+        persona = AIPersonaDAO.get_by_id(persona_id)
+        if not persona:
+            return error_response("AI人设不存在", 404)
+        if not is_cacheable(persona.opening_line):
+            return error_response("该人设的开场白为空或包含占位符，无法预合成", 404)
+
+        data = opening_audio.ensure(persona.opening_line, persona.voice_id or 'nova')
+        data['url'] = f"/api/audio/{data['key']}"
+        return success_response(data=data)
+
+    except Exception as e:
+        print(f"获取开场白音频错误: {traceback.format_exc()}")
+        return error_response(f"获取失败: {str(e)}", 500)
+
+
+@app.route('/api/audio/<string:key>', methods=['GET'])
+def get_audio(key):
+    """
+    下载预合成音频
+    内容寻址、永不变化，支持 Range 分段请求与 ETag 条件请求。
+    格式为连续的 [2 字节大端帧长 + Opus 帧]，16 kHz 单声道，每帧 60 ms。
+    ---
+    tags:
+      - AI人设管理
+    parameters:
+      - in: path
+        name: key
+        type: string
+        required: true
+        description: 音频内容地址
+    produces:
+      - application/octet-stream
+    responses:
+      200:
+        description: 音频数据
+      206:
+        description: 分段音频数据
+      404:
+        description: 音频不存在，或服务端未配置语音合成器
+    """
+    if not opening_audio.enabled:
+        return error_response("服务端未启用开场白预合成音频", 404)
+    try:
+        path = opening_audio.lookup(key)
+    except ValueError as e:
+        return error_response(str(e), 404)
+    if not path:
+        return error_response("音频不存在", 404)
+
+    response = send_file(
+        path,
+        mimetype='application/octet-stream',
+        conditional=True,
+        etag=key,
+        max_age=365 * 24 * 3600
+    )
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.headers['X-Audio-Codec'] = opening_audio.codec.tag
+    return response
+
+
+# ====================
+# 设备管理 API
+# ====================
+
+@app.route('/api/devices', methods=['POST'])
+def register_device():
+    """
+    注册或刷新设备推送令牌
+    客户端启动或令牌轮换时调用，服务端据此在闹钟到点时发送 VoIP / FCM 推送
+    ---
+    tags:
+      - 设备管理
+    parameters:
+      - in: body
+        name: device
+        description: 设备令牌信息
+        required: true
+        schema:
+          type: object
+          required:
+            - device_token
+            - user_id
+          properties:
+            device_token:
+              type: string
+              description: APNs 设备令牌或 FCM 注册令牌
+              example: "a1b2c3d4e5f6..."
+            user_id:
+              type: string
+              description: 用户ID
+              example: "user_123"
+            provider:
+              type: string
+              enum: [apns_voip, apns, fcm]
+              default: apns_voip
+              description: 推送通道
+            device_id:
+              type: string
+              description: 设备标识，同一设备的旧令牌会被停用
+              example: "iphone-8f14e45f"
+            app_version:
+              type: string
+              example: "1.2.0"
+    responses:
+      200:
+        description: 注册成功
+      400:
+        description: 请求参数错误
+      500:
+        description: 服务器内部错误
+    """
+    try:
+        data = request.get_json()
+
+        for field in ['device_token', 'user_id']:
+            if not data.get(field):
+                return error_response(f"缺少必填字段: {field}")
+
+        token = DeviceToken.from_dict(data)
+        if token.provider not in PUSH_PROVIDERS:
+            return error_response(f"provider 必须是以下之一: {', '.join(PUSH_PROVIDERS)}")
+
+        DeviceTokenDAO.register(token)
+        return success_response(data={'device_token': token.device_token}, message="设备注册成功")
+
+    except Exception as e:
+        print(f"注册设备错误: {traceback.format_exc()}")
+        return error_response(f"注册失败: {str(e)}", 500)
+
+
+@app.route('/api/devices', methods=['GET'])
+def get_devices():
+    """
+    获取用户的设备推送令牌
+    ---
+    tags:
+      - 设备管理
+    parameters:
+      - name: user_id
+        in: query
+        type: string
+        required: true
+        description: 用户ID
+      - name: include_inactive
+        in: query
+        type: boolean
+        required: false
+        default: false
+        description: 是否包含已失效的令牌
+    responses:
+      200:
+        description: 获取成功
+      400:
+        description: 缺少 user_id
+      500:
+        description: 服务器内部错误
+    """
+    try:
+        user_id = request.args.get('user_id')
+        if not user_id:
+            return error_response("缺少必填参数: user_id")
+
+        include_inactive = request.args.get('include_inactive', 'false').lower() == 'true'
+        tokens = DeviceTokenDAO.get_by_user(user_id, active_only=not include_inactive)
+        return success_response(data=[token.to_dict() for token in tokens])
+
+    except Exception as e:
+        print(f"获取设备列表错误: {traceback.format_exc()}")
+        return error_response(f"获取失败: {str(e)}", 500)
+
+
+@app.route('/api/devices/<string:device_token>', methods=['DELETE'])
+def delete_device(device_token):
+    """
+    注销设备推送令牌（退出登录时调用）
+    ---
+    tags:
+      - 设备管理
+    parameters:
+      - in: path
+        name: device_token
+        type: string
+        required: true
+        description: 推送令牌
+    responses:
+      200:
+        description: 注销成功
+      404:
+        description: 令牌不存在
+      500:
+        description: 服务器内部错误
+    """
+    try:
+        if DeviceTokenDAO.delete(device_token):
+            return success_response(message="设备已注销")
+        return error_response("设备令牌不存在", 404)
+
+    except Exception as e:
+        print(f"注销设备错误: {traceback.format_exc()}")
+        return error_response(f"注销失败: {str(e)}", 500)
+
+
+# ====================
+# 系统管理 API
+# ====================
+
+@app.route('/api/admin/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """
+    获取读缓存与请求合并统计
+    ---
+    tags:
+      - 系统
+    responses:
+      200:
+        description: 获取成功
+        schema:
+          type: object
+          properties:
+            success:
+              type: boolean
+              example: true
+            message:
+              type: string
+              example: "操作成功"
+            data:
+              type: object
+              properties:
+                hits:
+                  type: integer
+                  example: 1024
+                misses:
+                  type: integer
+                  example: 32
+                hit_rate:
+                  type: number
+                  example: 0.9697
+                evictions:
+                  type: integer
+                  example: 0
+    """
+    return success_response(data={
+        'alarms': alarm_cache.stats(),
+        'alarm_singleflight': alarm_cache.flight.stats(),
+        'persona_singleflight': persona_flight.stats(),
+        'persona_templates': prompts.persona_templates.stats(),
+        'idempotency': idempotency_store.stats()
+    })
+
+
+@app.route('/api/admin/admission/stats', methods=['GET'])
+def get_admission_stats():
+    """
+    获取准入控制统计
+    各类请求的隔离舱分别统计，便于确认一类请求的堆积没有影响其他类。
+    ---
+    tags:
+      - 系统
+    responses:
+      200:
+        description: 获取成功
+        schema:
+          type: object
+          properties:
+            success:
+              type: boolean
+              example: true
+            data:
+              type: object
+              properties:
+                capacity:
+                  type: integer
+                  example: 20
+                active:
+                  type: integer
+                  example: 3
+                shed:
+                  type: object
+                bulkheads:
+                  type: object
+                  description: 按类别（critical / read / write / search / admin）的并发、排队深度、延迟分位数与连接配额
+                rate_limited:
+                  type: integer
+                  example: 0
+    """
+    data = admission.stats()
+    data['stream_subscribers'] = change_feed.subscriber_count()
+    return success_response(data=data)
+
+
+@app.route('/api/admin/forecast', methods=['GET'])
+def get_wake_call_forecast():
+    """
+    预测未来每分钟的并发叫醒通话数
+    按人设与音色拆分，用于在早高峰前扩容语音后端。
+    闹钟时间统一按 ALARM_UTC_OFFSET_MINUTES 配置的时区解释。
+    ---
+    tags:
+      - 系统
+    parameters:
+      - name: days
+        in: query
+        type: integer
+        required: false
+        default: 7
+        description: 预测天数（含今天），最多 14 天
+      - name: call_minutes
+        in: query
+        type: integer
+        required: false
+        description: 单次通话持续的分钟数，默认取 WAKE_CALL_MINUTES 配置
+      - name: resolution
+        in: query
+        type: integer
+        required: false
+        default: 1
+        description: 序列中每个点覆盖的分钟数（取桶内峰值），须整除 1440
+    responses:
+      200:
+        description: 预测成功
+        schema:
+          type: object
+          properties:
+            success:
+              type: boolean
+              example: true
+            data:
+              type: object
+              properties:
+                alarms:
+                  type: integer
+                  example: 1250000
+                compute_ms:
+                  type: number
+                  example: 42.5
+                days:
+                  type: array
+                  items:
+                    type: object
+                    properties:
+                      date:
+                        type: string
+                        example: "2025-01-06"
+                      peak:
+                        type: integer
+                        example: 8421
+                      peak_time:
+                        type: string
+                        example: "07:01"
+                      total:
+                        type: array
+                        items:
+                          type: integer
+                      by_persona:
+                        type: object
+                      by_voice:
+                        type: object
+      400:
+        description: 参数错误
+    """
+    try:
+        try:
+            days = int(request.args.get('days', 7))
+            call_minutes = request.args.get('call_minutes')
+            call_minutes = int(call_minutes) if call_minutes else None
+            resolution = int(request.args.get('resolution', 1))
+        except ValueError:
+            return error_response("days、call_minutes 和 resolution 必须是整数")
+
+        try:
+            data = forecast.build_forecast(days=days, call_minutes=call_minutes, resolution=resolution)
+        except ValueError as e:
+            return error_response(str(e))
+        return success_response(data=data)
+    except Exception as e:
+        print(f"容量预测错误: {traceback.format_exc()}")
+        return error_response(f"预测失败: {str(e)}", 500)
+
+
 @app.errorhandler(404)
 def not_found(error):
     """404错误处理"""
@@ -0,0 +1,294 @@
+"""
+开场白音频缓存
+
+每个人设的开场白和音色是固定的，提前合成好音频，接听时直接下发，不必等待实时 TTS：
+- 按 (文本, 音色, 编码参数) 的哈希做内容寻址，文本或音色变化后自然生成新文件，旧链接依旧有效
+- 编码参数与客户端 xiaozhi_service.dart 一致：Opus，16 kHz 单声道，每帧 60 ms
+- 文件格式为连续的 [2 字节大端帧长 + Opus 帧]，客户端可按帧送入现有的解码播放流程
+- 帧数与字节数写在同名的 .json 元数据文件里（先于音频文件落盘），查询时不再读取音频统计帧数
+- 人设创建/更新后在后台重新合成，同一文件的并发合成只执行一次
+- 合成器可替换。未配置 TTS_SYNTHESIZER 时功能关闭，接口返回 404，客户端照常走实时 TTS；
+  StubSynthesizer 生成按文本长度估算时长的静音帧，只能显式设置 TTS_SYNTHESIZER=stub 用于开发和测试
+
+用法:
+    python audio_cache.py --warm    # 部署时预先合成所有启用人设的开场白
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import struct
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from config import Config
+from singleflight import SingleFlight
+
+
+# 含占位符的开场白每次响铃内容不同，不能预先合成
+PLACEHOLDER_PATTERN = re.compile(r'\{(time|alarm|date)\}')
+KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class CodecParams:
+    """音频编码参数"""
+
+    def __init__(self, fmt: str = 'opus', sample_rate: int = 16000, channels: int = 1, frame_duration: int = 60):
+        """
+        :param fmt: 编码格式
+        :param sample_rate: 采样率
+        :param channels: 声道数
+        :param frame_duration: 每帧毫秒数
+        """
+        self.format = fmt
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_duration = frame_duration
+
+    @property
+    def tag(self) -> str:
+        return f'{self.format}-{self.sample_rate}-{self.channels}-{self.frame_duration}'
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'format': self.format,
+            'sample_rate': self.sample_rate,
+            'channels': self.channels,
+            'frame_duration': self.frame_duration
+        }
+
+
+# 与客户端实时语音相同的编码参数
+DEFAULT_CODEC = CodecParams()
+
+
+class Synthesizer:
+    """语音合成接口"""
+
+    def synthesize(self, text: str, voice: str, codec: CodecParams) -> List[bytes]:
+        """
+        合成语音
+        :param text: 文本
+        :param voice: 音色 (nova / alloy / echo / fable / onyx)
+        :param codec: 编码参数
+        :return: 按 codec.frame_duration 切分的编码帧
+        """
+        raise NotImplementedError
+
+
+class StubSynthesizer(Synthesizer):
+    """本地替身：按每字 250 ms 估算时长，输出空的 SILK 宽带 60 ms 帧（解码为静音）"""
+
+    CHAR_MS = 250
+    # TOC 字节：config 11 (SILK WB 60 ms)，单声道，单帧
+    SILK_WB_60MS = bytes([11 << 3])
+
+    def synthesize(self, text: str, voice: str, codec: CodecParams) -> List[bytes]:
+        count = max(1, math.ceil(len(text) * self.CHAR_MS / codec.frame_duration))
+        return [self.SILK_WB_60MS] * count
+
+
+def create_synthesizer() -> Optional[Synthesizer]:
+    """
+    按 TTS_SYNTHESIZER 配置创建合成器
+    :return: 合成器，未配置时为 None（开场白音频功能关闭）
+    :raises ValueError: 合成器类型未知
+    """
+    if not Config.TTS_SYNTHESIZER:
+        return None
+    if Config.TTS_SYNTHESIZER == 'stub':
+        # 替身合成器只输出静音，不能当作真实的开场白下发
+        print("警告: TTS_SYNTHESIZER=stub，开场白音频为静音")
+        return StubSynthesizer()
+    raise ValueError(f"未知的语音合成器: {Config.TTS_SYNTHESIZER}")
+
+
+def content_key(text: str, voice: str, codec: CodecParams) -> str:
+    """音频文件的内容地址"""
+    raw = json.dumps([text, voice, codec.tag], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def pack_frames(frames: List[bytes]) -> bytes:
+    """按 [2 字节大端帧长 + 帧] 拼接"""
+    return b''.join(struct.pack('>H', len(frame)) + frame for frame in frames)
+
+
+def count_frames(data: bytes) -> int:
+    """统计打包数据中的帧数"""
+    count = 0
+    offset = 0
+    while offset + 2 <= len(data):
+        (length,) = struct.unpack_from('>H', data, offset)
+        offset += 2 + length
+        count += 1
+    return count
+
+
+def is_cacheable(text: Optional[str]) -> bool:
+    """开场白是否可以预先合成"""
+    return bool(text and text.strip()) and not PLACEHOLDER_PATTERN.search(text)
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """先写临时文件再原子替换，读取方不会看到写了一半的文件"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class AudioCache:
+    """内容寻址的开场白音频缓存"""
+
+    # 内存中保留的元数据条数（人设数 × 开场白版本，通常很少）
+    MAX_META = 4096
+
+    def __init__(
+        self,
+        root: str,
+        synthesizer: Optional[Synthesizer],
+        codec: CodecParams = DEFAULT_CODEC,
+        workers: int = 2
+    ):
+        """
+        :param root: 存储目录
+        :param synthesizer: 语音合成器，None 表示功能关闭
+        :param codec: 编码参数
+        :param workers: 后台合成线程数
+        """
+        self.root = root
+        self.synthesizer = synthesizer
+        self.codec = codec
+        self._flight = SingleFlight(timeout=120)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tts')
+        self._meta: Dict[str, Dict[str, int]] = {}
+        self.synthesized = 0
+
+    @property
+    def enabled(self) -> bool:
+        """是否配置了语音合成器"""
+        return self.synthesizer is not None
+
+    def key_for(self, text: str, voice: str) -> str:
+        return content_key(text, voice, self.codec)
+
+    def path_for(self, key: str) -> str:
+        """
+        :raises ValueError: key 不是合法的内容地址
+        """
+        if not KEY_PATTERN.match(key):
+            raise ValueError("音频 key 格式无效")
+        return os.path.join(self.root, key[:2], f'{key}.opus')
+
+    def lookup(self, key: str) -> Optional[str]:
+        """已合成时返回文件路径"""
+        path = self.path_for(key)
+        return path if os.path.exists(path) else None
+
+    def ensure(self, text: str, voice: str) -> Dict[str, Any]:
+        """
+        获取音频，未合成时同步合成
+        :param text: 开场白
+        :param voice: 音色
+        :return: 音频元数据
+        :raises RuntimeError: 未配置语音合成器
+        """
+        if not self.enabled:
+            raise RuntimeError("未配置语音合成器 (TTS_SYNTHESIZER)")
+        key = self.key_for(text, voice)
+        meta = self._meta.get(key)
+        if meta is None:
+            if self.lookup(key) is None:
+                self._flight.do(key, lambda: self._synthesize(key, text, voice))
+            meta = self._read_meta(key)
+            if len(self._meta) >= self.MAX_META:
+                self._meta.clear()
+            self._meta[key] = meta
+        return {
+            'key': key,
+            'voice': voice,
+            'codec': self.codec.to_dict(),
+            'frames': meta['frames'],
+            'duration_ms': meta['frames'] * self.codec.frame_duration,
+            'bytes': meta['bytes']
+        }
+
+    def _meta_path(self, key: str) -> str:
+        return self.path_for(key)[:-len('.opus')] + '.json'
+
+    def _read_meta(self, key: str) -> Dict[str, int]:
+        """读取元数据文件；早于元数据文件合成的音频统计一次后补写"""
+        try:
+            with open(self._meta_path(key), 'rb') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            with open(self.path_for(key), 'rb') as f:
+                data = f.read()
+            meta = {'frames': count_frames(data), 'bytes': len(data)}
+            write_atomic(self._meta_path(key), json.dumps(meta).encode('utf-8'))
+            return meta
+
+    def _synthesize(self, key: str, text: str, voice: str) -> str:
+        path = self.path_for(key)
+        if os.path.exists(path):
+            return path
+        frames = self.synthesizer.synthesize(text, voice, self.codec)
+        data = pack_frames(frames)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 元数据先落盘：音频文件一旦可见，元数据必然已存在
+        write_atomic(self._meta_path(key), json.dumps({'frames': len(frames), 'bytes': len(data)}).encode('utf-8'))
+        write_atomic(path, data)
+        self.synthesized += 1
+        return path
+
+    def refresh(self, persona) -> Optional[Future]:
+        """
+        在后台为人设合成开场白音频（内容未变时直接命中已有文件）
+        :param persona: AI人设
+        :return: 后台任务，功能关闭或开场白不可缓存时为 None
+        """
+        if not self.enabled or not is_cacheable(persona.opening_line):
+            return None
+        future = self._executor.submit(self.ensure, persona.opening_line, persona.voice_id or 'nova')
+        future.add_done_callback(self._report)
+        return future
+
+    @staticmethod
+    def _report(future: Future) -> None:
+        error = future.exception()
+        if error is not None:
+            print(f"开场白音频合成失败: {error}")
+
+
+opening_audio = AudioCache(Config.AUDIO_CACHE_DIR, create_synthesizer())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="开场白音频缓存")
+    parser.add_argument('--warm', action='store_true', help="合成所有启用人设的开场白")
+    args = parser.parse_args()
+    if not args.warm:
+        parser.print_help()
+        return
+    if not opening_audio.enabled:
+        print("未配置语音合成器 (TTS_SYNTHESIZER)，开场白音频功能关闭")
+        return
+
+    from dao import AIPersonaDAO
+    for persona in AIPersonaDAO.get_all():
+        if not is_cacheable(persona.opening_line):
+            print(f"跳过 {persona.persona_id}: 开场白为空或含占位符")
+            continue
+        meta = opening_audio.ensure(persona.opening_line, persona.voice_id or 'nova')
+        print(f"{persona.persona_id}: {meta['key']} ({meta['duration_ms']} ms, {meta['bytes']} 字节)")
+
+
+if __name__ == '__main__':
+    main()
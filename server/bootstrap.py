@@ -0,0 +1,93 @@
+"""
+应用启动数据
+
+客户端启动时原本依次请求 /health、闹钟列表、人设列表，再由 PersonaStore 逐个获取人设。
+这里一次返回启动所需的全部数据：
+- 用户的闹钟
+- 这些闹钟引用到的人设摘要，附带提示词指纹，客户端指纹不变时不必重新获取完整人设
+- 下一个即将响铃的闹钟与服务器时间
+- 变更流游标，客户端可从该位置订阅 /api/alarms/stream，不会漏掉启动期间的变更
+
+闹钟与人设查询都只依赖 user_id，在线程池中并行执行。
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from config import Config
+from dao import AlarmDAO, AIPersonaDAO
+from events import change_feed
+from models import Alarm, AIPersona, weekday_bit
+from prompts import CompiledPersona
+
+
+# 每次启动请求占用两个线程，与数据库并发上限一致即可
+_executor = ThreadPoolExecutor(max_workers=Config.DB_POOL_SIZE, thread_name_prefix='bootstrap')
+
+
+def next_occurrence(alarm: Alarm, now: datetime) -> Optional[datetime]:
+    """
+    闹钟下一次响铃的时间
+    :param alarm: 闹钟
+    :param now: 当前时间（闹钟所在时区）
+    :return: 响铃时间，未启用或时间无效时为 None
+    """
+    minute = alarm.minute_of_day
+    if not alarm.is_enabled or minute is None:
+        return None
+    mask = alarm.weekday_mask
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    for offset in range(8):
+        day = midnight + timedelta(days=offset)
+        fire_at = day + timedelta(minutes=minute)
+        # 一次性闹钟在下一个到点时刻响铃
+        if fire_at > now and (mask == 0 or mask & weekday_bit(day.isoweekday())):
+            return fire_at
+    return None
+
+
+def persona_summary(persona: AIPersona) -> Dict[str, Any]:
+    """人设摘要：不含提示词正文，prompt_hash 为提示词、开场白与音色的指纹"""
+    data = persona.to_dict()
+    del data['system_prompt']
+    del data['opening_line']
+    data['prompt_hash'] = CompiledPersona(persona).version
+    return data
+
+
+def build_bootstrap(user_id: str, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    汇总应用启动所需数据
+    :param user_id: 用户ID
+    :param now: 当前时间，默认取系统时间
+    :return: 启动数据
+    """
+    tz = timezone(timedelta(minutes=Config.ALARM_UTC_OFFSET_MINUTES))
+    now = now.astimezone(tz) if now else datetime.now(tz)
+    # 先取游标再查询，查询期间发生的变更会在订阅时补发
+    cursor = change_feed.cursor
+
+    # 在当前上下文中执行，沿用请求的查询时限
+    alarms_future = _executor.submit(contextvars.copy_context().run, AlarmDAO.get_by_user, user_id)
+    personas_future = _executor.submit(contextvars.copy_context().run, AIPersonaDAO.get_for_user, user_id)
+    alarms: List[Alarm] = alarms_future.result()
+    personas: List[AIPersona] = personas_future.result()
+
+    upcoming: Optional[Tuple[datetime, Alarm]] = None
+    for alarm in alarms:
+        fire_at = next_occurrence(alarm, now)
+        if fire_at and (upcoming is None or fire_at < upcoming[0]):
+            upcoming = (fire_at, alarm)
+
+    return {
+        'server_time': now.isoformat(),
+        'utc_offset_minutes': Config.ALARM_UTC_OFFSET_MINUTES,
+        'cursor': cursor,
+        'alarms': [alarm.to_dict() for alarm in alarms],
+        'personas': [persona_summary(persona) for persona in personas],
+        'next_alarm': {
+            'alarm_id': upcoming[1].alarm_id,
+            'fire_at': upcoming[0].isoformat(),
+            'in_seconds': int((upcoming[0] - now).total_seconds())
+        } if upcoming else None
+    }
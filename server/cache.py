@@ -0,0 +1,274 @@
+"""
+读穿透缓存 (Read-through Cache)
+
+- 进程内按字节数限制容量的 LRU，条目带 TTL
+- 通过"代数计数器"(generation) 失效：写操作只需递增代数，旧 key 自然不再命中
+- 支持缓存空结果（404），避免反复查询不存在的记录
+- 可选的共享缓存层（如 Redis），通过 SharedCacheBackend 接口接入
+- 值以 msgpack 序列化（不使用 pickle，共享层被写入的数据不会在反序列化时执行代码），
+  对象由调用方提供的 dump / load 与基础类型互转
+- 可选的 SingleFlight，未命中时相同 key 的并发加载只查询一次
+"""
+import msgpack
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+from singleflight import SingleFlight
+
+
+# 空结果占位符（序列化后存储，用于缓存 404）
+_NEGATIVE = b'\x00__negative__'
+
+# msgpack 扩展类型：datetime（数据库返回的是不带时区的 datetime，msgpack 内置的时间戳类型不支持）
+_DATETIME_EXT = 1
+
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return msgpack.ExtType(_DATETIME_EXT, value.isoformat().encode('ascii'))
+    raise TypeError(f"无法序列化的缓存值类型: {type(value).__name__}")
+
+
+def _msgpack_ext_hook(code: int, data: bytes) -> Any:
+    if code == _DATETIME_EXT:
+        return datetime.fromisoformat(data.decode('ascii'))
+    return msgpack.ExtType(code, data)
+
+
+def serialize(value: Any) -> bytes:
+    """基础类型（dict / list / str / 数字 / datetime 等）序列化为 msgpack"""
+    return msgpack.packb(value, default=_msgpack_default)
+
+
+def deserialize(raw: bytes) -> Any:
+    return msgpack.unpackb(raw, ext_hook=_msgpack_ext_hook)
+
+
+class SharedCacheBackend:
+    """共享缓存层接口，实现方需保证以下操作在多进程/多节点间可见"""
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取字节值，不存在或已过期返回 None"""
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """写入字节值并设置过期秒数"""
+        raise NotImplementedError
+
+    def get_counter(self, key: str) -> int:
+        """读取计数器，不存在时返回 0"""
+        raise NotImplementedError
+
+    def incr(self, key: str) -> int:
+        """原子递增计数器并返回新值"""
+        raise NotImplementedError
+
+
+class LocalSharedCache(SharedCacheBackend):
+    """进程内的共享缓存实现，用于测试和单机部署"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, tuple] = {}
+        self._counters: Dict[str, int] = {}
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._values[key] = (value, time.monotonic() + ttl)
+
+    def get_counter(self, key: str) -> int:
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = self._counters.get(key, 0) + 1
+            self._counters[key] = value
+            return value
+
+
+class LRUCache:
+    """按字节数限制容量的 LRU 缓存，条目带过期时间"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取并刷新 LRU 位置，过期条目会被删除"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """写入条目，超出容量时从最久未使用的一端淘汰"""
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str) -> None:
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+
+class ReadThroughCache:
+    """带代数失效的读穿透缓存"""
+
+    def __init__(
+        self,
+        namespace: str,
+        max_bytes: int,
+        ttl: float,
+        negative_ttl: float,
+        shared: Optional[SharedCacheBackend] = None,
+        flight: Optional[SingleFlight] = None,
+        dump: Callable[[Any], Any] = lambda value: value,
+        load: Callable[[Any], Any] = lambda data: data
+    ):
+        """
+        :param dump: 缓存值转换为可 msgpack 序列化的基础类型
+        :param load: dump 的逆操作
+        """
+        self.namespace = namespace
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.shared = shared
+        self.flight = flight
+        self.dump = dump
+        self.load = load
+        self.local = LRUCache(max_bytes)
+        self._lock = threading.Lock()
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    def attach_shared(self, backend: Optional[SharedCacheBackend]) -> None:
+        """接入（或移除）共享缓存层，本地条目随之清空"""
+        self.shared = backend
+        self.local.clear()
+
+    def generation(self, scope: str) -> int:
+        """
+        获取作用域当前代数
+        :param scope: 作用域，例如 "user:user_001"
+        :return: 代数
+        """
+        if self.shared is not None:
+            return self.shared.get_counter(f'{self.namespace}:gen:{scope}')
+        with self._lock:
+            return self._generations.get(scope, 0)
+
+    def bump(self, *scopes: str) -> None:
+        """递增作用域代数，使其下所有缓存条目失效"""
+        for scope in scopes:
+            if self.shared is not None:
+                self.shared.incr(f'{self.namespace}:gen:{scope}')
+            else:
+                with self._lock:
+                    self._generations[scope] = self._generations.get(scope, 0) + 1
+
+    def get_or_load(self, scope: str, loader: Callable[[], Any]) -> Any:
+        """
+        读取缓存，未命中时调用 loader 并回填
+        :param scope: 作用域，同时作为缓存 key
+        :param loader: 未命中时的加载函数，返回 None 表示记录不存在
+        :return: 缓存或新加载的值
+        """
+        # 必须在加载前读取代数，保证加载期间发生的写入不会被旧值覆盖
+        key = f'{self.namespace}:{scope}@{self.generation(scope)}'
+
+        raw = self.local.get(key)
+        if raw is None and self.shared is not None:
+            raw = self.shared.get(key)
+            if raw is not None:
+                with self._lock:
+                    self.shared_hits += 1
+                self.local.set(key, raw, self._ttl_for(raw))
+        if raw is not None:
+            with self._lock:
+                self.hits += 1
+            return None if raw == _NEGATIVE else self.load(deserialize(raw))
+
+        with self._lock:
+            self.misses += 1
+
+        def load():
+            value = loader()
+            raw = _NEGATIVE if value is None else serialize(self.dump(value))
+            ttl = self._ttl_for(raw)
+            self.local.set(key, raw, ttl)
+            if self.shared is not None:
+                self.shared.set(key, raw, ttl)
+            return value
+
+        # key 中包含代数，写入之后的请求不会合并到写入之前开始的加载
+        return self.flight.do(key, load) if self.flight is not None else load()
+
+    def _ttl_for(self, raw: bytes) -> float:
+        return self.negative_ttl if raw == _NEGATIVE else self.ttl
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率与淘汰统计"""
+        with self._lock:
+            hits, misses, shared_hits = self.hits, self.misses, self.shared_hits
+        lookups = hits + misses
+        return {
+            'namespace': self.namespace,
+            'hits': hits,
+            'misses': misses,
+            'shared_hits': shared_hits,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'entries': len(self.local),
+            'size_bytes': self.local.size_bytes,
+            'max_bytes': self.local.max_bytes,
+            'evictions': self.local.evictions,
+            'expirations': self.local.expirations,
+            'shared_enabled': self.shared is not None
+        }
@@ -0,0 +1,163 @@
+"""
+响应格式协商
+
+/api/* 接口按 Accept 请求头返回 JSON（默认）、MessagePack 或 CBOR，三者的响应信封相同
+（success / message / data）。二进制格式下：
+- 时间戳字段（键名以 _at / _time 结尾、值为 ISO-8601 日期时间）编码为原生时间类型：
+  MessagePack 的 timestamp 扩展 (-1)，CBOR 的 tag 1；不带时区的值按 ALARM_UTC_OFFSET_MINUTES 解释
+- 字段相同的对象列表编码为列式表 [keys, rows]，字段名只出现一次：
+  MessagePack 扩展类型 TABLE_EXT，内容为 MessagePack 编码的 [keys, rows]；CBOR 为 tag TABLE_TAG 包裹的 [keys, rows]
+  解码端按 keys 把每一行还原为对象，见 decode()
+"""
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+import cbor2
+import msgpack
+from config import Config
+
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+CBOR = 'application/cbor'
+# 与 JSON 同等优先级时返回 JSON，浏览器与未声明 Accept 的客户端不受影响
+MEDIA_TYPES = [JSON, MSGPACK, CBOR]
+# 部分客户端仍使用旧的 MessagePack 类型名
+ALIASES = {'application/x-msgpack': MSGPACK}
+
+TABLE_EXT = 1
+TABLE_TAG = 55801
+# 至少这么多条、字段完全相同时才编码为列式表
+TABLE_MIN_ROWS = 2
+
+TIMESTAMP_SUFFIXES = ('_at', '_time')
+LOCAL_TZ = timezone(timedelta(minutes=Config.ALARM_UTC_OFFSET_MINUTES))
+
+
+def negotiate(accept_mimetypes) -> str:
+    """
+    按 Accept 选择响应格式
+    :param accept_mimetypes: request.accept_mimetypes
+    :return: JSON / MSGPACK / CBOR
+    """
+    for alias, media_type in ALIASES.items():
+        if accept_mimetypes[alias] and not accept_mimetypes[media_type]:
+            return media_type
+    return accept_mimetypes.best_match(MEDIA_TYPES, default=JSON)
+
+
+class Table:
+    """列式表：keys 为字段名，rows 中每行的取值与 keys 一一对应"""
+
+    __slots__ = ('keys', 'rows')
+
+    def __init__(self, keys: List[str], rows: List[List[Any]]):
+        self.keys = keys
+        self.rows = rows
+
+
+def _timestamp(value: str) -> Any:
+    # 先做廉价的形状判断，"07:30" 这类时刻不会进入解析
+    if len(value) < 19 or value[10] != 'T':
+        return value
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=LOCAL_TZ)
+
+
+def _field(key: str, value: Any) -> Any:
+    if isinstance(value, str):
+        return _timestamp(value) if key.endswith(TIMESTAMP_SUFFIXES) else value
+    if isinstance(value, (dict, list)):
+        return prepare(value)
+    return value
+
+
+def _table(items: List[Any]) -> Optional[Table]:
+    first = items[0]
+    if len(items) < TABLE_MIN_ROWS or not isinstance(first, dict):
+        return None
+    keys = list(first)
+    shape = first.keys()
+    for item in items:
+        if not isinstance(item, dict) or item.keys() != shape:
+            return None
+    return Table(keys, [[_field(key, item[key]) for key in keys] for item in items])
+
+
+def prepare(value: Any) -> Any:
+    """把 JSON 形态的数据转换为二进制编码前的形态（原生时间戳与列式表）"""
+    if isinstance(value, dict):
+        return {key: _field(key, item) for key, item in value.items()}
+    if isinstance(value, list):
+        if value:
+            table = _table(value)
+            if table is not None:
+                return table
+        return [prepare(item) for item in value]
+    return value
+
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, Table):
+        return msgpack.ExtType(TABLE_EXT, msgpack.packb([value.keys, value.rows], default=_msgpack_default, datetime=True))
+    raise TypeError(f"无法编码的类型: {type(value).__name__}")
+
+
+def _cbor_default(encoder, value: Any) -> None:
+    if isinstance(value, Table):
+        encoder.encode(cbor2.CBORTag(TABLE_TAG, [value.keys, value.rows]))
+        return
+    raise TypeError(f"无法编码的类型: {type(value).__name__}")
+
+
+def encode(payload: Dict[str, Any], media_type: str) -> bytes:
+    """
+    编码响应
+    :param payload: JSON 形态的响应信封
+    :param media_type: JSON / MSGPACK / CBOR
+    :return: 响应体
+    """
+    if media_type == MSGPACK:
+        return msgpack.packb(prepare(payload), default=_msgpack_default, datetime=True)
+    if media_type == CBOR:
+        return cbor2.dumps(prepare(payload), default=_cbor_default, datetime_as_timestamp=True)
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+
+def _rows_to_objects(keys: List[str], rows: List[List[Any]]) -> List[Dict[str, Any]]:
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def _msgpack_ext_hook(code: int, data: bytes) -> Any:
+    if code == TABLE_EXT:
+        keys, rows = msgpack.unpackb(data, ext_hook=_msgpack_ext_hook, timestamp=3)
+        return _rows_to_objects(keys, rows)
+    return msgpack.ExtType(code, data)
+
+
+def _restore_cbor_tables(value: Any) -> Any:
+    # 不使用 tag_hook：cbor2 各版本（C 扩展与纯 Python 实现）传给它的参数不一致
+    if isinstance(value, cbor2.CBORTag) and value.tag == TABLE_TAG:
+        keys, rows = value.value
+        return _rows_to_objects(keys, _restore_cbor_tables(rows))
+    if isinstance(value, dict):
+        return {key: _restore_cbor_tables(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_restore_cbor_tables(item) for item in value]
+    return value
+
+
+def decode(body: bytes, media_type: str) -> Any:
+    """
+    解码响应体，列式表还原为对象列表，时间戳还原为带时区的 datetime
+    :param body: 响应体
+    :param media_type: JSON / MSGPACK / CBOR
+    """
+    if media_type == MSGPACK:
+        return msgpack.unpackb(body, ext_hook=_msgpack_ext_hook, timestamp=3)
+    if media_type == CBOR:
+        return _restore_cbor_tables(cbor2.loads(body))
+    return json.loads(body)
@@ -17,7 +17,11 @@ class Config:
         'password': os.getenv('DB_PASSWORD', ''),
         'database': os.getenv('DB_NAME', 'alarm_clock_db'),
         'charset': 'utf8mb4',
-        'autocommit': True
+        'autocommit': True,
+        # 驱动层超时（秒）：建立连接、读取结果、发送语句；读写超时为 0 时不限制（在线迁移等长语句可临时关闭）
+        'connect_timeout': float(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+        'read_timeout': float(os.getenv('DB_READ_TIMEOUT', 60)) or None,
+        'write_timeout': float(os.getenv('DB_WRITE_TIMEOUT', 60)) or None
     }
     
     # Flask配置
@@ -25,3 +29,98 @@ class Config:
     DEBUG = os.getenv('DEBUG', 'True') == 'True'
     HOST = os.getenv('HOST', '0.0.0.0')
     PORT = int(os.getenv('PORT', 5000))
+    # gunicorn gevent worker 同时保持的连接数上限（见 gunicorn.conf.py），需要 ulimit -n 不低于该值 + 1024
+    WEB_WORKER_CONNECTIONS = int(os.getenv('WEB_WORKER_CONNECTIONS', 100000))
+    
+    # 闹钟读缓存配置
+    ALARM_CACHE_MAX_BYTES = int(os.getenv('ALARM_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    ALARM_CACHE_TTL = float(os.getenv('ALARM_CACHE_TTL', 60))
+    ALARM_CACHE_NEGATIVE_TTL = float(os.getenv('ALARM_CACHE_NEGATIVE_TTL', 10))
+    
+    # 并发读合并：等待进行中查询的最长秒数
+    SINGLEFLIGHT_TIMEOUT = float(os.getenv('SINGLEFLIGHT_TIMEOUT', 5))
+    
+    # 准入控制：每个 API Key / 客户端 IP 的限流速率与突发量
+    RATE_LIMIT_PER_SECOND = float(os.getenv('RATE_LIMIT_PER_SECOND', 5))
+    RATE_LIMIT_BURST = float(os.getenv('RATE_LIMIT_BURST', 20))
+    # 服务端认可的 API Key，格式 "名称=密钥,名称=密钥"；只有匹配的 X-API-Key 按名称单独限流，未知的 Key 按 IP 限流
+    API_KEYS = os.getenv('API_KEYS', '')
+    # 前面的反向代理层数（例如 Nginx -> gunicorn 为 1），按 X-Forwarded-For / X-Forwarded-Proto / X-Forwarded-Host
+    # 还原客户端地址；直接对外暴露时必须保持 0，否则客户端可以伪造来源 IP
+    PROXY_FIX_HOPS = int(os.getenv('PROXY_FIX_HOPS', 0))
+    # 总并发上限，应与数据库可用连接数一致，按 admission.BULKHEAD_SHARES 分给各类请求
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 20))
+    # 排队超过该秒数的请求直接返回 503
+    ADMISSION_LATENCY_TARGET = float(os.getenv('ADMISSION_LATENCY_TARGET', 0.5))
+    
+    # 变更推送：环形缓冲区保留的事件数与心跳间隔（秒）
+    CHANGE_FEED_BUFFER = int(os.getenv('CHANGE_FEED_BUFFER', 10000))
+    STREAM_HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', 15))
+    
+    # 容量预测：闹钟时间所在时区（相对 UTC 的分钟数，默认东八区）与单次叫醒通话的预计时长
+    ALARM_UTC_OFFSET_MINUTES = int(os.getenv('ALARM_UTC_OFFSET_MINUTES', 480))
+    WAKE_CALL_MINUTES = int(os.getenv('WAKE_CALL_MINUTES', 3))
+    
+    # 叫醒调度：同一分钟的通话在 ±容忍秒数内错峰启动，提前预热秒数构建上下文，单个人设的并发上限
+    WAKE_DISPATCH_TOLERANCE = float(os.getenv('WAKE_DISPATCH_TOLERANCE', 20))
+    WAKE_DISPATCH_PREWARM = float(os.getenv('WAKE_DISPATCH_PREWARM', 60))
+    WAKE_PERSONA_CONCURRENCY = int(os.getenv('WAKE_PERSONA_CONCURRENCY', 500))
+    # 按人设覆盖并发上限，例如 "gentle=800,strict=200"
+    WAKE_PERSONA_LIMITS = os.getenv('WAKE_PERSONA_LIMITS', '')
+    
+    # 推送：网关类型 (http 为 APNs、FCM / local 为进程内替身，只用于开发，需显式设置)，每批条数、并发批数、重试次数与退避秒数
+    PUSH_GATEWAY = os.getenv('PUSH_GATEWAY', 'http')
+    PUSH_BATCH_SIZE = int(os.getenv('PUSH_BATCH_SIZE', 500))
+    PUSH_CONCURRENCY = int(os.getenv('PUSH_CONCURRENCY', 8))
+    PUSH_MAX_ATTEMPTS = int(os.getenv('PUSH_MAX_ATTEMPTS', 4))
+    PUSH_RETRY_BACKOFF = float(os.getenv('PUSH_RETRY_BACKOFF', 0.5))
+    # 整分钟前多少秒预取该分钟到点的闹钟与设备令牌（这几秒内新建的闹钟由设备本地调度兜底）
+    PUSH_PREFETCH = float(os.getenv('PUSH_PREFETCH', 10))
+    # 各推送通道每秒发送上限，例如 "apns_voip=5000,fcm=3000"，未配置的通道使用默认值
+    PUSH_PROVIDER_RATES = os.getenv('PUSH_PROVIDER_RATES', '')
+    PUSH_DEFAULT_RATE = float(os.getenv('PUSH_DEFAULT_RATE', 2000))
+    # HTTP/2 网关：每个通道的连接数与每个连接上的并发流数
+    PUSH_HTTP_CONNECTIONS = int(os.getenv('PUSH_HTTP_CONNECTIONS', 4))
+    PUSH_HTTP_STREAMS = int(os.getenv('PUSH_HTTP_STREAMS', 100))
+    PUSH_APNS_URL = os.getenv('PUSH_APNS_URL', 'https://api.push.apple.com')
+    PUSH_APNS_TOPIC = os.getenv('PUSH_APNS_TOPIC', '')
+    PUSH_APNS_AUTH_TOKEN = os.getenv('PUSH_APNS_AUTH_TOKEN', '')
+    PUSH_FCM_URL = os.getenv('PUSH_FCM_URL', '')
+    PUSH_FCM_AUTH_TOKEN = os.getenv('PUSH_FCM_AUTH_TOKEN', '')
+    
+    # 开场白音频缓存：存储目录与语音合成实现。留空则功能关闭（接口返回 404，客户端走实时 TTS）；
+    # stub 是只输出静音的本地替身，仅用于开发和测试
+    AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audio_cache'))
+    TTS_SYNTHESIZER = os.getenv('TTS_SYNTHESIZER', '')
+    
+    # 语音会话中继：来电响铃时以设备自己的身份预先完成上游鉴权与 hello 握手，接听时直接交给该设备。
+    # 中继不持有上游凭据；默认只监听本机，监听其他地址时必须设置 RELAY_CLIENT_TOKEN，否则中继拒绝启动
+    RELAY_HOST = os.getenv('RELAY_HOST', '127.0.0.1')
+    RELAY_PORT = int(os.getenv('RELAY_PORT', 8765))
+    RELAY_UPSTREAM_URL = os.getenv('RELAY_UPSTREAM_URL', 'wss://api.tenclass.net/xiaozhi/v1/')
+    # 客户端访问中继需携带的令牌（X-Relay-Token 头或 relay_token 参数），留空则不校验（只允许监听本机时留空）
+    RELAY_CLIENT_TOKEN = os.getenv('RELAY_CLIENT_TOKEN', '')
+    # 同时保持的预热会话总数上限（每台设备每种模式最多一条）
+    RELAY_POOL_SIZE = int(os.getenv('RELAY_POOL_SIZE', 256))
+    # 上游会关闭长时间空闲的会话，预热后超过该秒数仍未接听的会话关闭
+    RELAY_POOL_MAX_IDLE = float(os.getenv('RELAY_POOL_MAX_IDLE', 90))
+    # 每个方向最多缓冲的帧数，超过后停止读取，由 TCP 把压力传回发送方
+    RELAY_MAX_QUEUE = int(os.getenv('RELAY_MAX_QUEUE', 32))
+    
+    # 编译好的人设指示词模板的保留秒数（人设写操作会立即失效本进程的缓存）
+    PROMPT_TEMPLATE_TTL = float(os.getenv('PROMPT_TEMPLATE_TTL', 300))
+    
+    # 同步对账：默认的 Merkle 分桶数与允许的最大分桶数
+    SYNC_BUCKETS = int(os.getenv('SYNC_BUCKETS', 256))
+    SYNC_MAX_BUCKETS = int(os.getenv('SYNC_MAX_BUCKETS', 4096))
+    
+    # 幂等键：保存已完成响应的总字节数与秒数（需覆盖客户端重试窗口），相同 key 的并发重试最长等待秒数
+    # （同时不超过该请求剩余的时限 X-Request-Timeout / REQUEST_DEADLINE）
+    IDEMPOTENCY_MAX_BYTES = int(os.getenv('IDEMPOTENCY_MAX_BYTES', 8 * 1024 * 1024))
+    IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', 24 * 3600))
+    IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT', 10))
+    
+    # 查询时限：每个 HTTP 请求内数据库调用的总预算（秒），客户端可通过 X-Request-Timeout 请求头缩短；
+    # 到期后仍未返回的语句在宽限秒数后被 KILL QUERY
+    REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', 10))
+    QUERY_KILL_GRACE = float(os.getenv('QUERY_KILL_GRACE', 0.5))
@@ -1,14 +1,52 @@
 """
 数据访问层 (DAO - Data Access Object)
 """
-from typing import List, Optional
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from audio_cache import opening_audio
+from cache import ReadThroughCache
+from config import Config
 from database import Database
-from models import Alarm, AIPersona
+from events import change_feed
+from models import Alarm, AIPersona, DeviceToken, weekday_bit
+from prompts import persona_templates
+from singleflight import SingleFlight
+
+
+def _dump_alarms(value: Any) -> Any:
+    """Alarm 或 Alarm 列表转换为字段字典，用于缓存序列化"""
+    if isinstance(value, list):
+        return [vars(alarm) for alarm in value]
+    return vars(value)
+
+
+def _load_alarms(data: Any) -> Any:
+    if isinstance(data, list):
+        return [Alarm(**fields) for fields in data]
+    return Alarm(**data)
+
+
+# 闹钟读缓存：get_by_id / get_by_user 走缓存，写操作递增代数失效
+alarm_cache = ReadThroughCache(
+    'alarms',
+    max_bytes=Config.ALARM_CACHE_MAX_BYTES,
+    ttl=Config.ALARM_CACHE_TTL,
+    negative_ttl=Config.ALARM_CACHE_NEGATIVE_TTL,
+    flight=SingleFlight(Config.SINGLEFLIGHT_TIMEOUT),
+    dump=_dump_alarms,
+    load=_load_alarms
+)
+
+# AI人设读请求合并：相同查询并发时只访问一次数据库，写操作后 forget()
+persona_flight = SingleFlight(Config.SINGLEFLIGHT_TIMEOUT)
 
 
 class AlarmDAO:
     """闹钟数据访问对象"""
     
+    # IN 查询每批的ID数
+    CHUNK_SIZE = 1000
+    
     @staticmethod
     def create(alarm: Alarm) -> int:
         """
@@ -18,8 +56,9 @@ class AlarmDAO:
         """
         sql = """
         INSERT INTO alarms (alarm_id, user_id, alarm_time, alarm_name, ai_persona_id, 
-                           repeat_days, is_enabled, next_alarm_time, created_at, updated_at)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+                           repeat_days, minute_of_day, weekday_mask, is_enabled, next_alarm_time,
+                           content_hash, version, created_at, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 1, NOW(), NOW())
         """
         with Database.get_cursor() as cursor:
             cursor.execute(sql, (
@@ -29,10 +68,16 @@ class AlarmDAO:
                 alarm.alarm_name,
                 alarm.ai_persona_id,
                 alarm.repeat_days,
+                alarm.minute_of_day,
+                alarm.weekday_mask,
                 alarm.is_enabled,
-                alarm.next_alarm_time
+                alarm.next_alarm_time,
+                alarm.content_hash
             ))
-            return alarm.alarm_id
+        # 同时失效该ID的空结果缓存
+        AlarmDAO._invalidate(alarm.alarm_id, alarm.user_id)
+        AlarmDAO._publish('created', alarm.alarm_id, alarm.user_id)
+        return alarm.alarm_id
     
     @staticmethod
     def get_by_id(alarm_id: str) -> Optional[Alarm]:
@@ -41,12 +86,36 @@ class AlarmDAO:
         :param alarm_id: 闹钟ID
         :return: 闹钟对象或None
         """
+        # 事务中需要读到本事务的修改，且未提交的数据不能进入缓存
+        if Database.in_transaction():
+            return AlarmDAO._load_by_id(alarm_id)
+        return alarm_cache.get_or_load(
+            f'alarm:{alarm_id}',
+            lambda: AlarmDAO._load_by_id(alarm_id)
+        )
+    
+    @staticmethod
+    def _load_by_id(alarm_id: str) -> Optional[Alarm]:
+        """从数据库读取单个闹钟（不经过缓存）"""
         sql = "SELECT * FROM alarms WHERE alarm_id = %s"
         with Database.get_cursor() as cursor:
             cursor.execute(sql, (alarm_id,))
             result = cursor.fetchone()
             return Alarm.from_dict(result) if result else None
     
+    @staticmethod
+    def get_for_update(alarm_id: str) -> Optional[Alarm]:
+        """
+        读取并锁定闹钟，直到当前事务结束（在 Database.transaction() 内调用）
+        :param alarm_id: 闹钟ID
+        :return: 闹钟对象或None
+        """
+        sql = "SELECT * FROM alarms WHERE alarm_id = %s FOR UPDATE"
+        with Database.get_cursor() as cursor:
+            cursor.execute(sql, (alarm_id,))
+            result = cursor.fetchone()
+            return Alarm.from_dict(result) if result else None
+    
     @staticmethod
     def get_by_user(user_id: str) -> List[Alarm]:
         """
@@ -54,12 +123,58 @@ class AlarmDAO:
         :param user_id: 用户ID
         :return: 闹钟列表
         """
+        if Database.in_transaction():
+            return AlarmDAO._load_by_user(user_id)
+        return alarm_cache.get_or_load(
+            f'user:{user_id}',
+            lambda: AlarmDAO._load_by_user(user_id)
+        )
+    
+    @staticmethod
+    def _load_by_user(user_id: str) -> List[Alarm]:
+        """从数据库读取用户的所有闹钟（不经过缓存）"""
         sql = "SELECT * FROM alarms WHERE user_id = %s ORDER BY alarm_time"
         with Database.get_cursor() as cursor:
             cursor.execute(sql, (user_id,))
             results = cursor.fetchall()
             return [Alarm.from_dict(row) for row in results]
     
+    @staticmethod
+    def get_digests(user_id: str) -> Dict[str, Tuple[str, int]]:
+        """
+        获取用户闹钟的内容指纹与版本（只读 idx_user_digest 覆盖索引，不读整行）
+        :param user_id: 用户ID
+        :return: {alarm_id: (content_hash, version)}，未回填指纹的行 content_hash 为空字符串
+        """
+        sql = "SELECT alarm_id, content_hash, version FROM alarms WHERE user_id = %s"
+        with Database.get_cursor() as cursor:
+            cursor.execute(sql, (user_id,))
+            return {
+                row['alarm_id']: (row['content_hash'] or '', row['version'])
+                for row in cursor.fetchall()
+            }
+    
+    @staticmethod
+    def get_by_ids(user_id: str, alarm_ids: Sequence[str]) -> List[Alarm]:
+        """
+        批量获取用户的指定闹钟
+        :param user_id: 用户ID
+        :param alarm_ids: 闹钟ID列表
+        :return: 闹钟列表（不存在的ID忽略）
+        """
+        alarms = []
+        alarm_ids = list(alarm_ids)
+        with Database.get_cursor() as cursor:
+            for start in range(0, len(alarm_ids), AlarmDAO.CHUNK_SIZE):
+                chunk = alarm_ids[start:start + AlarmDAO.CHUNK_SIZE]
+                placeholders = ', '.join(['%s'] * len(chunk))
+                cursor.execute(
+                    f"SELECT * FROM alarms WHERE user_id = %s AND alarm_id IN ({placeholders})",
+                    (user_id, *chunk)
+                )
+                alarms.extend(Alarm.from_dict(row) for row in cursor.fetchall())
+        return alarms
+    
     @staticmethod
     def get_all() -> List[Alarm]:
         """
@@ -82,21 +197,34 @@ class AlarmDAO:
         sql = """
         UPDATE alarms 
         SET user_id = %s, alarm_time = %s, alarm_name = %s, ai_persona_id = %s, 
-            repeat_days = %s, is_enabled = %s, next_alarm_time = %s, updated_at = NOW()
+            repeat_days = %s, minute_of_day = %s, weekday_mask = %s,
+            is_enabled = %s, next_alarm_time = %s,
+            version = IF(content_hash <=> %s, version, version + 1), content_hash = %s,
+            updated_at = NOW()
         WHERE alarm_id = %s
         """
-        with Database.get_cursor() as cursor:
+        with Database.transaction(), Database.get_cursor() as cursor:
+            owner = AlarmDAO._get_owner(cursor, alarm.alarm_id)
             cursor.execute(sql, (
                 alarm.user_id,
                 alarm.alarm_time,
                 alarm.alarm_name,
                 alarm.ai_persona_id,
                 alarm.repeat_days,
+                alarm.minute_of_day,
+                alarm.weekday_mask,
                 alarm.is_enabled,
                 alarm.next_alarm_time,
+                alarm.content_hash,
+                alarm.content_hash,
                 alarm.alarm_id
             ))
-            return cursor.rowcount > 0
+            updated = cursor.rowcount > 0
+        # 原属用户和新属用户的列表都需要刷新
+        AlarmDAO._invalidate(alarm.alarm_id, owner, alarm.user_id)
+        if updated:
+            AlarmDAO._publish('updated', alarm.alarm_id, owner, alarm.user_id)
+        return updated
     
     @staticmethod
     def delete(alarm_id: str) -> bool:
@@ -106,9 +234,14 @@ class AlarmDAO:
         :return: 是否删除成功
         """
         sql = "DELETE FROM alarms WHERE alarm_id = %s"
-        with Database.get_cursor() as cursor:
+        with Database.transaction(), Database.get_cursor() as cursor:
+            owner = AlarmDAO._get_owner(cursor, alarm_id)
             cursor.execute(sql, (alarm_id,))
-            return cursor.rowcount > 0
+            deleted = cursor.rowcount > 0
+        AlarmDAO._invalidate(alarm_id, owner)
+        if deleted:
+            AlarmDAO._publish('deleted', alarm_id, owner)
+        return deleted
     
     @staticmethod
     def toggle_status(alarm_id: str, is_enabled: bool) -> bool:
@@ -118,10 +251,28 @@ class AlarmDAO:
         :param is_enabled: 是否启用
         :return: 是否更新成功
         """
-        sql = "UPDATE alarms SET is_enabled = %s, updated_at = NOW() WHERE alarm_id = %s"
-        with Database.get_cursor() as cursor:
-            cursor.execute(sql, (is_enabled, alarm_id))
-            return cursor.rowcount > 0
+        sql = """
+        UPDATE alarms
+        SET is_enabled = %s, version = IF(content_hash <=> %s, version, version + 1), content_hash = %s,
+            updated_at = NOW()
+        WHERE alarm_id = %s
+        """
+        with Database.transaction(), Database.get_cursor() as cursor:
+            # 内容指纹依赖启用状态，先锁定当前行再计算
+            cursor.execute("SELECT * FROM alarms WHERE alarm_id = %s FOR UPDATE", (alarm_id,))
+            row = cursor.fetchone()
+            if not row:
+                return False
+            alarm = Alarm.from_dict(row)
+            owner = alarm.user_id
+            alarm.is_enabled = is_enabled
+            content_hash = alarm.content_hash
+            cursor.execute(sql, (is_enabled, content_hash, content_hash, alarm_id))
+            updated = cursor.rowcount > 0
+        AlarmDAO._invalidate(alarm_id, owner)
+        if updated:
+            AlarmDAO._publish('updated', alarm_id, owner)
+        return updated
     
     @staticmethod
     def get_enabled_alarms() -> List[Alarm]:
@@ -134,6 +285,90 @@ class AlarmDAO:
             cursor.execute(sql)
             results = cursor.fetchall()
             return [Alarm.from_dict(row) for row in results]
+    
+    @staticmethod
+    def get_enabled_in_window(
+        start_minute: int,
+        end_minute: int,
+        day: date,
+        include_one_shot: bool = True
+    ) -> List[Alarm]:
+        """
+        获取指定日期、指定时间窗口内的启用闹钟（走 idx_enabled_schedule 索引）
+        一次性闹钟 (weekday_mask = 0) 只在一天响铃：设置了 next_alarm_time 时为该日期，
+        否则为 updated_at（创建、修改或重新启用的时间）之后的第一次到点，
+        客户端未同步回"已关闭"时也不会每天重复响铃。
+        updated_at 由 NOW() 写入，是数据库会话时区的时间，比较前先换算到 ALARM_UTC_OFFSET_MINUTES 所在时区
+        :param start_minute: 窗口起点，当天第几分钟 (含)
+        :param end_minute: 窗口终点，当天第几分钟 (含)；小于起点表示跨越午夜
+        :param day: 窗口所在日期（闹钟时区）
+        :param include_one_shot: 是否包含一次性闹钟
+        :return: 闹钟列表
+        """
+        if start_minute <= end_minute:
+            window = "minute_of_day BETWEEN %s AND %s"
+        else:
+            window = "(minute_of_day >= %s OR minute_of_day <= %s)"
+        params: List[Any] = [start_minute, end_minute, weekday_bit(day.isoweekday())]
+        day_filter = "(weekday_mask & %s) != 0"
+        if include_one_shot:
+            # 会话时区 -> UTC -> 闹钟时区；NOW() 与 UTC_TIMESTAMP() 取同一语句开始时刻，差值即会话时区偏移
+            updated_local = "updated_at + INTERVAL (TIMESTAMPDIFF(MINUTE, NOW(), UTC_TIMESTAMP()) + %s) MINUTE"
+            day_filter = f"""({day_filter} OR (weekday_mask = 0 AND (
+                DATE(next_alarm_time) = %s
+                OR (next_alarm_time IS NULL
+                    AND {updated_local} >= TIMESTAMP(%s) + INTERVAL minute_of_day MINUTE - INTERVAL 1 DAY
+                    AND {updated_local} < TIMESTAMP(%s) + INTERVAL minute_of_day MINUTE)
+            )))"""
+            offset = Config.ALARM_UTC_OFFSET_MINUTES
+            params.extend([day, offset, day, offset, day])
+        sql = f"""
+        SELECT * FROM alarms
+        WHERE is_enabled = 1 AND {window} AND {day_filter}
+        ORDER BY minute_of_day
+        """
+        with Database.get_cursor() as cursor:
+            cursor.execute(sql, params)
+            results = cursor.fetchall()
+            return [Alarm.from_dict(row) for row in results]
+    
+    @staticmethod
+    def get_enabled_schedule() -> List[Dict[str, Any]]:
+        """
+        按 (分钟, 星期掩码, 人设) 聚合启用闹钟的数量（用于容量预测）
+        在数据库内分组计数，返回的行数只与不同的调度组合数有关，与闹钟总数无关
+        :return: [{'minute_of_day', 'weekday_mask', 'ai_persona_id', 'alarms'}, ...]
+        """
+        sql = """
+        SELECT minute_of_day, weekday_mask, ai_persona_id, COUNT(*) AS alarms FROM alarms
+        WHERE is_enabled = 1 AND minute_of_day IS NOT NULL
+        GROUP BY minute_of_day, weekday_mask, ai_persona_id
+        """
+        with Database.get_cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchall()
+    
+    @staticmethod
+    def _get_owner(cursor, alarm_id: str) -> Optional[str]:
+        """查询并锁定闹钟当前所属用户，用于写操作后的缓存失效"""
+        cursor.execute("SELECT user_id FROM alarms WHERE alarm_id = %s FOR UPDATE", (alarm_id,))
+        row = cursor.fetchone()
+        return row['user_id'] if row else None
+    
+    @staticmethod
+    def _invalidate(alarm_id: str, *user_ids: Optional[str]) -> None:
+        """递增闹钟及相关用户的缓存代数（处于事务中时在提交之后执行）"""
+        scopes = {f'alarm:{alarm_id}'}
+        scopes.update(f'user:{user_id}' for user_id in user_ids if user_id)
+        Database.on_commit(lambda: alarm_cache.bump(*scopes))
+    
+    @staticmethod
+    def _publish(action: str, alarm_id: str, *user_ids: Optional[str]) -> None:
+        """向相关用户的订阅者发布闹钟变更事件（处于事务中时在提交之后发布）"""
+        def publish():
+            for user_id in {user_id for user_id in user_ids if user_id}:
+                change_feed.publish('alarm', action, alarm_id, user_id)
+        Database.on_commit(publish)
 
 
 class AIPersonaDAO:
@@ -164,7 +399,8 @@ class AIPersonaDAO:
                 persona.is_active,
                 persona.is_default
             ))
-            return persona.persona_id
+        AIPersonaDAO._changed('created', persona.persona_id, persona)
+        return persona.persona_id
     
     @staticmethod
     def get_by_id(persona_id: str) -> Optional[AIPersona]:
@@ -173,12 +409,35 @@ class AIPersonaDAO:
         :param persona_id: 人设 ID
         :return: AI人设对象或None
         """
+        if Database.in_transaction():
+            return AIPersonaDAO._load_by_id(persona_id)
+        return persona_flight.do(
+            ('get_by_id', persona_id),
+            lambda: AIPersonaDAO._load_by_id(persona_id)
+        )
+    
+    @staticmethod
+    def _load_by_id(persona_id: str) -> Optional[AIPersona]:
+        """从数据库读取单个AI人设"""
         sql = "SELECT * FROM ai_personas WHERE persona_id = %s"
         with Database.get_cursor() as cursor:
             cursor.execute(sql, (persona_id,))
             result = cursor.fetchone()
             return AIPersona.from_dict(result) if result else None
     
+    @staticmethod
+    def get_for_update(persona_id: str) -> Optional[AIPersona]:
+        """
+        读取并锁定AI人设，直到当前事务结束（在 Database.transaction() 内调用）
+        :param persona_id: 人设 ID
+        :return: AI人设对象或None
+        """
+        sql = "SELECT * FROM ai_personas WHERE persona_id = %s FOR UPDATE"
+        with Database.get_cursor() as cursor:
+            cursor.execute(sql, (persona_id,))
+            result = cursor.fetchone()
+            return AIPersona.from_dict(result) if result else None
+    
     @staticmethod
     def get_all(active_only: bool = True) -> List[AIPersona]:
         """
@@ -186,6 +445,16 @@ class AIPersonaDAO:
         :param active_only: 是否只获取激活的人设
         :return: AI人设列表
         """
+        if Database.in_transaction():
+            return AIPersonaDAO._load_all(active_only)
+        return persona_flight.do(
+            ('get_all', active_only),
+            lambda: AIPersonaDAO._load_all(active_only)
+        )
+    
+    @staticmethod
+    def _load_all(active_only: bool) -> List[AIPersona]:
+        """从数据库读取AI人设列表"""
         sql = "SELECT * FROM ai_personas"
         if active_only:
             sql += " WHERE is_active = 1"
@@ -196,12 +465,48 @@ class AIPersonaDAO:
             results = cursor.fetchall()
             return [AIPersona.from_dict(row) for row in results]
     
+    @staticmethod
+    def get_for_user(user_id: str) -> List[AIPersona]:
+        """
+        获取用户闹钟引用到的AI人设（未指定人设的闹钟使用 gentle）
+        只依赖 user_id，可以与闹钟查询并行执行
+        :param user_id: 用户ID
+        :return: AI人设列表
+        """
+        if Database.in_transaction():
+            return AIPersonaDAO._load_for_user(user_id)
+        return persona_flight.do(
+            ('get_for_user', user_id),
+            lambda: AIPersonaDAO._load_for_user(user_id)
+        )
+    
+    @staticmethod
+    def _load_for_user(user_id: str) -> List[AIPersona]:
+        """从数据库读取用户闹钟引用到的AI人设"""
+        sql = """
+        SELECT * FROM ai_personas
+        WHERE persona_id IN (
+            SELECT DISTINCT COALESCE(NULLIF(ai_persona_id, ''), 'gentle') FROM alarms WHERE user_id = %s
+        )
+        """
+        with Database.get_cursor() as cursor:
+            cursor.execute(sql, (user_id,))
+            results = cursor.fetchall()
+            return [AIPersona.from_dict(row) for row in results]
+    
     @staticmethod
     def get_defaults() -> List[AIPersona]:
         """
         获取默认AI人设
         :return: 默认AI人设列表
         """
+        if Database.in_transaction():
+            return AIPersonaDAO._load_defaults()
+        return persona_flight.do(('get_defaults',), AIPersonaDAO._load_defaults)
+    
+    @staticmethod
+    def _load_defaults() -> List[AIPersona]:
+        """从数据库读取默认AI人设"""
         sql = "SELECT * FROM ai_personas WHERE is_default = 1 AND is_active = 1 ORDER BY created_at ASC"
         with Database.get_cursor() as cursor:
             cursor.execute(sql)
@@ -235,7 +540,10 @@ class AIPersonaDAO:
                 persona.is_default,
                 persona.persona_id
             ))
-            return cursor.rowcount > 0
+            updated = cursor.rowcount > 0
+        if updated:
+            AIPersonaDAO._changed('updated', persona.persona_id, persona)
+        return updated
     
     @staticmethod
     def delete(persona_id: str) -> bool:
@@ -247,7 +555,10 @@ class AIPersonaDAO:
         sql = "DELETE FROM ai_personas WHERE persona_id = %s"
         with Database.get_cursor() as cursor:
             cursor.execute(sql, (persona_id,))
-            return cursor.rowcount > 0
+            deleted = cursor.rowcount > 0
+        if deleted:
+            AIPersonaDAO._changed('deleted', persona_id)
+        return deleted
     
     @staticmethod
     def toggle_status(persona_id: str, is_active: bool) -> bool:
@@ -260,7 +571,10 @@ class AIPersonaDAO:
         sql = "UPDATE ai_personas SET is_active = %s, updated_at = NOW() WHERE persona_id = %s"
         with Database.get_cursor() as cursor:
             cursor.execute(sql, (is_active, persona_id))
-            return cursor.rowcount > 0
+            updated = cursor.rowcount > 0
+        if updated:
+            AIPersonaDAO._changed('updated', persona_id)
+        return updated
     
     @staticmethod
     def search(query: str) -> List[AIPersona]:
@@ -283,3 +597,121 @@ class AIPersonaDAO:
             cursor.execute(sql, (search_term, search_term, search_term))
             results = cursor.fetchall()
             return [AIPersona.from_dict(row) for row in results]
+    
+    @staticmethod
+    def _changed(action: str, persona_id: str, persona: Optional[AIPersona] = None) -> None:
+        """
+        人设写入后（处于事务中时在提交之后）：丢弃进行中的合并查询、失效编译好的模板并发布变更事件
+        :param persona: 新的人设内容，开场白或音色变化时内容地址随之变化，后台合成新音频
+        """
+        def apply():
+            persona_flight.forget()
+            persona_templates.invalidate(persona_id)
+            change_feed.publish('persona', action, persona_id)
+            if persona is not None:
+                opening_audio.refresh(persona)
+        Database.on_commit(apply)
+
+
+class DeviceTokenDAO:
+    """设备推送令牌数据访问对象"""
+    
+    # IN 查询每批的最大参数个数
+    CHUNK_SIZE = 1000
+    
+    @staticmethod
+    def register(token: DeviceToken) -> None:
+        """
+        注册或刷新推送令牌（同一令牌重复注册时更新归属并重新启用）
+        同一 device_id 的其他令牌会被停用，避免令牌轮换后重复推送
+        :param token: 令牌对象
+        """
+        sql = """
+        INSERT INTO device_tokens (device_token, user_id, provider, device_id, app_version,
+                                   is_active, last_seen_at, created_at, updated_at)
+        VALUES (%s, %s, %s, %s, %s, 1, NOW(), NOW(), NOW())
+        ON DUPLICATE KEY UPDATE
+            user_id = VALUES(user_id), provider = VALUES(provider), device_id = VALUES(device_id),
+            app_version = VALUES(app_version), is_active = 1, last_seen_at = NOW(), updated_at = NOW()
+        """
+        with Database.transaction(), Database.get_cursor() as cursor:
+            cursor.execute(sql, (
+                token.device_token,
+                token.user_id,
+                token.provider,
+                token.device_id,
+                token.app_version
+            ))
+            if token.device_id:
+                cursor.execute(
+                    "UPDATE device_tokens SET is_active = 0 WHERE device_id = %s AND device_token != %s AND is_active = 1",
+                    (token.device_id, token.device_token)
+                )
+    
+    @staticmethod
+    def get_by_user(user_id: str, active_only: bool = True) -> List[DeviceToken]:
+        """
+        获取用户的推送令牌
+        :param user_id: 用户ID
+        :param active_only: 是否只返回有效令牌
+        :return: 令牌列表
+        """
+        sql = "SELECT * FROM device_tokens WHERE user_id = %s"
+        if active_only:
+            sql += " AND is_active = 1"
+        sql += " ORDER BY last_seen_at DESC"
+        with Database.get_cursor() as cursor:
+            cursor.execute(sql, (user_id,))
+            results = cursor.fetchall()
+            return [DeviceToken.from_dict(row) for row in results]
+    
+    @staticmethod
+    def get_active_for_users(user_ids: Sequence[str]) -> Dict[str, List[DeviceToken]]:
+        """
+        批量获取多个用户的有效令牌（按 CHUNK_SIZE 分批 IN 查询，走 idx_user_active 索引）
+        :param user_ids: 用户ID列表
+        :return: {user_id: [令牌, ...]}
+        """
+        unique_ids = list(dict.fromkeys(user_ids))
+        tokens: Dict[str, List[DeviceToken]] = {}
+        with Database.get_cursor() as cursor:
+            for i in range(0, len(unique_ids), DeviceTokenDAO.CHUNK_SIZE):
+                chunk = unique_ids[i:i + DeviceTokenDAO.CHUNK_SIZE]
+                placeholders = ', '.join(['%s'] * len(chunk))
+                cursor.execute(
+                    f"SELECT * FROM device_tokens WHERE user_id IN ({placeholders}) AND is_active = 1",
+                    chunk
+                )
+                for row in cursor.fetchall():
+                    tokens.setdefault(row['user_id'], []).append(DeviceToken.from_dict(row))
+        return tokens
+    
+    @staticmethod
+    def deactivate(device_tokens: Sequence[str]) -> int:
+        """
+        停用推送网关报告为无效的令牌
+        :param device_tokens: 令牌列表
+        :return: 停用的行数
+        """
+        updated = 0
+        with Database.get_cursor() as cursor:
+            for i in range(0, len(device_tokens), DeviceTokenDAO.CHUNK_SIZE):
+                chunk = list(device_tokens[i:i + DeviceTokenDAO.CHUNK_SIZE])
+                placeholders = ', '.join(['%s'] * len(chunk))
+                cursor.execute(
+                    f"UPDATE device_tokens SET is_active = 0 WHERE device_token IN ({placeholders})",
+                    chunk
+                )
+                updated += cursor.rowcount
+        return updated
+    
+    @staticmethod
+    def delete(device_token: str) -> bool:
+        """
+        删除推送令牌（用户退出登录时）
+        :param device_token: 令牌
+        :return: 是否删除成功
+        """
+        with Database.get_cursor() as cursor:
+            cursor.execute("DELETE FROM device_tokens WHERE device_token = %s", (device_token,))
+            return cursor.rowcount > 0
@@ -1,22 +1,441 @@
 """
 数据库连接管理
+
+默认每次 get_cursor() 使用一个新连接。在 Database.session() 内（Flask 请求与批处理任务），
+同一线程的所有 DAO 调用共用一个连接；Database.transaction() 内的调用还共用一个事务，
+退出时提交，异常时回滚，缓存失效与变更推送通过 on_commit() 推迟到提交之后。
+
+Database.deadline() 内的语句受剩余时间约束：
+- 预算已用完时不再发送语句，直接抛出 QueryTimeout
+- SELECT 带上 MAX_EXECUTION_TIME 提示，由 MySQL 在到期时中止
+- 其他语句（以及提示不生效的 SELECT ... FOR UPDATE）到期后由后台线程通过另一个连接 KILL QUERY
+
+Database.set_connection_quota() 之后新建的连接占用该配额（准入控制按请求类别设置），
+配额用完时等待其他连接关闭，最多等待连接超时。
 """
+import heapq
+import itertools
+import re
+import threading
+import time
+import traceback
 import pymysql
 from pymysql.cursors import DictCursor
 from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from config import Config
 
 
+# 主键或唯一索引冲突的错误码
+ER_DUP_ENTRY = 1062
+# 语句超过 MAX_EXECUTION_TIME 被中止 / 语句被 KILL QUERY 中止
+ER_QUERY_TIMEOUT = 3024
+ER_QUERY_INTERRUPTED = 1317
+
+SELECT_PATTERN = re.compile(r'^\s*SELECT\b', re.IGNORECASE)
+
+
+class QueryTimeout(TimeoutError):
+    """超出查询时限"""
+
+
+class ConnectionQuotaExceeded(pymysql.err.OperationalError):
+    """等待连接配额超时"""
+
+
+class Deadline:
+    """一次请求或任务的查询时限"""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+        # 是否有语句因时限失败，供 HTTP 层返回 504
+        self.exceeded = False
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expire(self, message: str) -> QueryTimeout:
+        self.exceeded = True
+        return QueryTimeout(message)
+
+
+_deadline: ContextVar[Optional[Deadline]] = ContextVar('db_deadline', default=None)
+
+
+class QueryWatchdog:
+    """到期仍未返回的语句，由后台线程通过另一个连接 KILL QUERY"""
+
+    def __init__(self, grace: float):
+        """
+        :param grace: 到期后再等待的秒数，SELECT 优先由 MAX_EXECUTION_TIME 在服务端中止
+        """
+        self.grace = grace
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[float, int]] = []
+        self._watched: Dict[int, int] = {}
+        self._ids = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self.kills = 0
+
+    def watch(self, connection_id: int, expires_at: float) -> int:
+        """
+        登记一条执行中的语句
+        :param connection_id: 服务端连接ID (Connection.thread_id())
+        :param expires_at: 时限（单调时间）
+        :return: 传给 done() 的句柄
+        """
+        handle = next(self._ids)
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='query-watchdog', daemon=True)
+                self._thread.start()
+            self._watched[handle] = connection_id
+            heapq.heappush(self._heap, (expires_at + self.grace, handle))
+            if self._heap[0][1] == handle:
+                self._cond.notify()
+        return handle
+
+    def done(self, handle: int) -> None:
+        """语句已返回"""
+        with self._cond:
+            self._watched.pop(handle, None)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    # 已返回的语句直接丢弃
+                    while self._heap and self._heap[0][1] not in self._watched:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                _, handle = heapq.heappop(self._heap)
+                connection_id = self._watched.pop(handle)
+            self._kill(connection_id)
+
+    def _kill(self, connection_id: int) -> None:
+        try:
+            connection = pymysql.connect(**Config.DB_CONFIG)
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("KILL QUERY %s", (connection_id,))
+            finally:
+                connection.close()
+            self.kills += 1
+        except pymysql.Error:
+            print(f"终止超时语句失败: {traceback.format_exc()}")
+
+
+watchdog = QueryWatchdog(Config.QUERY_KILL_GRACE)
+
+
+class ConnectionQuota:
+    """一类请求可同时占用的数据库连接数"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self._cond = threading.Condition()
+        self.in_use = 0
+        self.peak = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def acquire(self, timeout: Optional[float]) -> bool:
+        """
+        占用一个连接名额
+        :param timeout: 最长等待秒数，None 表示一直等待
+        :return: 是否成功
+        """
+        with self._cond:
+            if self.in_use >= self.limit:
+                self.waits += 1
+                if not self._cond.wait_for(lambda: self.in_use < self.limit, timeout):
+                    self.timeouts += 1
+                    return False
+            self.in_use += 1
+            self.peak = max(self.peak, self.in_use)
+            return True
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_use -= 1
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'in_use': self.in_use,
+                'peak': self.peak,
+                'waits': self.waits,
+                'timeouts': self.timeouts
+            }
+
+
+_connection_quota: ContextVar[Optional[ConnectionQuota]] = ContextVar('db_connection_quota', default=None)
+
+
+class QuotaConnection(pymysql.connections.Connection):
+    """占用连接配额的连接，关闭时归还"""
+
+    quota: Optional[ConnectionQuota] = None
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            quota, self.quota = self.quota, None
+            if quota is not None:
+                quota.release()
+
+
+class DeadlineCursor(DictCursor):
+    """按当前时限执行语句的游标，没有时限时与 DictCursor 相同"""
+
+    def execute(self, query, args=None):
+        deadline = _deadline.get()
+        if deadline is None:
+            return super().execute(query, args)
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            raise deadline.expire("超出查询时限，未执行")
+        if SELECT_PATTERN.match(query) and 'MAX_EXECUTION_TIME' not in query:
+            query = SELECT_PATTERN.sub(
+                lambda match: f'{match.group(0)} /*+ MAX_EXECUTION_TIME({max(1, int(remaining * 1000))}) */',
+                query,
+                count=1
+            )
+        handle = watchdog.watch(self.connection.thread_id(), deadline.expires_at)
+        try:
+            return super().execute(query, args)
+        except pymysql.err.MySQLError as e:
+            if e.args[:1] in ((ER_QUERY_TIMEOUT,), (ER_QUERY_INTERRUPTED,)):
+                raise deadline.expire("超出查询时限，语句已中止") from e
+            raise
+        finally:
+            watchdog.done(handle)
+
+
+class Session:
+    """一个请求或批处理任务内共用的连接，首次使用时才建立"""
+
+    def __init__(self):
+        self.connection = None
+        # 连接不能跨线程使用，其他线程（例如线程池）看不到这个会话
+        self.thread_id = threading.get_ident()
+        self.transaction_depth = 0
+        self.on_commit: List[Callable[[], Any]] = []
+        self.connects = 0
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = Database.connect()
+            self.connects += 1
+        return self.connection
+
+    def discard(self) -> None:
+        """关闭连接，下次使用时重新建立（连接出错后调用）"""
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except pymysql.Error:
+                pass
+            self.connection = None
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.transaction_depth > 0
+
+
+_session: ContextVar[Optional[Session]] = ContextVar('db_session', default=None)
+
+
 class Database:
     """数据库连接管理类"""
     
+    @staticmethod
+    def is_duplicate_entry(error: Exception) -> bool:
+        """是否为主键/唯一索引冲突"""
+        return isinstance(error, pymysql.err.IntegrityError) and error.args[:1] == (ER_DUP_ENTRY,)
+    
+    @staticmethod
+    def connect():
+        """
+        建立新连接，处于时限内时连接超时不超过剩余时间；
+        设置了连接配额时先占用配额，等待时间计入连接超时
+        """
+        options = dict(Config.DB_CONFIG)
+        deadline = _deadline.get()
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise deadline.expire("超出查询时限，未建立连接")
+            options['connect_timeout'] = min(options.get('connect_timeout') or remaining, remaining)
+        quota = _connection_quota.get()
+        if quota is None:
+            return pymysql.connect(**options, cursorclass=DeadlineCursor)
+        
+        if not quota.acquire(options.get('connect_timeout')):
+            if deadline is not None and deadline.remaining() <= 0:
+                raise deadline.expire("超出查询时限，等待数据库连接配额")
+            raise ConnectionQuotaExceeded(f"{quota.name} 类请求的数据库连接配额已用完")
+        try:
+            connection = QuotaConnection(**options, cursorclass=DeadlineCursor)
+        except BaseException:
+            quota.release()
+            raise
+        connection.quota = quota
+        return connection
+    
+    @staticmethod
+    def set_connection_quota(quota: ConnectionQuota) -> Token:
+        """
+        之后新建的连接占用 quota，供准入控制使用
+        :return: 传给 reset_connection_quota() 的令牌
+        """
+        return _connection_quota.set(quota)
+    
+    @staticmethod
+    def reset_connection_quota(token: Token) -> None:
+        _connection_quota.reset(token)
+    
+    @staticmethod
+    def set_deadline(seconds: float) -> Token:
+        """
+        设置查询时限，供请求钩子使用；外层已有更早的时限时沿用外层
+        :param seconds: 从现在起的秒数
+        :return: 传给 reset_deadline() 的令牌
+        """
+        deadline = Deadline(seconds)
+        outer = _deadline.get()
+        if outer is not None and outer.expires_at < deadline.expires_at:
+            deadline = outer
+        return _deadline.set(deadline)
+    
+    @staticmethod
+    def reset_deadline(token: Token) -> None:
+        _deadline.reset(token)
+    
+    @staticmethod
+    def current_deadline() -> Optional[Deadline]:
+        return _deadline.get()
+    
+    @staticmethod
+    @contextmanager
+    def deadline(seconds: float):
+        """块内的数据库调用共用 seconds 秒的时限"""
+        token = Database.set_deadline(seconds)
+        try:
+            yield _deadline.get()
+        finally:
+            Database.reset_deadline(token)
+    
+    @staticmethod
+    def current_session() -> Optional[Session]:
+        """当前线程的会话，没有时为 None"""
+        session = _session.get()
+        if session is not None and session.thread_id == threading.get_ident():
+            return session
+        return None
+    
+    @staticmethod
+    def open_session() -> Optional[Token]:
+        """
+        开启会话，供请求钩子使用；已有会话时沿用
+        :return: 传给 close_session() 的令牌，沿用已有会话时为 None
+        """
+        if Database.current_session() is not None:
+            return None
+        return _session.set(Session())
+    
+    @staticmethod
+    def close_session(token: Optional[Token]) -> None:
+        """关闭 open_session() 开启的会话并归还连接"""
+        if token is None:
+            return
+        session = _session.get()
+        _session.reset(token)
+        if session is not None:
+            if session.in_transaction:
+                # 事务未正常结束（不应发生），放弃未提交的修改
+                session.transaction_depth = 0
+                session.on_commit = []
+            session.discard()
+    
+    @staticmethod
+    @contextmanager
+    def session():
+        """同一线程内的 DAO 调用共用一个连接，嵌套调用沿用外层会话"""
+        token = Database.open_session()
+        try:
+            yield Database.current_session()
+        finally:
+            Database.close_session(token)
+    
+    @staticmethod
+    @contextmanager
+    def transaction():
+        """
+        事务：块内的 DAO 调用共用一个连接与事务，正常退出时提交，异常时回滚。
+        嵌套调用并入外层事务，由最外层提交。
+        """
+        with Database.session() as session:
+            if session.in_transaction:
+                session.transaction_depth += 1
+                try:
+                    yield session
+                finally:
+                    session.transaction_depth -= 1
+                return
+            
+            connection = session.connect()
+            connection.begin()
+            session.transaction_depth = 1
+            callbacks = session.on_commit = []
+            try:
+                yield session
+                connection.commit()
+            except BaseException:
+                try:
+                    connection.rollback()
+                except pymysql.Error:
+                    session.discard()
+                raise
+            finally:
+                session.transaction_depth = 0
+                session.on_commit = []
+            for callback in callbacks:
+                callback()
+    
+    @staticmethod
+    def in_transaction() -> bool:
+        """当前线程是否处于事务中"""
+        session = Database.current_session()
+        return session is not None and session.in_transaction
+    
+    @staticmethod
+    def on_commit(callback: Callable[[], Any]) -> None:
+        """在当前事务提交后执行回调（回滚则丢弃），不在事务中时立即执行"""
+        session = Database.current_session()
+        if session is not None and session.in_transaction:
+            session.on_commit.append(callback)
+        else:
+            callback()
+    
     @staticmethod
     @contextmanager
     def get_connection():
         """获取数据库连接的上下文管理器"""
         connection = None
         try:
-            connection = pymysql.connect(**Config.DB_CONFIG, cursorclass=DictCursor)
+            connection = Database.connect()
             yield connection
         except pymysql.Error as e:
             if connection:
@@ -29,14 +448,34 @@ class Database:
     @staticmethod
     @contextmanager
     def get_cursor():
-        """获取游标的上下文管理器"""
-        with Database.get_connection() as conn:
-            cursor = conn.cursor()
-            try:
-                yield cursor
+        """获取游标的上下文管理器，处于会话中时使用会话的连接"""
+        session = Database.current_session()
+        if session is None:
+            with Database.get_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    yield cursor
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    raise e
+                finally:
+                    cursor.close()
+            return
+        
+        conn = session.connect()
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            # 事务中由 transaction() 统一提交
+            if not session.in_transaction:
                 conn.commit()
-            except Exception as e:
-                conn.rollback()
-                raise e
-            finally:
-                cursor.close()
+        except Exception as e:
+            if not session.in_transaction:
+                if isinstance(e, (pymysql.err.OperationalError, pymysql.err.InterfaceError)):
+                    session.discard()
+                else:
+                    conn.rollback()
+            raise e
+        finally:
+            cursor.close()
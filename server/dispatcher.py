@@ -0,0 +1,379 @@
+"""
+叫醒调度：削峰与预热
+
+同一分钟到点的闹钟不会在同一秒全部发起 AI 会话：
+- 提前 prewarm 秒读取下一分钟到点的闹钟，预先构建每通电话的指示词（闹钟上下文 + 人设提示词），
+  到点时只需把现成的文本交给会话后端
+- 启动时间在 [到点 - tolerance, 到点 + tolerance] 内均匀错开
+- 每个人设有并发上限，名额用完的通话排队，等前面的会话结束后再启动
+
+时钟与会话后端均可替换：
+- 生产环境使用 push.PushSessionBackend，在每通电话错峰后的启动时间推送唤起设备来电：
+    python push.py --staggered
+- SimulatedClock + FakeSessionBackend 可在不等待真实时间的情况下回放一个早高峰：
+    python dispatcher.py --at 07:00 --weekday 1
+"""
+import argparse
+import hashlib
+import heapq
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from config import Config
+from dao import AlarmDAO, AIPersonaDAO
+from database import Database
+from models import Alarm, AIPersona
+from prompts import CompiledPersona, render_directive
+
+
+class Clock:
+    """时钟接口，时间均为 Unix 秒"""
+
+    def now(self) -> float:
+        raise NotImplementedError
+
+    def sleep(self, seconds: float) -> None:
+        raise NotImplementedError
+
+
+class SystemClock(Clock):
+    """真实时钟"""
+
+    def now(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+
+class SimulatedClock(Clock):
+    """模拟时钟，sleep 直接推进时间，用于测试和回放"""
+
+    def __init__(self, start: float):
+        self._now = start
+
+    def now(self) -> float:
+        return self._now
+
+    def sleep(self, seconds: float) -> None:
+        self._now += max(seconds, 0.0)
+
+
+class WakeCall:
+    """一通待发起的叫醒电话"""
+
+    def __init__(self, alarm: Alarm, fire_at: float, start_at: float, directive: str, voice_id: Optional[str]):
+        """
+        :param alarm: 闹钟
+        :param fire_at: 闹钟到点时间
+        :param start_at: 错峰后的计划启动时间
+        :param directive: 预先构建好的指示词
+        :param voice_id: 人设音色
+        """
+        self.alarm = alarm
+        self.fire_at = fire_at
+        self.start_at = start_at
+        self.directive = directive
+        self.voice_id = voice_id
+        self.started_at: Optional[float] = None
+        # 是否因人设名额已满而排过队
+        self.deferred = False
+
+    @property
+    def key(self) -> str:
+        """同一闹钟每次响铃唯一"""
+        return f'{self.alarm.alarm_id}@{int(self.fire_at)}'
+
+    @property
+    def persona_id(self) -> str:
+        return self.alarm.ai_persona_id or 'gentle'
+
+
+class SessionBackend:
+    """AI 会话后端接口"""
+
+    def start(self, call: WakeCall) -> None:
+        """
+        发起会话，应尽快返回；会话结束后由后端调用 WakeDispatcher.finish(call)
+        :raises Exception: 发起失败，调度器会释放名额并计入失败数
+        """
+        raise NotImplementedError
+
+
+class FakeSessionBackend(SessionBackend):
+    """记录启动时间的假后端，会话在 call_seconds 之后由调度器超时回收"""
+
+    def __init__(self, clock: Clock):
+        self.clock = clock
+        self.started: List[Tuple[float, WakeCall]] = []
+
+    def start(self, call: WakeCall) -> None:
+        self.started.append((self.clock.now(), call))
+
+
+def parse_limits(text: str) -> Dict[str, int]:
+    """
+    解析按人设的并发上限配置
+    :param text: 形如 "gentle=800,strict=200"
+    :return: {persona_id: limit}
+    """
+    limits = {}
+    for item in text.split(','):
+        if '=' in item:
+            persona_id, limit = item.split('=', 1)
+            limits[persona_id.strip()] = int(limit)
+    return limits
+
+
+class WakeDispatcher:
+    """错峰、限流并预热的叫醒调度器"""
+
+    def __init__(
+        self,
+        backend: SessionBackend,
+        clock: Optional[Clock] = None,
+        tolerance: float = Config.WAKE_DISPATCH_TOLERANCE,
+        prewarm: float = Config.WAKE_DISPATCH_PREWARM,
+        default_limit: int = Config.WAKE_PERSONA_CONCURRENCY,
+        persona_limits: Optional[Dict[str, int]] = None,
+        call_seconds: float = Config.WAKE_CALL_MINUTES * 60,
+        utc_offset_minutes: int = Config.ALARM_UTC_OFFSET_MINUTES,
+        load_alarms: Callable[..., List[Alarm]] = AlarmDAO.get_enabled_in_window,
+        load_persona: Callable[[str], Optional[AIPersona]] = AIPersonaDAO.get_by_id
+    ):
+        """
+        :param backend: 会话后端
+        :param clock: 时钟，默认真实时钟
+        :param tolerance: 错峰窗口半宽（秒）
+        :param prewarm: 到点前多少秒开始构建该分钟的通话
+        :param default_limit: 每个人设的默认并发上限
+        :param persona_limits: 按人设覆盖并发上限，默认读取 WAKE_PERSONA_LIMITS
+        :param call_seconds: 后端未回调 finish 时，会话名额的最长占用秒数
+        :param utc_offset_minutes: 闹钟时间所在时区
+        :param load_alarms: 按 (起始分钟, 结束分钟, 日期) 读取启用闹钟
+        :param load_persona: 按 ID 读取人设
+        """
+        self.backend = backend
+        self.clock = clock or SystemClock()
+        self.tolerance = tolerance
+        self.prewarm = prewarm
+        self.default_limit = default_limit
+        self.persona_limits = parse_limits(Config.WAKE_PERSONA_LIMITS) if persona_limits is None else persona_limits
+        self.call_seconds = call_seconds
+        self.tz = timezone(timedelta(minutes=utc_offset_minutes))
+        self.load_alarms = load_alarms
+        self.load_persona = load_persona
+
+        self._lock = threading.Lock()
+        # 已预热、等待计划启动时间的通话：(start_at, 序号, call)
+        self._pending: List[Tuple[float, int, WakeCall]] = []
+        self._seq = 0
+        # 已到计划时间但人设名额已满的通话
+        self._waiting: Dict[str, Deque[WakeCall]] = {}
+        # 进行中的会话：key -> persona_id，以及按超时时间排序的堆
+        self._active: Dict[str, str] = {}
+        self._active_count: Dict[str, int] = {}
+        self._expiry: List[Tuple[float, str]] = []
+        # 下一个需要预热的整分钟
+        self._next_minute = (int(self.clock.now()) // 60 + 1) * 60
+
+        self.prepared = 0
+        self.started = 0
+        self.deferred = 0
+        self.failed = 0
+        self.skipped_minutes = 0
+        self.max_lateness = 0.0
+
+    def limit_for(self, persona_id: str) -> int:
+        return self.persona_limits.get(persona_id, self.default_limit)
+
+    def prepare(self, minute_start: float) -> int:
+        """
+        预热某一分钟到点的所有闹钟
+        :param minute_start: 该分钟开始的 Unix 秒
+        :return: 预热的通话数
+        """
+        local = datetime.fromtimestamp(minute_start, self.tz)
+        minute_of_day = local.hour * 60 + local.minute
+        # 闹钟与各人设的查询共用一个连接
+        with Database.session():
+            alarms = self.load_alarms(minute_of_day, minute_of_day, local.date())
+            if not alarms:
+                return 0
+
+            # 每个人设只编译一次，逐个闹钟只格式化上下文部分
+            templates: Dict[str, CompiledPersona] = {}
+            for alarm in alarms:
+                persona_id = alarm.ai_persona_id or 'gentle'
+                if persona_id not in templates:
+                    templates[persona_id] = CompiledPersona(self.load_persona(persona_id))
+
+        # 按闹钟ID的哈希排序后均匀铺满窗口：同一闹钟每天的偏移稳定，各人设在窗口内也大致均匀
+        alarms.sort(key=lambda alarm: hashlib.md5(alarm.alarm_id.encode('utf-8')).digest())
+        span = 2 * self.tolerance
+        calls = []
+        for i, alarm in enumerate(alarms):
+            template = templates[alarm.ai_persona_id or 'gentle']
+            start_at = minute_start - self.tolerance + span * (i + 0.5) / len(alarms)
+            try:
+                directive = render_directive(alarm, template, local).text
+            except Exception:
+                # 单个闹钟的数据问题不影响同一分钟的其他闹钟
+                print(f"构建叫醒指示词失败 {alarm.alarm_id}: {traceback.format_exc()}")
+                self.failed += 1
+                continue
+            calls.append(WakeCall(
+                alarm,
+                fire_at=minute_start,
+                start_at=start_at,
+                directive=directive,
+                voice_id=template.voice_id
+            ))
+
+        with self._lock:
+            for call in calls:
+                self._seq += 1
+                heapq.heappush(self._pending, (call.start_at, self._seq, call))
+            self.prepared += len(calls)
+        return len(calls)
+
+    def tick(self) -> int:
+        """
+        执行一轮调度：预热即将到点的分钟、回收超时会话、启动到期的通话
+        :return: 本轮启动的通话数
+        """
+        now = self.clock.now()
+        while self._next_minute - now <= self.prewarm + self.tolerance:
+            try:
+                self.prepare(self._next_minute)
+            except Exception:
+                print(f"预热叫醒通话失败 {datetime.fromtimestamp(self._next_minute, self.tz)}: {traceback.format_exc()}")
+                # 错峰窗口开始前留到下一轮重试，之后放弃该分钟，避免阻塞后续分钟
+                if self._next_minute - self.tolerance > now:
+                    break
+                self.skipped_minutes += 1
+            self._next_minute += 60
+
+        to_start = []
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, key = heapq.heappop(self._expiry)
+                self._release(key)
+            while self._pending and self._pending[0][0] <= now:
+                _, _, call = heapq.heappop(self._pending)
+                self._waiting.setdefault(call.persona_id, deque()).append(call)
+            for persona_id, queue in self._waiting.items():
+                limit = self.limit_for(persona_id)
+                while queue and self._active_count.get(persona_id, 0) < limit:
+                    call = queue.popleft()
+                    self._acquire(call, now)
+                    to_start.append(call)
+            for queue in self._waiting.values():
+                for call in queue:
+                    if not call.deferred:
+                        call.deferred = True
+                        self.deferred += 1
+            self._waiting = {persona_id: queue for persona_id, queue in self._waiting.items() if queue}
+
+        for call in to_start:
+            call.started_at = now
+            try:
+                self.backend.start(call)
+                self.started += 1
+                self.max_lateness = max(self.max_lateness, now - call.start_at)
+            except Exception as e:
+                print(f"发起叫醒会话失败 {call.key}: {e}")
+                self.failed += 1
+                self.finish(call)
+        return len(to_start)
+
+    def finish(self, call: WakeCall) -> None:
+        """会话结束，释放人设名额"""
+        with self._lock:
+            self._release(call.key)
+
+    def next_wakeup(self) -> float:
+        """距离下一次需要调度的秒数"""
+        now = self.clock.now()
+        with self._lock:
+            candidates = [self._next_minute - self.prewarm - self.tolerance]
+            if self._pending:
+                candidates.append(self._pending[0][0])
+            if self._expiry and self._waiting:
+                candidates.append(self._expiry[0][0])
+        return max(min(candidates) - now, 0.0)
+
+    def run(self, stop: threading.Event, max_sleep: float = 1.0) -> None:
+        """持续调度直到 stop 被置位"""
+        while not stop.is_set():
+            try:
+                self.tick()
+            except Exception:
+                print(f"叫醒调度错误: {traceback.format_exc()}")
+            self.clock.sleep(min(self.next_wakeup(), max_sleep))
+
+    def run_until(self, end: float) -> None:
+        """推进到指定时间，配合 SimulatedClock 使用"""
+        while self.clock.now() < end:
+            self.tick()
+            self.clock.sleep(min(self.next_wakeup(), end - self.clock.now()) or 0.001)
+        self.tick()
+
+    def _acquire(self, call: WakeCall, now: float) -> None:
+        self._active[call.key] = call.persona_id
+        self._active_count[call.persona_id] = self._active_count.get(call.persona_id, 0) + 1
+        heapq.heappush(self._expiry, (now + self.call_seconds, call.key))
+
+    def _release(self, key: str) -> None:
+        persona_id = self._active.pop(key, None)
+        if persona_id is not None:
+            self._active_count[persona_id] -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """调度统计"""
+        with self._lock:
+            return {
+                'prepared': self.prepared,
+                'started': self.started,
+                'deferred': self.deferred,
+                'failed': self.failed,
+                'skipped_minutes': self.skipped_minutes,
+                'max_lateness': round(self.max_lateness, 3),
+                'pending': len(self._pending),
+                'waiting': sum(len(queue) for queue in self._waiting.values()),
+                'active': {persona_id: count for persona_id, count in self._active_count.items() if count}
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用模拟时钟回放某一分钟的叫醒高峰")
+    parser.add_argument('--at', default='07:00', help="闹钟时间 HH:MM")
+    parser.add_argument('--weekday', type=int, default=1, help="星期，1-7 表示周一到周日")
+    parser.add_argument('--tolerance', type=float, default=Config.WAKE_DISPATCH_TOLERANCE, help="错峰窗口半宽（秒）")
+    args = parser.parse_args()
+
+    tz = timezone(timedelta(minutes=Config.ALARM_UTC_OFFSET_MINUTES))
+    hour, minute = (int(part) for part in args.at.split(':'))
+    # 2024-01-01 是周一
+    fire_at = datetime(2024, 1, args.weekday, hour, minute, tzinfo=tz).timestamp()
+
+    clock = SimulatedClock(fire_at - Config.WAKE_DISPATCH_PREWARM - args.tolerance - 1)
+    backend = FakeSessionBackend(clock)
+    dispatcher = WakeDispatcher(backend, clock, tolerance=args.tolerance)
+    dispatcher.run_until(fire_at + args.tolerance + 60)
+
+    per_second: Dict[int, int] = {}
+    for started_at, _ in backend.started:
+        second = int(started_at - fire_at)
+        per_second[second] = per_second.get(second, 0) + 1
+    print(f"调度统计: {dispatcher.stats()}")
+    if per_second:
+        peak_second = max(per_second, key=per_second.get)
+        print(f"每秒最多启动 {per_second[peak_second]} 通（到点后 {peak_second} 秒）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+变更事件流
+
+DAO 写操作提交后发布闹钟/人设变更事件，订阅者（SSE 连接）按游标增量拉取。
+事件保存在固定长度的环形缓冲区中，客户端断线重连时携带最后的游标即可续传；
+游标早于缓冲区时返回 reset，客户端应执行一次全量同步。
+
+每个订阅者只持有一个 Event，发布时只唤醒相关用户的订阅者，
+配合 gevent 等协程 worker 可支撑大量空闲长连接。
+"""
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Set, Tuple
+from config import Config
+
+
+# 人设变更对所有用户可见
+BROADCAST = '*'
+
+
+class ChangeFeed:
+    """带游标的进程内变更事件流"""
+
+    def __init__(self, capacity: int):
+        """
+        :param capacity: 环形缓冲区保留的事件数
+        """
+        self._lock = threading.Lock()
+        self._events: deque = deque(maxlen=capacity)
+        self._seq = itertools.count(1)
+        self._last_seq = 0
+        self._subscribers: Dict[str, Set[threading.Event]] = {}
+
+    @property
+    def cursor(self) -> int:
+        """当前最新事件的游标"""
+        return self._last_seq
+
+    def publish(self, entity: str, action: str, entity_id: str, user_id: Optional[str] = None) -> None:
+        """
+        发布变更事件
+        :param entity: 实体类型 (alarm / persona)
+        :param action: 动作 (created / updated / deleted)
+        :param entity_id: 实体ID
+        :param user_id: 所属用户，None 表示广播给所有订阅者
+        """
+        audience = user_id or BROADCAST
+        with self._lock:
+            seq = next(self._seq)
+            self._last_seq = seq
+            self._events.append((seq, audience, {
+                'entity': entity,
+                'action': action,
+                'id': entity_id,
+                'user_id': user_id,
+                'ts': time.time()
+            }))
+            if audience == BROADCAST:
+                waiters = [w for group in self._subscribers.values() for w in group]
+            else:
+                waiters = list(self._subscribers.get(audience, ()))
+        for waiter in waiters:
+            waiter.set()
+
+    def read(self, user_id: str, cursor: int) -> Tuple[List[Tuple[int, Dict[str, Any]]], int, bool]:
+        """
+        读取游标之后与该用户相关的事件
+        :param user_id: 用户ID
+        :param cursor: 上次读取到的游标
+        :return: (事件列表, 新游标, 是否需要全量同步)
+        """
+        with self._lock:
+            # 游标已被环形缓冲区淘汰，或来自重启之前的进程
+            if cursor > self._last_seq or (self._events and cursor < self._events[0][0] - 1):
+                return [], self._last_seq, True
+            # 从最新事件向前扫描，耗时只与新增事件数有关
+            events = []
+            for seq, audience, payload in reversed(self._events):
+                if seq <= cursor:
+                    break
+                if audience == user_id or audience == BROADCAST:
+                    events.append((seq, payload))
+            events.reverse()
+            return events, self._last_seq, False
+
+    def subscribe(self, user_id: str) -> threading.Event:
+        """注册订阅者，返回有新事件时被置位的 Event"""
+        waiter = threading.Event()
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(waiter)
+        return waiter
+
+    def unsubscribe(self, user_id: str, waiter: threading.Event) -> None:
+        """注销订阅者"""
+        with self._lock:
+            group = self._subscribers.get(user_id)
+            if group:
+                group.discard(waiter)
+                if not group:
+                    del self._subscribers[user_id]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(group) for group in self._subscribers.values())
+
+
+change_feed = ChangeFeed(Config.CHANGE_FEED_BUFFER)
@@ -0,0 +1,200 @@
+"""
+叫醒通话容量预测
+
+将启用闹钟按调度列 (minute_of_day, weekday_mask, ai_persona_id) 分组计数后载入 NumPy 数组，
+预测未来若干天每分钟同时进行的 AI 叫醒通话数，并按人设、音色拆分，用于提前扩容语音后端。
+
+- 分组计数在数据库内完成，载入的行数只与不同的调度组合数有关，不随闹钟总数增长
+- 一次带权 bincount 按 (星期掩码, 分钟, 人设) 汇总
+- 星期展开是 (天数 × 不同掩码数) 的矩阵乘法，与闹钟总数无关
+- 通话时长通过累加和的滑动窗口折算为并发数，前一天深夜的通话会延续到当天凌晨
+- alarms 表没有时区列，所有闹钟按 Config.ALARM_UTC_OFFSET_MINUTES 所在时区解释
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+from config import Config
+from dao import AlarmDAO, AIPersonaDAO
+from models import ALL_WEEKDAYS_MASK
+
+
+MINUTES_PER_DAY = 1440
+MAX_DAYS = 14
+MAX_CALL_MINUTES = 60
+# 人设已删除或为空时使用的标签
+UNKNOWN = 'unknown'
+
+
+class Schedule:
+    """启用闹钟的列式调度数据"""
+
+    def __init__(
+        self,
+        minutes: np.ndarray,
+        masks: np.ndarray,
+        persona_codes: np.ndarray,
+        personas: List[str],
+        counts: Optional[np.ndarray] = None
+    ):
+        """
+        :param minutes: 每组闹钟的当天分钟数 (0-1439)
+        :param masks: 每组闹钟的星期位掩码 (0 表示一次性)
+        :param persona_codes: 每组闹钟的人设下标，指向 personas
+        :param personas: 人设ID列表
+        :param counts: 每组的闹钟数，默认每组一个闹钟
+        """
+        self.minutes = minutes
+        self.masks = masks
+        self.persona_codes = persona_codes
+        self.personas = personas
+        self.counts = counts if counts is not None else np.ones(len(minutes), dtype=np.int64)
+
+    def __len__(self) -> int:
+        """闹钟总数"""
+        return int(self.counts.sum())
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Dict[str, Any]]) -> 'Schedule':
+        """由 AlarmDAO.get_enabled_schedule() 的分组计数结果构建"""
+        index: Dict[str, int] = {}
+        count = len(rows)
+        minutes = np.fromiter((row['minute_of_day'] for row in rows), dtype=np.int64, count=count)
+        masks = np.fromiter((row['weekday_mask'] for row in rows), dtype=np.int64, count=count) & ALL_WEEKDAYS_MASK
+        codes = np.fromiter(
+            (index.setdefault(row['ai_persona_id'] or UNKNOWN, len(index)) for row in rows),
+            dtype=np.int64,
+            count=count
+        )
+        counts = np.fromiter((row['alarms'] for row in rows), dtype=np.int64, count=count)
+        return cls(minutes, masks, codes, list(index), counts)
+
+
+def load_schedule() -> Schedule:
+    """从数据库载入启用闹钟"""
+    return Schedule.from_rows(AlarmDAO.get_enabled_schedule())
+
+
+def concurrent_calls(
+    schedule: Schedule,
+    start_weekday: int,
+    start_minute: int,
+    days: int,
+    call_minutes: int
+) -> np.ndarray:
+    """
+    计算每分钟各人设的并发通话数
+    :param schedule: 调度数据
+    :param start_weekday: 预测首日的星期，1-7 表示周一到周日
+    :param start_minute: 当前时间在首日的分钟数，一次性闹钟在此之前的时间落到次日
+    :param days: 预测天数
+    :param call_minutes: 单次通话持续的分钟数
+    :return: 形状为 (days, 1440, 人设数) 的并发数
+    """
+    groups = len(schedule.personas)
+    if groups == 0:
+        return np.zeros((days, MINUTES_PER_DAY, 0), dtype=np.int64)
+    # 只为实际出现的掩码分配计数行，避免 128 × 1440 × 人设数 的稀疏矩阵
+    present = np.flatnonzero(np.bincount(schedule.masks, minlength=128))
+    if 0 not in present:
+        present = np.concatenate(([0], present))
+    mask_rows = np.zeros(128, dtype=np.int64)
+    mask_rows[present] = np.arange(len(present))
+
+    key = (mask_rows[schedule.masks] * MINUTES_PER_DAY + schedule.minutes) * groups + schedule.persona_codes
+    counts = np.bincount(key, weights=schedule.counts, minlength=len(present) * MINUTES_PER_DAY * groups)
+    counts = counts.astype(np.int64).reshape(len(present), MINUTES_PER_DAY * groups)
+
+    # 额外计算首日前一天，用于前一天深夜开始、跨过午夜的通话
+    weekdays = (start_weekday - 2 + np.arange(days + 1)) % 7
+    fires = (present[None, :] >> weekdays[:, None]) & 1
+    starts = (fires @ counts).reshape(days + 1, MINUTES_PER_DAY, groups)
+
+    # 一次性闹钟在下一次到点时响铃：首日尚未到的时间在首日，已过的时间在次日
+    one_shot = counts[0].reshape(MINUTES_PER_DAY, groups)
+    starts[1, start_minute:] += one_shot[start_minute:]
+    if days > 1:
+        starts[2, :start_minute] += one_shot[:start_minute]
+
+    # 并发数 = 最近 call_minutes 分钟内开始的通话数
+    timeline = np.cumsum(starts.reshape(-1, groups), axis=0)
+    timeline[call_minutes:] -= timeline[:-call_minutes].copy()
+    return timeline[MINUTES_PER_DAY:].reshape(days, MINUTES_PER_DAY, groups)
+
+
+def _bucket_peaks(series: np.ndarray, resolution: int) -> List[int]:
+    """按 resolution 分钟一桶取峰值，扩容需要看桶内最大值而不是平均值"""
+    return series.reshape(-1, resolution).max(axis=1).tolist()
+
+
+def build_forecast(
+    days: int = 7,
+    call_minutes: Optional[int] = None,
+    resolution: int = 1,
+    now: Optional[datetime] = None,
+    schedule: Optional[Schedule] = None
+) -> Dict[str, Any]:
+    """
+    生成容量预测报告
+    :param days: 预测天数（含今天）
+    :param call_minutes: 单次通话分钟数，默认 Config.WAKE_CALL_MINUTES
+    :param resolution: 输出序列每个点覆盖的分钟数，须整除 1440
+    :param now: 当前时间，默认取当前时间并换算到闹钟所在时区
+    :param schedule: 调度数据，默认从数据库载入
+    :return: 每天的峰值与按人设、音色拆分的并发序列
+    :raises ValueError: 参数超出范围
+    """
+    call_minutes = call_minutes or Config.WAKE_CALL_MINUTES
+    if not 1 <= days <= MAX_DAYS:
+        raise ValueError(f"days 必须在 1-{MAX_DAYS} 之间")
+    if not 1 <= call_minutes <= MAX_CALL_MINUTES:
+        raise ValueError(f"call_minutes 必须在 1-{MAX_CALL_MINUTES} 之间")
+    if resolution < 1 or MINUTES_PER_DAY % resolution:
+        raise ValueError("resolution 必须整除 1440")
+
+    tz = timezone(timedelta(minutes=Config.ALARM_UTC_OFFSET_MINUTES))
+    now = now.astimezone(tz) if now else datetime.now(tz)
+    if schedule is None:
+        schedule = load_schedule()
+
+    started = time.perf_counter()
+    calls = concurrent_calls(schedule, now.isoweekday(), now.hour * 60 + now.minute, days, call_minutes)
+
+    voices_by_persona = {p.persona_id: p.voice_id for p in AIPersonaDAO.get_all(active_only=False)}
+    voices = sorted({voices_by_persona.get(persona) or UNKNOWN for persona in schedule.personas})
+    voice_matrix = np.zeros((len(schedule.personas), len(voices)), dtype=np.int64)
+    for code, persona in enumerate(schedule.personas):
+        voice_matrix[code, voices.index(voices_by_persona.get(persona) or UNKNOWN)] = 1
+    by_voice = calls @ voice_matrix
+    totals = calls.sum(axis=2)
+    compute_ms = (time.perf_counter() - started) * 1000
+
+    report = []
+    for day in range(days):
+        date = now.date() + timedelta(days=day)
+        peak_minute = int(totals[day].argmax())
+        report.append({
+            'date': date.isoformat(),
+            'weekday': date.isoweekday(),
+            'peak': int(totals[day, peak_minute]),
+            'peak_time': f"{peak_minute // 60:02d}:{peak_minute % 60:02d}",
+            'total': _bucket_peaks(totals[day], resolution),
+            'by_persona': {
+                persona: _bucket_peaks(calls[day, :, code], resolution)
+                for code, persona in enumerate(schedule.personas)
+            },
+            'by_voice': {
+                voice: _bucket_peaks(by_voice[day, :, code], resolution)
+                for code, voice in enumerate(voices)
+            }
+        })
+
+    return {
+        'generated_at': now.isoformat(),
+        'utc_offset_minutes': Config.ALARM_UTC_OFFSET_MINUTES,
+        'alarms': len(schedule),
+        'call_minutes': call_minutes,
+        'resolution': resolution,
+        'compute_ms': round(compute_ms, 2),
+        'days': report
+    }
@@ -0,0 +1,56 @@
+"""
+生产环境的 gunicorn 配置
+
+用法:
+    gunicorn -c gunicorn.conf.py app:app
+
+- gevent 协程 worker：每个连接是一个协程而不是一个线程，/api/alarms/stream 的空闲 SSE 长连接
+  只占用一个协程和一个等待事件；PyMySQL 为纯 Python 实现，打补丁后数据库访问同样是协程友好的
+- 只启动一个 worker 进程：变更事件流、读缓存、幂等键与准入控制都保存在进程内，
+  多个 worker 之间互相看不到对方的事件与计数。需要扩容时部署多个容器
+- 普通请求的并发仍由准入控制的隔离舱按 DB_POOL_SIZE 限制，超出的请求快速返回 503，
+  worker_connections 只是长连接的上限
+- 每个连接占用一个文件描述符：启动时把软上限 (ulimit -n) 提高到硬上限，
+  仍低于 worker_connections 时在日志中告警。默认 10 万连接需要硬上限不低于 101024
+  （docker-compose.yml 已设置 nofile），宿主机的 fs.nr_open / fs.file-max 也要足够
+"""
+import resource
+from config import Config
+
+
+# 连接之外还需要的文件描述符：监听套接字、数据库连接池、日志等
+RESERVED_FDS = 1024
+
+
+bind = f'{Config.HOST}:{Config.PORT}'
+worker_class = 'gevent'
+workers = 1
+# 单个 worker 同时保持的连接数（主要是 SSE 长连接），需配合调高容器的文件描述符上限 (ulimit -n)
+worker_connections = Config.WEB_WORKER_CONNECTIONS
+# 优雅退出时等待进行中的请求；SSE 连接会被断开，客户端按 retry 自动重连
+graceful_timeout = 30
+keepalive = 75
+accesslog = '-'
+
+
+def raise_nofile_limit() -> int:
+    """把文件描述符软上限提高到硬上限（worker 进程继承），返回提高后的软上限"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = worker_connections + RESERVED_FDS if hard == resource.RLIM_INFINITY else hard
+    if soft != resource.RLIM_INFINITY and soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+def on_starting(server):
+    soft = raise_nofile_limit()
+    if soft != resource.RLIM_INFINITY and soft < worker_connections + RESERVED_FDS:
+        server.log.warning(
+            "文件描述符上限 %d 低于 worker_connections (%d) + %d，超出的连接会因 EMFILE 被拒绝；"
+            "请调高 ulimit -n 或降低 WEB_WORKER_CONNECTIONS",
+            soft, worker_connections, RESERVED_FDS
+        )
@@ -0,0 +1,163 @@
+"""
+幂等键 (Idempotency-Key)
+
+客户端重试（App 的 _maxRetryCount、MCP 服务端的退避重试与对冲）会重复发送 POST 请求，
+服务端无法区分重试与新请求。带 Idempotency-Key 请求头的 POST 请求：
+- 首次执行后保存响应（状态码 < 500），TTL 内相同 key 的重试直接返回保存的响应，不再访问数据库
+- 相同 key 的请求仍在执行时，重试等待其完成后返回同一响应，而不是并发执行第二次；
+  等待不超过本请求剩余的时限，调用方放弃之前就能拿到 409 与 Retry-After
+- 相同 key 但请求内容不同视为客户端错误，返回 422
+- 5xx 与异常不保存，重试会重新执行
+
+key 按调用方（API Key / user_id / IP）隔离；存储在进程内，容量按字节数限制。
+"""
+import hashlib
+import pickle
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from cache import LRUCache
+from config import Config
+from database import Database
+
+
+HEADER = 'Idempotency-Key'
+# 重放的响应带上该响应头
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+# begin() 的结果
+PROCEED = 'proceed'
+REPLAY = 'replay'
+MISMATCH = 'mismatch'
+IN_PROGRESS = 'in_progress'
+
+
+def request_fingerprint(method: str, path: str, body: bytes) -> str:
+    """请求内容指纹，用于识别复用了 key 的不同请求"""
+    digest = hashlib.sha256(f'{method} {path}\n'.encode('utf-8'))
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class StoredResponse:
+    """保存的响应"""
+
+    def __init__(self, status_code: int, headers: List[Tuple[str, str]], body: bytes, fingerprint: str):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.fingerprint = fingerprint
+
+
+class _Pending:
+    """一次进行中的请求"""
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+
+
+class IdempotencyStore:
+    """已完成响应的存储与进行中请求的去重"""
+
+    def __init__(self, max_bytes: int, ttl: float, wait_timeout: float):
+        """
+        :param max_bytes: 保存响应的总字节上限
+        :param ttl: 响应保存秒数，应覆盖客户端的最长重试窗口
+        :param wait_timeout: 等待进行中请求的最长秒数，请求时限更短时以时限为准
+        """
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.responses = LRUCache(max_bytes)
+        self._lock = threading.Lock()
+        self._pending: Dict[str, _Pending] = {}
+        self.executions = 0
+        self.replays = 0
+        self.waits = 0
+        self.mismatches = 0
+        self.timeouts = 0
+
+    def begin(self, key: str, fingerprint: str) -> Tuple[str, Optional[StoredResponse]]:
+        """
+        开始处理带幂等键的请求
+        :param key: 已按调用方隔离的幂等键
+        :param fingerprint: 请求内容指纹
+        :return: (PROCEED, None) 调用方执行请求并在结束时调用 complete() / abandon()；
+                 (REPLAY, 响应)；(MISMATCH, None)；(IN_PROGRESS, None) 等待超时
+        """
+        while True:
+            stored = self._lookup(key)
+            if stored is not None:
+                if stored.fingerprint != fingerprint:
+                    self.mismatches += 1
+                    return MISMATCH, None
+                self.replays += 1
+                return REPLAY, stored
+
+            with self._lock:
+                pending = self._pending.get(key)
+                if pending is None:
+                    # 加锁后再查一次，避免与刚完成的请求交错
+                    if self._lookup(key) is not None:
+                        continue
+                    self._pending[key] = _Pending(fingerprint)
+                    self.executions += 1
+                    return PROCEED, None
+
+            if pending.fingerprint != fingerprint:
+                self.mismatches += 1
+                return MISMATCH, None
+            self.waits += 1
+            if not pending.done.wait(self._wait_budget()):
+                self.timeouts += 1
+                return IN_PROGRESS, None
+            # 进行中的请求已结束：保存了响应则下一轮重放，否则由本请求重新执行
+
+    def _wait_budget(self) -> float:
+        deadline = Database.current_deadline()
+        if deadline is None:
+            return self.wait_timeout
+        return max(0.0, min(self.wait_timeout, deadline.remaining()))
+
+    def complete(self, key: str, response: StoredResponse) -> None:
+        """请求结束，保存非 5xx 响应并唤醒等待者"""
+        if response.status_code < 500:
+            self.responses.set(key, pickle.dumps(response, pickle.HIGHEST_PROTOCOL), self.ttl)
+        self._finish(key)
+
+    def abandon(self, key: str) -> None:
+        """请求异常结束，不保存响应，等待者会重新执行"""
+        self._finish(key)
+
+    def _lookup(self, key: str) -> Optional[StoredResponse]:
+        raw = self.responses.get(key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def _finish(self, key: str) -> None:
+        with self._lock:
+            pending = self._pending.pop(key, None)
+        if pending is not None:
+            pending.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """重放与去重统计"""
+        with self._lock:
+            in_flight = len(self._pending)
+        return {
+            'executions': self.executions,
+            'replays': self.replays,
+            'waits': self.waits,
+            'mismatches': self.mismatches,
+            'timeouts': self.timeouts,
+            'in_flight': in_flight,
+            'entries': len(self.responses),
+            'size_bytes': self.responses.size_bytes,
+            'max_bytes': self.responses.max_bytes
+        }
+
+
+idempotency_store = IdempotencyStore(
+    Config.IDEMPOTENCY_MAX_BYTES,
+    Config.IDEMPOTENCY_TTL,
+    Config.IDEMPOTENCY_WAIT_TIMEOUT
+)
@@ -11,13 +11,19 @@ CREATE TABLE IF NOT EXISTS alarms (
     alarm_name VARCHAR(200) DEFAULT NULL COMMENT '闹钟名称',
     ai_persona_id VARCHAR(50) DEFAULT 'gentle' COMMENT 'AI人设ID',
     repeat_days VARCHAR(50) DEFAULT NULL COMMENT '重复日期 (1-7表示周一到周日，逗号分隔，如: 1,2,3,4,5)',
+    minute_of_day SMALLINT DEFAULT NULL COMMENT '闹钟时间对应当天第几分钟 (0-1439)，由 alarm_time 派生',
+    weekday_mask TINYINT UNSIGNED NOT NULL DEFAULT 0 COMMENT '星期位掩码 (bit0=周一 ... bit6=周日, 0=一次性)，由 repeat_days 派生',
     is_enabled TINYINT(1) DEFAULT 1 COMMENT '是否启用 (0:禁用, 1:启用)',
     next_alarm_time DATETIME DEFAULT NULL COMMENT '下次闹钟时间',
+    content_hash CHAR(16) DEFAULT NULL COMMENT '内容指纹，规则见 models.alarm_content_hash',
+    version INT UNSIGNED NOT NULL DEFAULT 1 COMMENT '内容版本，每次修改递增',
     created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
     updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
     INDEX idx_user_id (user_id),
     INDEX idx_alarm_time (alarm_time),
-    INDEX idx_is_enabled (is_enabled)
+    INDEX idx_is_enabled (is_enabled),
+    INDEX idx_enabled_schedule (is_enabled, minute_of_day, weekday_mask),
+    INDEX idx_user_digest (user_id, content_hash, version)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='闹钟表';
 
 -- 创建AI人设表
@@ -38,6 +44,21 @@ CREATE TABLE IF NOT EXISTS ai_personas (
     INDEX idx_is_default (is_default)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='AI人设表';
 
+-- 创建设备推送令牌表
+CREATE TABLE IF NOT EXISTS device_tokens (
+    device_token VARCHAR(255) PRIMARY KEY COMMENT '推送令牌 (APNs 设备令牌或 FCM 注册令牌)',
+    user_id VARCHAR(100) NOT NULL COMMENT '用户ID',
+    provider VARCHAR(20) NOT NULL DEFAULT 'apns_voip' COMMENT '推送通道 (apns_voip / apns / fcm)',
+    device_id VARCHAR(100) DEFAULT NULL COMMENT '设备标识，同一设备重新注册时替换旧令牌',
+    app_version VARCHAR(50) DEFAULT NULL COMMENT '客户端版本',
+    is_active TINYINT(1) DEFAULT 1 COMMENT '是否有效 (推送网关返回令牌失效后置 0)',
+    last_seen_at DATETIME DEFAULT NULL COMMENT '最近一次注册/刷新时间',
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+    updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+    INDEX idx_user_active (user_id, is_active),
+    INDEX idx_device_id (device_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='设备推送令牌表';
+
 -- 为闹钟表添加外键约束（如果需要）
 -- ALTER TABLE alarms ADD CONSTRAINT fk_alarms_ai_persona FOREIGN KEY (ai_persona_id) REFERENCES ai_personas(persona_id);
 
@@ -64,7 +85,7 @@ INSERT INTO ai_personas (persona_id, name, description, emoji, system_prompt, op
 '喂！时间已经不等人了，立即起床！你的任务等着你，没有任何借口可以拖延！', 'onyx', '坚决不妥协,事实说话,紧迫感强', 1, 1);
 
 -- 插入示例闹钟数据
-INSERT INTO alarms (alarm_id, user_id, alarm_time, alarm_name, ai_persona_id, repeat_days, is_enabled) VALUES
-('550e8400-e29b-41d4-a716-446655440001', 'user_001', '07:00', '早晨闹钟', 'gentle', '1,2,3,4,5', 1),
-('550e8400-e29b-41d4-a716-446655440002', 'user_001', '12:00', '午餐提醒', 'informative', '1,2,3,4,5,6,7', 1),
-('550e8400-e29b-41d4-a716-446655440003', 'user_001', '22:00', '睡觉提醒', 'gentle', '1,2,3,4,5,6,7', 0);
+INSERT INTO alarms (alarm_id, user_id, alarm_time, alarm_name, ai_persona_id, repeat_days, minute_of_day, weekday_mask, is_enabled, content_hash) VALUES
+('550e8400-e29b-41d4-a716-446655440001', 'user_001', '07:00', '早晨闹钟', 'gentle', '1,2,3,4,5', 420, 31, 1, '913dc84d37e124ef'),
+('550e8400-e29b-41d4-a716-446655440002', 'user_001', '12:00', '午餐提醒', 'informative', '1,2,3,4,5,6,7', 720, 127, 1, '86dc8e835188125d'),
+('550e8400-e29b-41d4-a716-446655440003', 'user_001', '22:00', '睡觉提醒', 'gentle', '1,2,3,4,5,6,7', 1320, 127, 0, '0518b707b2ac13d0');
@@ -0,0 +1,114 @@
+"""
+面向 LLM 工具的紧凑闹钟列表
+
+按条数和字节数双重预算分页，支持列式 (columns) 与预渲染文本 (text) 两种格式，
+通过不透明的续传 token 翻页。续传 token 记录上一页最后一条的排序键 (alarm_time, alarm_id)，
+翻页期间有闹钟增删也不会重复或漏掉。
+"""
+import base64
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from models import Alarm
+
+
+# 列式格式的列顺序
+COLUMNS = ['alarm_id', 'alarm_name', 'alarm_time', 'ai_persona_id', 'repeat_days', 'is_enabled']
+
+FORMATS = ('columns', 'text')
+
+# 分页预算的默认值与上限
+DEFAULT_MAX_ITEMS = 50
+MAX_ITEMS_LIMIT = 200
+DEFAULT_MAX_BYTES = 8 * 1024
+MAX_BYTES_LIMIT = 64 * 1024
+
+
+def encode_cursor(key: Tuple[str, str]) -> str:
+    """将排序键编码为续传 token"""
+    raw = json.dumps(list(key), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str) -> Tuple[str, str]:
+    """
+    解析续传 token
+    :raises ValueError: token 格式无效
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        alarm_time, alarm_id = json.loads(raw)
+        return str(alarm_time), str(alarm_id)
+    except Exception:
+        raise ValueError("cursor 格式无效")
+
+
+def sort_key(alarm: Alarm) -> Tuple[str, str]:
+    """列表排序键：先按时间，再按ID保证顺序稳定"""
+    return alarm.alarm_time or '', alarm.alarm_id or ''
+
+
+def to_row(alarm: Alarm) -> List[Any]:
+    """列式格式的一行"""
+    return [
+        alarm.alarm_id,
+        alarm.alarm_name,
+        alarm.alarm_time,
+        alarm.ai_persona_id,
+        alarm.repeat_days,
+        1 if alarm.is_enabled else 0
+    ]
+
+
+def to_line(alarm: Alarm) -> str:
+    """预渲染的单行文本"""
+    status_icon = "✅" if alarm.is_enabled else "❌"
+    repeat_mark = "🔁" if alarm.repeat_days else "1️⃣"
+    return f"{status_icon} {repeat_mark} {alarm.alarm_name} - {alarm.alarm_time} (ID: {alarm.alarm_id})"
+
+
+def build_page(
+    alarms: List[Alarm],
+    fmt: str,
+    cursor: Optional[str],
+    max_items: int,
+    max_bytes: int
+) -> Dict[str, Any]:
+    """
+    生成一页紧凑列表
+    :param alarms: 用户的全部闹钟
+    :param fmt: columns 或 text
+    :param cursor: 续传 token，None 表示第一页
+    :param max_items: 本页最多条数
+    :param max_bytes: 本页条目的最大字节数（UTF-8 JSON），至少返回一条
+    :return: 响应 data
+    """
+    ordered = sorted(alarms, key=sort_key)
+    if cursor:
+        after = decode_cursor(cursor)
+        ordered = [alarm for alarm in ordered if sort_key(alarm) > after]
+
+    encode = to_row if fmt == 'columns' else to_line
+    items = []
+    used_bytes = 0
+    for alarm in ordered[:max_items]:
+        item = encode(alarm)
+        size = len(json.dumps(item, ensure_ascii=False).encode('utf-8')) + 1
+        if items and used_bytes + size > max_bytes:
+            break
+        items.append(item)
+        used_bytes += size
+
+    remaining = len(ordered) - len(items)
+    data = {
+        'total': len(alarms),
+        'enabled': sum(1 for alarm in alarms if alarm.is_enabled),
+        'returned': len(items),
+        'remaining': remaining,
+        'next_cursor': encode_cursor(sort_key(ordered[len(items) - 1])) if remaining and items else None
+    }
+    if fmt == 'columns':
+        data['columns'] = COLUMNS
+        data['rows'] = items
+    else:
+        data['lines'] = items
+    return data
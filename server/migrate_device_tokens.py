@@ -0,0 +1,51 @@
+"""
+在线迁移：为已有数据库创建 device_tokens 表（新库由 init_db.sql 创建）
+
+用法:
+    python migrate_device_tokens.py
+
+- 只新建表，不修改已有的表，不影响线上读写
+- 可重复执行，表已存在时跳过
+"""
+from database import Database
+
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS device_tokens (
+    device_token VARCHAR(255) PRIMARY KEY COMMENT '推送令牌 (APNs 设备令牌或 FCM 注册令牌)',
+    user_id VARCHAR(100) NOT NULL COMMENT '用户ID',
+    provider VARCHAR(20) NOT NULL DEFAULT 'apns_voip' COMMENT '推送通道 (apns_voip / apns / fcm)',
+    device_id VARCHAR(100) DEFAULT NULL COMMENT '设备标识，同一设备重新注册时替换旧令牌',
+    app_version VARCHAR(50) DEFAULT NULL COMMENT '客户端版本',
+    is_active TINYINT(1) DEFAULT 1 COMMENT '是否有效 (推送网关返回令牌失效后置 0)',
+    last_seen_at DATETIME DEFAULT NULL COMMENT '最近一次注册/刷新时间',
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+    updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+    INDEX idx_user_active (user_id, is_active),
+    INDEX idx_device_id (device_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='设备推送令牌表'
+"""
+
+
+def table_exists(cursor, table: str) -> bool:
+    cursor.execute(
+        """
+        SELECT 1 FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """,
+        (table,)
+    )
+    return cursor.fetchone() is not None
+
+
+def main():
+    with Database.get_cursor() as cursor:
+        if table_exists(cursor, 'device_tokens'):
+            print("device_tokens 表已存在，跳过")
+            return
+        cursor.execute(CREATE_TABLE)
+    print("已创建 device_tokens 表")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+在线迁移：为 alarms 表增加 minute_of_day / weekday_mask 列与索引，并分批回填历史数据
+
+用法:
+    python migrate_schedule_columns.py [--batch-size 1000] [--sleep 0.05]
+
+- 加列优先使用 ALGORITHM=INSTANT，旧版本 MySQL 退回 INPLACE + LOCK=NONE，不阻塞读写
+- 按 alarm_id 分批回填，每批单独提交，批间休眠以限制对线上的压力
+- 回填时保留 updated_at，并以 alarm_time / repeat_days 为条件更新，
+  不会覆盖迁移期间由 DAO 写入的新值
+- 可重复执行，已完成的步骤会被跳过
+"""
+import argparse
+import time
+import pymysql
+from database import Database
+from models import parse_minute_of_day, weekday_mask_from_days
+
+
+ADD_COLUMNS = """
+ALTER TABLE alarms
+    ADD COLUMN minute_of_day SMALLINT DEFAULT NULL
+        COMMENT '闹钟时间对应当天第几分钟 (0-1439)，由 alarm_time 派生' AFTER repeat_days,
+    ADD COLUMN weekday_mask TINYINT UNSIGNED NOT NULL DEFAULT 0
+        COMMENT '星期位掩码 (bit0=周一 ... bit6=周日, 0=一次性)，由 repeat_days 派生' AFTER minute_of_day
+"""
+
+ADD_INDEX = """
+ALTER TABLE alarms
+    ADD INDEX idx_enabled_schedule (is_enabled, minute_of_day, weekday_mask),
+    ALGORITHM=INPLACE, LOCK=NONE
+"""
+
+BACKFILL = """
+UPDATE alarms
+SET minute_of_day = %s, weekday_mask = %s, updated_at = updated_at
+WHERE alarm_id = %s AND alarm_time = %s AND repeat_days <=> %s
+"""
+
+
+def column_exists(cursor, column: str) -> bool:
+    cursor.execute(
+        """
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'alarms' AND COLUMN_NAME = %s
+        """,
+        (column,)
+    )
+    return cursor.fetchone() is not None
+
+
+def index_exists(cursor, index: str) -> bool:
+    cursor.execute(
+        """
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'alarms' AND INDEX_NAME = %s
+        """,
+        (index,)
+    )
+    return cursor.fetchone() is not None
+
+
+def add_columns(cursor) -> None:
+    if column_exists(cursor, 'minute_of_day'):
+        print("列已存在，跳过加列")
+        return
+    try:
+        cursor.execute(ADD_COLUMNS + ", ALGORITHM=INSTANT")
+    except pymysql.err.OperationalError as e:
+        print(f"INSTANT 加列不可用 ({e})，改用 INPLACE")
+        cursor.execute(ADD_COLUMNS + ", ALGORITHM=INPLACE, LOCK=NONE")
+    print("已添加 minute_of_day / weekday_mask 列")
+
+
+def add_index(cursor) -> None:
+    if index_exists(cursor, 'idx_enabled_schedule'):
+        print("索引已存在，跳过建索引")
+        return
+    cursor.execute(ADD_INDEX)
+    print("已添加 idx_enabled_schedule 索引")
+
+
+def backfill(batch_size: int, pause: float) -> int:
+    """按 alarm_id 分批回填派生列，返回更新的行数"""
+    last_id = ''
+    updated = 0
+    while True:
+        with Database.get_cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT alarm_id, alarm_time, repeat_days, minute_of_day, weekday_mask
+                FROM alarms WHERE alarm_id > %s ORDER BY alarm_id LIMIT %s
+                """,
+                (last_id, batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                return updated
+
+            params = []
+            for row in rows:
+                minute_of_day = parse_minute_of_day(row['alarm_time'])
+                weekday_mask = weekday_mask_from_days(row['repeat_days'])
+                if row['minute_of_day'] != minute_of_day or row['weekday_mask'] != weekday_mask:
+                    params.append((
+                        minute_of_day, weekday_mask,
+                        row['alarm_id'], row['alarm_time'], row['repeat_days']
+                    ))
+            if params:
+                cursor.executemany(BACKFILL, params)
+                updated += cursor.rowcount
+            last_id = rows[-1]['alarm_id']
+
+        print(f"已回填至 {last_id}，累计更新 {updated} 行")
+        time.sleep(pause)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="alarms 表调度列在线迁移")
+    parser.add_argument('--batch-size', type=int, default=1000, help="每批回填的行数")
+    parser.add_argument('--sleep', type=float, default=0.05, help="批次之间的休眠秒数")
+    args = parser.parse_args()
+
+    with Database.get_cursor() as cursor:
+        add_columns(cursor)
+        add_index(cursor)
+
+    updated = backfill(args.batch_size, args.sleep)
+    print(f"迁移完成，共更新 {updated} 行")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+在线迁移：为 alarms 表增加 content_hash / version 列与 idx_user_digest 索引，并分批回填内容指纹
+
+用法:
+    python migrate_sync_columns.py [--batch-size 1000] [--sleep 0.05]
+
+- 加列优先使用 ALGORITHM=INSTANT，旧版本 MySQL 退回 INPLACE + LOCK=NONE，不阻塞读写
+- 按 alarm_id 分批回填，每批单独提交，批间休眠以限制对线上的压力
+- 回填时保留 updated_at，只更新 content_hash 仍为空的行，不会覆盖迁移期间由 DAO 写入的新值
+- 回填完成前 /api/sync 无法比较未回填闹钟的内容，以服务端为准下发（客户端有未同步修改时记入 conflict_ids），不影响正确性
+- 可重复执行，已完成的步骤会被跳过
+"""
+import argparse
+import time
+import pymysql
+from database import Database
+from migrate_schedule_columns import column_exists, index_exists
+from models import alarm_content_hash
+
+
+ADD_COLUMNS = """
+ALTER TABLE alarms
+    ADD COLUMN content_hash CHAR(16) DEFAULT NULL
+        COMMENT '内容指纹，规则见 models.alarm_content_hash' AFTER next_alarm_time,
+    ADD COLUMN version INT UNSIGNED NOT NULL DEFAULT 1
+        COMMENT '内容版本，每次修改递增' AFTER content_hash
+"""
+
+ADD_INDEX = """
+ALTER TABLE alarms
+    ADD INDEX idx_user_digest (user_id, content_hash, version),
+    ALGORITHM=INPLACE, LOCK=NONE
+"""
+
+BACKFILL = """
+UPDATE alarms
+SET content_hash = %s, updated_at = updated_at
+WHERE alarm_id = %s AND content_hash IS NULL
+"""
+
+
+def add_columns(cursor) -> None:
+    if column_exists(cursor, 'content_hash'):
+        print("列已存在，跳过加列")
+        return
+    try:
+        cursor.execute(ADD_COLUMNS + ", ALGORITHM=INSTANT")
+    except pymysql.err.OperationalError as e:
+        print(f"INSTANT 加列不可用 ({e})，改用 INPLACE")
+        cursor.execute(ADD_COLUMNS + ", ALGORITHM=INPLACE, LOCK=NONE")
+    print("已添加 content_hash / version 列")
+
+
+def add_index(cursor) -> None:
+    if index_exists(cursor, 'idx_user_digest'):
+        print("索引已存在，跳过建索引")
+        return
+    cursor.execute(ADD_INDEX)
+    print("已添加 idx_user_digest 索引")
+
+
+def backfill(batch_size: int, pause: float) -> int:
+    """按 alarm_id 分批回填内容指纹，返回更新的行数"""
+    last_id = ''
+    updated = 0
+    while True:
+        with Database.get_cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT alarm_id, alarm_time, alarm_name, ai_persona_id, repeat_days, is_enabled, content_hash
+                FROM alarms WHERE alarm_id > %s ORDER BY alarm_id LIMIT %s
+                """,
+                (last_id, batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                return updated
+
+            params = [
+                (
+                    alarm_content_hash(
+                        row['alarm_time'], row['alarm_name'], row['ai_persona_id'],
+                        row['repeat_days'], row['is_enabled']
+                    ),
+                    row['alarm_id']
+                )
+                for row in rows if row['content_hash'] is None
+            ]
+            if params:
+                cursor.executemany(BACKFILL, params)
+                updated += cursor.rowcount
+            last_id = rows[-1]['alarm_id']
+
+        print(f"已回填至 {last_id}，累计更新 {updated} 行")
+        time.sleep(pause)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="alarms 表同步列在线迁移")
+    parser.add_argument('--batch-size', type=int, default=1000, help="每批回填的行数")
+    parser.add_argument('--sleep', type=float, default=0.05, help="批次之间的休眠秒数")
+    args = parser.parse_args()
+
+    with Database.get_cursor() as cursor:
+        add_columns(cursor)
+        add_index(cursor)
+
+    updated = backfill(args.batch_size, args.sleep)
+    print(f"迁移完成，共更新 {updated} 行")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,74 @@
 """
 数据模型定义
 """
+import hashlib
+import json
 from datetime import datetime
 from typing import Optional, Dict, Any
 
 
+# 全部七天的星期掩码
+ALL_WEEKDAYS_MASK = 0b1111111
+
+
+def parse_minute_of_day(alarm_time: Optional[str]) -> Optional[int]:
+    """
+    将 "HH:MM" 转换为当天的第几分钟 (0-1439)
+    :param alarm_time: 闹钟时间
+    :return: 分钟数，格式无效时返回 None
+    """
+    try:
+        hour, minute = map(int, alarm_time.split(':'))
+    except (AttributeError, ValueError):
+        return None
+    if 0 <= hour < 24 and 0 <= minute < 60:
+        return hour * 60 + minute
+    return None
+
+
+def weekday_mask_from_days(repeat_days: Optional[str]) -> int:
+    """
+    将重复日期 "1,2,3" 转换为星期位掩码，周一为第 0 位，周日为第 6 位
+    :param repeat_days: 逗号分隔的 1-7
+    :return: 位掩码，一次性闹钟为 0
+    """
+    mask = 0
+    for day in (repeat_days or '').split(','):
+        day = day.strip()
+        if day.isdigit() and 1 <= int(day) <= 7:
+            mask |= 1 << (int(day) - 1)
+    return mask
+
+
+def alarm_content_hash(
+    alarm_time: Optional[str],
+    alarm_name: Optional[str],
+    ai_persona_id: Optional[str],
+    repeat_days: Optional[str],
+    is_enabled: bool
+) -> str:
+    """
+    闹钟内容指纹，客户端按相同规则计算后用于同步比对
+    规范形式为紧凑 JSON 数组 [alarm_time, alarm_name, ai_persona_id, repeat_days, is_enabled]：
+    人设为空时取 gentle，重复日期去重升序后以逗号连接，启用状态为 1/0，取 SHA-256 前 16 位十六进制
+    """
+    days = sorted({int(day) for day in (repeat_days or '').split(',') if day.strip().isdigit()})
+    canonical = json.dumps(
+        [alarm_time or '', alarm_name or '', ai_persona_id or 'gentle', ','.join(map(str, days)), 1 if is_enabled else 0],
+        ensure_ascii=False,
+        separators=(',', ':')
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+def weekday_bit(weekday: int) -> int:
+    """
+    :param weekday: 1-7 表示周一到周日（与 datetime.isoweekday() 一致）
+    :return: 该天对应的掩码位
+    """
+    return 1 << (weekday - 1)
+
+
 class Alarm:
     """闹钟数据模型"""
     
@@ -19,7 +83,8 @@ class Alarm:
         is_enabled: bool = True,
         next_alarm_time: Optional[datetime] = None,
         created_at: Optional[datetime] = None,
-        updated_at: Optional[datetime] = None
+        updated_at: Optional[datetime] = None,
+        version: int = 1
     ):
         self.alarm_id = alarm_id
         self.user_id = user_id
@@ -31,6 +96,24 @@ class Alarm:
         self.next_alarm_time = next_alarm_time
         self.created_at = created_at
         self.updated_at = updated_at
+        self.version = version  # 服务端每次修改内容后递增，用于同步时判断哪一方更新
+    
+    @property
+    def minute_of_day(self) -> Optional[int]:
+        """闹钟时间对应当天的第几分钟，与 alarms.minute_of_day 列一致"""
+        return parse_minute_of_day(self.alarm_time)
+    
+    @property
+    def weekday_mask(self) -> int:
+        """重复日期的星期位掩码，与 alarms.weekday_mask 列一致"""
+        return weekday_mask_from_days(self.repeat_days)
+    
+    @property
+    def content_hash(self) -> str:
+        """闹钟内容指纹，与 alarms.content_hash 列一致"""
+        return alarm_content_hash(
+            self.alarm_time, self.alarm_name, self.ai_persona_id, self.repeat_days, self.is_enabled
+        )
     
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典"""
@@ -41,10 +124,14 @@ class Alarm:
             'alarm_name': self.alarm_name,
             'ai_persona_id': self.ai_persona_id,
             'repeat_days': self.repeat_days,
+            'minute_of_day': self.minute_of_day,
+            'weekday_mask': self.weekday_mask,
             'is_enabled': self.is_enabled,
             'next_alarm_time': self.next_alarm_time.isoformat() if self.next_alarm_time else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'content_hash': self.content_hash,
+            'version': self.version
         }
     
     @classmethod
@@ -60,7 +147,8 @@ class Alarm:
             is_enabled=data.get('is_enabled', True),
             next_alarm_time=data.get('next_alarm_time'),
             created_at=data.get('created_at'),
-            updated_at=data.get('updated_at')
+            updated_at=data.get('updated_at'),
+            version=data.get('version') or 1
         )
 
 
@@ -119,7 +207,7 @@ class AIPersona:
         features_str = ','.join(features_list) if isinstance(features_list, list) else features_list
         
         return cls(
-            persona_id=data.get('id'),
+            persona_id=data.get('id') or data.get('persona_id'),
             name=data.get('name'),
             description=data.get('description'),
             emoji=data.get('emoji', '🙂'),
@@ -132,3 +220,62 @@ class AIPersona:
             created_at=data.get('created_at'),
             updated_at=data.get('updated_at')
         )
+
+
+# 推送通道：iOS VoIP 推送 (PushKit)、iOS 普通推送、Android FCM
+PUSH_PROVIDERS = ('apns_voip', 'apns', 'fcm')
+
+
+class DeviceToken:
+    """设备推送令牌数据模型"""
+    
+    def __init__(
+        self,
+        device_token: Optional[str] = None,
+        user_id: Optional[str] = None,
+        provider: Optional[str] = 'apns_voip',
+        device_id: Optional[str] = None,
+        app_version: Optional[str] = None,
+        is_active: bool = True,
+        last_seen_at: Optional[datetime] = None,
+        created_at: Optional[datetime] = None,
+        updated_at: Optional[datetime] = None
+    ):
+        self.device_token = device_token
+        self.user_id = user_id
+        self.provider = provider  # apns_voip / apns / fcm
+        self.device_id = device_id
+        self.app_version = app_version
+        self.is_active = is_active  # 推送网关返回令牌失效后置为 0
+        self.last_seen_at = last_seen_at
+        self.created_at = created_at
+        self.updated_at = updated_at
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return {
+            'device_token': self.device_token,
+            'user_id': self.user_id,
+            'provider': self.provider,
+            'device_id': self.device_id,
+            'app_version': self.app_version,
+            'is_active': bool(self.is_active),
+            'last_seen_at': self.last_seen_at.isoformat() if self.last_seen_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'DeviceToken':
+        """从字典创建对象"""
+        return cls(
+            device_token=data.get('device_token'),
+            user_id=data.get('user_id'),
+            provider=data.get('provider', 'apns_voip'),
+            device_id=data.get('device_id'),
+            app_version=data.get('app_version'),
+            is_active=data.get('is_active', True),
+            last_seen_at=data.get('last_seen_at'),
+            created_at=data.get('created_at'),
+            updated_at=data.get('updated_at')
+        )
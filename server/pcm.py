@@ -0,0 +1,331 @@
+"""
+PCM16 音频处理
+
+服务端的中继、录音、质检都会用到 PCM 处理，逐样本的 Python 循环跟不上实时，这里统一用 NumPy 向量化：
+- 分帧：np.frombuffer 直接引用原始缓冲区，按帧 reshape，不拷贝数据
+- 重采样：24 kHz ↔ 16 kHz 多相 FIR，一次处理多路流各一帧，每路保留滤波器历史，可连续流式处理
+- 电平：RMS / 峰值 / 平均绝对幅度，按帧批量计算
+- VAD：与客户端 simple_vad.dart 相同的能量阈值 + 连续帧计数 + 冷却规则，按路并行
+- 生成器：把任意大小的数据块切成定长帧，配合重采样与 VAD 逐帧处理
+
+音频格式与客户端一致：16 kHz 单声道 16 bit 小端，每帧 60 ms。
+
+用法:
+    python pcm.py --bench 2000    # 压测：2000 路流各处理一帧的耗时与单核可承载路数
+"""
+import argparse
+import math
+import time
+from functools import lru_cache
+from typing import Iterable, Iterator, Optional, Tuple, Union
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from audio_cache import DEFAULT_CODEC
+
+
+SAMPLE_RATE = DEFAULT_CODEC.sample_rate
+FRAME_MS = DEFAULT_CODEC.frame_duration
+SAMPLE_WIDTH = 2
+INT16_MAX = 32767
+INT16_MIN = -32768
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+def frame_samples(sample_rate: int = SAMPLE_RATE, frame_ms: int = FRAME_MS) -> int:
+    """每帧样本数（16 kHz、60 ms 为 960）"""
+    return sample_rate * frame_ms // 1000
+
+
+def as_samples(data: Buffer) -> np.ndarray:
+    """
+    把 PCM16 字节视为 int16 数组（不拷贝，末尾不足一个样本的字节忽略）
+    :param data: 小端 PCM16 数据
+    :return: int16 一维数组，data 为 bytes 时只读
+    """
+    view = memoryview(data).cast('B')
+    return np.frombuffer(view[:len(view) - len(view) % SAMPLE_WIDTH], dtype='<i2')
+
+
+def to_frames(data: Union[Buffer, np.ndarray], size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    按定长分帧（不拷贝）
+    :param data: PCM16 字节或 int16 数组
+    :param size: 每帧样本数
+    :return: (形状为 (帧数, size) 的帧, 不足一帧的剩余样本)
+    """
+    samples = data if isinstance(data, np.ndarray) else as_samples(data)
+    whole = len(samples) - len(samples) % size
+    return samples[:whole].reshape(-1, size), samples[whole:]
+
+
+def to_pcm16(samples: np.ndarray) -> np.ndarray:
+    """浮点样本四舍五入并截断为 int16"""
+    return np.clip(np.rint(samples), INT16_MIN, INT16_MAX).astype(np.int16)
+
+
+def mean_abs(frames: np.ndarray) -> np.ndarray:
+    """逐帧平均绝对幅度（与 simple_vad.dart 的能量指标相同）"""
+    return np.abs(frames, dtype=np.int32).mean(axis=-1)
+
+
+def rms(frames: np.ndarray) -> np.ndarray:
+    """逐帧均方根幅度"""
+    values = frames.astype(np.float32)
+    return np.sqrt(np.einsum('...i,...i->...', values, values) / values.shape[-1])
+
+
+def peak(frames: np.ndarray) -> np.ndarray:
+    """逐帧峰值幅度"""
+    return np.abs(frames, dtype=np.int32).max(axis=-1)
+
+
+def to_dbfs(level: np.ndarray) -> np.ndarray:
+    """幅度换算为 dBFS，静音记为 -inf"""
+    with np.errstate(divide='ignore'):
+        return 20 * np.log10(np.asarray(level, dtype=np.float64) / INT16_MAX)
+
+
+# 每次矩阵乘法覆盖的输入组数（每组 down 个输入样本产出 up 个输出样本）
+BLOCK_GROUPS = 16
+
+
+def _filter_center(up: int, down: int, taps_per_phase: int) -> int:
+    """
+    滤波器中心在上采样域中的位置：取离抽头中点最近的 down 的整数倍，
+    这样中心正好落在某个输出样本上，重采样的延迟是整数个输出样本，没有小数部分的相位偏移
+    """
+    return round((up * taps_per_phase - 1) / 2 / down) * down
+
+
+@lru_cache(maxsize=None)
+def _block_filter(up: int, down: int, taps_per_phase: int) -> np.ndarray:
+    """
+    Kaiser 窗 sinc 低通滤波器展开成的分块 Toeplitz 矩阵
+    一段 (BLOCK_GROUPS - 1) * down + taps_per_phase + down - 1 个输入样本乘以该矩阵，
+    得到 BLOCK_GROUPS * up 个输出样本；多相滤波变成一次大矩阵乘法，可以交给 BLAS
+    滤波器中心取 down 的整数倍，延迟恰好是整数个输出样本（见 _filter_center）
+    """
+    length = up * taps_per_phase
+    cutoff = 0.95 / max(up, down)
+    center = _filter_center(up, down, taps_per_phase)
+    # 窗口以中心对称，超出半宽的抽头为零，保持线性相位
+    half = min(center, length - 1 - center)
+    n = np.arange(length) - center
+    window = np.i0(6.0 * np.sqrt(np.clip(1 - (n / half) ** 2, 0, None))) / np.i0(6.0)
+    h = cutoff * np.sinc(cutoff * n) * np.where(np.abs(n) <= half, window, 0)
+    h *= up / h.sum()
+    # 第 phase 个相位的抽头，按输入时间正序排列
+    phases = h.reshape(taps_per_phase, up).T[:, ::-1]
+
+    width = (BLOCK_GROUPS - 1) * down + taps_per_phase + down - 1
+    matrix = np.zeros((width, BLOCK_GROUPS * up), dtype=np.float32)
+    for group in range(BLOCK_GROUPS):
+        for first in range(up):
+            offset = group * down + first * down // up
+            matrix[offset:offset + taps_per_phase, group * up + first] = phases[first * down % up]
+    return matrix
+
+
+class Resampler:
+    """多路并行的有理数倍率重采样器（例如 24000 -> 16000 为 2/3）"""
+
+    def __init__(self, src_rate: int, dst_rate: int, streams: int = 1, taps_per_phase: int = 16):
+        """
+        :param src_rate: 输入采样率
+        :param dst_rate: 输出采样率
+        :param streams: 并行的流数，每路单独保留滤波器历史
+        :param taps_per_phase: 每个相位的抽头数
+        """
+        divisor = math.gcd(src_rate, dst_rate)
+        self.up = dst_rate // divisor
+        self.down = src_rate // divisor
+        self.taps = taps_per_phase
+        self.matrix = _block_filter(self.up, self.down, taps_per_phase)
+        self.history = np.zeros((streams, taps_per_phase - 1), dtype=np.float32)
+
+    @property
+    def delay(self) -> int:
+        """滤波器引入的延迟（输出样本数，恒为整数）"""
+        return _filter_center(self.up, self.down, self.taps) // self.down
+
+    def output_length(self, input_length: int) -> int:
+        return input_length * self.up // self.down
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """
+        处理每路流的下一段样本
+        :param block: 形状为 (streams, N) 的 int16 样本，N 须为 down 的整数倍
+        :return: 形状为 (streams, N * up / down) 的 int16 样本
+        :raises ValueError: 形状与流数或倍率不匹配
+        """
+        block = np.atleast_2d(block)
+        streams, length = block.shape
+        if streams != len(self.history):
+            raise ValueError(f"流数不匹配: {streams} != {len(self.history)}")
+        if length % self.down:
+            raise ValueError(f"每段样本数必须是 {self.down} 的整数倍")
+        width = self.matrix.shape[0]
+        step = BLOCK_GROUPS * self.down
+        blocks = -(-length // step)
+        keep = self.taps - 1
+        # 历史样本 + 本段样本，末尾补零到整块
+        padded = np.zeros((streams, (blocks - 1) * step + width), dtype=np.float32)
+        padded[:, :keep] = self.history
+        padded[:, keep:keep + length] = block
+        windows = sliding_window_view(padded, width, axis=1)[:, ::step][:, :blocks]
+        out = np.ascontiguousarray(windows).reshape(-1, width) @ self.matrix
+        self.history = padded[:, length:length + keep].copy()
+        return to_pcm16(out.reshape(streams, -1)[:, :self.output_length(length)])
+
+    def stream(self, frames: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        """逐帧重采样单路流"""
+        for frame in frames:
+            yield self.process(frame)[0]
+
+
+def resample(samples: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """
+    一次性重采样整段音频（滤波器延迟为整数个输出样本，裁掉后输出与输入对齐）
+    :param samples: int16 一维数组
+    :param src_rate: 输入采样率
+    :param dst_rate: 输出采样率
+    :return: int16 一维数组
+    """
+    resampler = Resampler(src_rate, dst_rate)
+    delay = resampler.delay
+    tail = math.ceil(delay * resampler.down / resampler.up) + resampler.taps
+    tail += -(len(samples) + tail) % resampler.down
+    padded = np.concatenate([samples, np.zeros(tail, dtype=np.int16)])
+    out = resampler.process(padded[np.newaxis, :])[0]
+    return out[delay:delay + resampler.output_length(len(samples))]
+
+
+class EnergyVAD:
+    """
+    能量阈值 VAD，规则与 simple_vad.dart 一致：
+    平均绝对幅度达到阈值计为有声帧，连续计数达到 trigger_frames 时触发一次并清零，
+    低于阈值时计数减一，两次触发间至少间隔 cooldown_frames 帧
+    """
+
+    def __init__(self, streams: int = 1, threshold: float = 900, trigger_frames: int = 4, cooldown_frames: int = 20):
+        """
+        :param streams: 并行的流数
+        :param threshold: 平均绝对幅度阈值
+        :param trigger_frames: 触发所需的有声帧计数
+        :param cooldown_frames: 冷却帧数（60 ms 帧下 20 帧即 1.2 秒）
+        """
+        self.threshold = threshold
+        self.trigger_frames = trigger_frames
+        self.cooldown_frames = cooldown_frames
+        self.count = np.zeros(streams, dtype=np.int32)
+        self.since_trigger = np.full(streams, cooldown_frames, dtype=np.int32)
+
+    def is_speech(self, frames: np.ndarray) -> np.ndarray:
+        """逐帧判断是否为有声帧"""
+        return mean_abs(frames) >= self.threshold
+
+    def process(self, frames: np.ndarray) -> np.ndarray:
+        """
+        处理每路流的若干帧
+        :param frames: 形状为 (streams, 帧数, 帧长) 或 (streams, 帧长)
+        :return: 形状为 (streams, 帧数) 的布尔数组，True 表示该帧触发了“开始说话”
+        """
+        if frames.ndim == 2:
+            frames = frames[:, np.newaxis, :]
+        speech = self.is_speech(frames)
+        triggers = np.zeros(speech.shape, dtype=bool)
+        # 能量一次算完，计数状态机按帧推进，每步对所有流向量化
+        for index in range(speech.shape[1]):
+            voiced = speech[:, index]
+            self.count = np.where(voiced, self.count + 1, np.maximum(self.count - 1, 0))
+            self.since_trigger += 1
+            reached = self.count >= self.trigger_frames
+            self.count[reached] = 0
+            fired = reached & (self.since_trigger >= self.cooldown_frames)
+            self.since_trigger[fired] = 0
+            triggers[:, index] = fired
+        return triggers
+
+    def stream(self, frames: Iterable[np.ndarray]) -> Iterator[Tuple[np.ndarray, bool]]:
+        """逐帧处理单路流，产出 (帧, 是否触发)"""
+        for frame in frames:
+            yield frame, bool(self.process(frame[np.newaxis, :])[0, 0])
+
+
+def iter_frames(chunks: Iterable[Buffer], size: Optional[int] = None) -> Iterator[np.ndarray]:
+    """
+    把任意大小的 PCM16 数据块切成定长帧
+    数据块与帧边界对齐时直接引用原缓冲区，只有跨块的残余部分需要拼接
+    :param chunks: 数据块（例如 WebSocket 收到的二进制消息）
+    :param size: 每帧样本数，默认 16 kHz 60 ms
+    :return: int16 帧的生成器，不足一帧的结尾丢弃
+    """
+    size = size or frame_samples()
+    frame_bytes = size * SAMPLE_WIDTH
+    remainder = b''
+    for chunk in chunks:
+        if remainder:
+            chunk = remainder + bytes(chunk)
+        whole = len(chunk) - len(chunk) % frame_bytes
+        if whole:
+            yield from to_frames(memoryview(chunk)[:whole], size)[0]
+        remainder = bytes(memoryview(chunk)[whole:])
+
+
+def _bench(streams: int, rounds: int) -> None:
+    rng = np.random.default_rng(0)
+    src_frame = frame_samples(24000)
+    dst_frame = frame_samples(16000)
+    # 模拟每路收到的一帧 24 kHz PCM 字节：一半为语音量级，一半为底噪
+    amplitude = np.where(np.arange(streams) % 2 == 0, 4000, 200)[:, np.newaxis]
+    payload = to_pcm16(rng.standard_normal((streams, src_frame)) * amplitude).tobytes()
+    down = Resampler(24000, 16000, streams)
+    up = Resampler(16000, 24000, streams)
+    vad = EnergyVAD(streams)
+
+    timings = {'分帧': 0.0, '24k→16k': 0.0, '电平': 0.0, 'VAD': 0.0, '16k→24k': 0.0}
+    for _ in range(rounds):
+        started = time.perf_counter()
+        block, _ = to_frames(payload, src_frame)
+        timings['分帧'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        narrow = down.process(block)
+        timings['24k→16k'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        rms(narrow)
+        peak(narrow)
+        timings['电平'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        vad.process(narrow)
+        timings['VAD'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        up.process(narrow)
+        timings['16k→24k'] += time.perf_counter() - started
+
+    assert narrow.shape == (streams, dst_frame)
+    budget = FRAME_MS / 1000
+    total = sum(timings.values()) / rounds
+    for name, elapsed in timings.items():
+        print(f"{name:>8}: {elapsed / rounds * 1000:8.3f} ms")
+    print(f"{streams} 路各处理一帧 ({FRAME_MS} ms 音频) 共 {total * 1000:.3f} ms，"
+          f"单核约可实时承载 {int(streams * budget / total)} 路")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PCM16 音频处理")
+    parser.add_argument('--bench', type=int, default=0, help="压测：并行处理的流数")
+    parser.add_argument('--rounds', type=int, default=50, help="压测轮数")
+    args = parser.parse_args()
+    if not args.bench:
+        parser.print_help()
+        return
+    _bench(args.bench, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""
+人设指示词模板
+
+叫醒通话发给 AI 的指示词 = 闹钟上下文 + 人设提示词 + 开场白建议 + 音色提示（见 ALARM_CONTEXT_FLOW.md）。
+人设部分只在人设变化时才会变，这里预先编译：
+- 提示词与开场白按 {time} / {alarm} / {date} 占位符切分为字面量与占位符交替的片段，不含占位符时整段就是常量
+- 编译时统计字面量的字符数与估算 token 数，渲染时只需加上占位符取值的部分
+- 编译结果按人设 ID 缓存，人设写操作后失效，另有 TTL 兜底多进程部署下的失效
+- 每次渲染只格式化几行闹钟上下文，再拼接预编译的片段
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple
+from audio_cache import PLACEHOLDER_PATTERN
+from config import Config
+from models import Alarm, AIPersona
+
+
+WEEKDAY_NAMES = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+
+CONTEXT_TEXT = (
+    "【闹钟上下文信息】\n"
+    "当前时间：{year}年{month}月{day}日 {weekday} {time}\n"
+    "闹钟名称：{name}\n"
+    "闹钟类型：{repeat}\n"
+    "---\n"
+    "请根据以上信息，以合适的方式与用户对话，帮助用户完成闹钟设定的任务。\n"
+)
+# 闹钟上下文的字段
+FIELD_PATTERN = re.compile(r'\{(\w+)\}')
+
+DEFAULT_DIRECTIVE = "现在是{time}，闹钟“{alarm}”已响铃。请用一句简短而有活力的话温柔唤醒我，然后等待我回应。"
+
+# 粗略的 token 估算：每个汉字、每个英文单词、每串数字、每个标点各算一个
+TOKEN_PATTERN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]|[A-Za-z]+|\d+|[^\sA-Za-z\d\u3400-\u9fff\uf900-\ufaff]')
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 数"""
+    return len(TOKEN_PATTERN.findall(text))
+
+
+@lru_cache(maxsize=1024)
+def repeat_description(repeat_days: Optional[str]) -> str:
+    """重复日期的中文描述，与客户端 Alarm.getRepeatDescription() 一致"""
+    days = sorted({int(day) for day in (repeat_days or '').split(',') if day.strip().isdigit()})
+    if not days:
+        return '仅一次'
+    if len(days) == 7:
+        return '每天'
+    if days == [1, 2, 3, 4, 5]:
+        return '工作日'
+    if days == [6, 7]:
+        return '周末'
+    return ', '.join(WEEKDAY_NAMES[day - 1] for day in days if 1 <= day <= 7)
+
+
+class CompiledTemplate:
+    """切分好的模板：literals 与 names 交替排列，len(literals) == len(names) + 1"""
+
+    def __init__(self, pattern: Pattern = PLACEHOLDER_PATTERN):
+        """
+        :param pattern: 占位符正则，第一个分组为占位符名
+        """
+        self.pattern = pattern
+        self.literals: List[str] = ['']
+        self.names: List[str] = []
+        self.chars = 0
+        self.tokens = 0
+        # 每个占位符出现的次数，用于渲染时补算长度
+        self.occurrences: Dict[str, int] = {}
+
+    def append(self, text: str, placeholders: bool = True) -> 'CompiledTemplate':
+        """
+        追加一段文本
+        :param text: 文本
+        :param placeholders: 是否解析其中的占位符，False 时按字面量追加
+        """
+        position = 0
+        if placeholders:
+            for match in self.pattern.finditer(text):
+                self._literal(text[position:match.start()])
+                name = match.group(1)
+                self.names.append(name)
+                self.literals.append('')
+                self.occurrences[name] = self.occurrences.get(name, 0) + 1
+                position = match.end()
+        self._literal(text[position:])
+        return self
+
+    def _literal(self, text: str) -> None:
+        self.literals[-1] += text
+        self.chars += len(text)
+        self.tokens += estimate_tokens(text)
+
+    @property
+    def is_static(self) -> bool:
+        return not self.names
+
+    def render(self, values: Dict[str, str]) -> str:
+        if not self.names:
+            return self.literals[0]
+        parts = [self.literals[0]]
+        for name, literal in zip(self.names, self.literals[1:]):
+            parts.append(values[name])
+            parts.append(literal)
+        return ''.join(parts)
+
+    def measure(self, values: Dict[str, str]) -> Tuple[int, int]:
+        """渲染结果的 (字符数, 估算 token 数)，不必真正渲染"""
+        chars = self.chars
+        tokens = self.tokens
+        for name, count in self.occurrences.items():
+            chars += len(values[name]) * count
+            tokens += estimate_tokens(values[name]) * count
+        return chars, tokens
+
+
+class CompiledPersona:
+    """编译好的人设指示词"""
+
+    def __init__(self, persona: Optional[AIPersona]):
+        """
+        :param persona: AI人设，None 时使用默认指示词
+        """
+        self.persona_id = persona.persona_id if persona else None
+        self.voice_id = persona.voice_id if persona else None
+        self.body = CompiledTemplate()
+        if persona is None:
+            self.body.append(DEFAULT_DIRECTIVE)
+            raw = [DEFAULT_DIRECTIVE]
+        else:
+            self.body.append(persona.system_prompt or '')
+            if (persona.opening_line or '').strip():
+                self.body.append("\n开场白建议：", placeholders=False).append(persona.opening_line)
+            # 音色是 ID，不解析占位符
+            if (persona.voice_id or '').strip():
+                self.body.append(f"\n音色：{persona.voice_id}（若支持）", placeholders=False)
+            raw = [persona.system_prompt or '', persona.opening_line or '', persona.voice_id or '']
+        # 人设内容的指纹，内容不变时版本号不变
+        self.version = hashlib.sha1('\x00'.join(raw).encode('utf-8')).hexdigest()[:12]
+        self.compiled_at = time.monotonic()
+
+
+CONTEXT = CompiledTemplate(FIELD_PATTERN).append(CONTEXT_TEXT)
+
+
+class RenderedDirective:
+    """渲染结果，token 数按预编译的字面量统计加上字段取值按需计算"""
+
+    def __init__(self, text: str, template: CompiledPersona,
+                 context_values: Dict[str, str], body_values: Optional[Dict[str, str]]):
+        self.text = text
+        self.template = template
+        self._context_values = context_values
+        self._body_values = body_values
+
+    @property
+    def chars(self) -> int:
+        return len(self.text)
+
+    @property
+    def tokens(self) -> int:
+        body = self.template.body
+        tokens = CONTEXT.measure(self._context_values)[1]
+        return tokens + (body.measure(self._body_values)[1] if self._body_values else body.tokens)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'directive': self.text,
+            'chars': self.chars,
+            'tokens': self.tokens,
+            'persona_id': self.template.persona_id,
+            'persona_version': self.template.version,
+            'voice_id': self.template.voice_id
+        }
+
+
+def render_directive(alarm: Alarm, template: CompiledPersona, fire_at: datetime) -> RenderedDirective:
+    """
+    渲染完整指示词，格式与客户端 AIService._prepareDirectiveText() 一致
+    :param alarm: 闹钟
+    :param template: 编译好的人设
+    :param fire_at: 闹钟到点时间（闹钟所在时区）
+    :return: 渲染结果
+    """
+    alarm_time = alarm.alarm_time or f'{fire_at.hour:02d}:{fire_at.minute:02d}'
+    context_values = {
+        'year': str(fire_at.year),
+        'month': str(fire_at.month),
+        'day': str(fire_at.day),
+        'weekday': WEEKDAY_NAMES[fire_at.weekday()],
+        'time': alarm_time,
+        'name': alarm.alarm_name or '',
+        'repeat': repeat_description(alarm.repeat_days)
+    }
+    body = template.body
+    body_values = None
+    if body.is_static:
+        text = body.literals[0]
+    else:
+        body_values = {
+            'time': alarm_time,
+            'alarm': alarm.alarm_name or '',
+            'date': f'{fire_at.year:04d}-{fire_at.month:02d}-{fire_at.day:02d}'
+        }
+        text = body.render(body_values)
+    return RenderedDirective(
+        f"{CONTEXT.render(context_values)}\n{text}",
+        template,
+        context_values,
+        body_values
+    )
+
+
+def build_directive(alarm: Alarm, persona: Optional[AIPersona], fire_at: datetime) -> str:
+    """
+    构建发送给 AI 的完整指示词（一次性编译，不经过缓存）
+    :param alarm: 闹钟
+    :param persona: 闹钟使用的人设，None 时使用默认指示词
+    :param fire_at: 闹钟到点时间（闹钟所在时区）
+    :return: 闹钟上下文 + 人设指示词
+    """
+    return render_directive(alarm, CompiledPersona(persona), fire_at).text
+
+
+class TemplateCache:
+    """按人设 ID 缓存编译结果"""
+
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        """
+        :param ttl: 编译结果的最长保留秒数
+        :param max_entries: 最多缓存的人设数
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CompiledPersona]" = OrderedDict()
+        # 失效代数：加载期间发生 invalidate() 时不保存加载结果，避免旧模板覆盖变更
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, persona_id: str, load: Callable[[str], Optional[AIPersona]]) -> CompiledPersona:
+        """
+        获取编译好的人设，未命中时加载并编译
+        :param persona_id: 人设 ID
+        :param load: 按 ID 读取人设，返回 None 时编译为默认指示词
+        """
+        now = time.monotonic()
+        with self._lock:
+            template = self._entries.get(persona_id)
+            if template is not None and now - template.compiled_at < self.ttl:
+                self._entries.move_to_end(persona_id)
+                self.hits += 1
+                return template
+            self.misses += 1
+            generation = (self._epoch, self._generations.get(persona_id, 0))
+        template = CompiledPersona(load(persona_id))
+        with self._lock:
+            if generation != (self._epoch, self._generations.get(persona_id, 0)):
+                return template
+            self._entries[persona_id] = template
+            self._entries.move_to_end(persona_id)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return template
+
+    def invalidate(self, persona_id: Optional[str] = None) -> None:
+        """人设变更后调用，persona_id 为 None 时清空"""
+        with self._lock:
+            if persona_id is None:
+                self._entries.clear()
+                self._epoch += 1
+            else:
+                self._entries.pop(persona_id, None)
+                self._generations[persona_id] = self._generations.get(persona_id, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+persona_templates = TemplateCache(Config.PROMPT_TEMPLATE_TTL)
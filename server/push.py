@@ -0,0 +1,677 @@
+"""
+叫醒推送分发
+
+到点时由服务端向设备发送 VoIP / FCM 推送唤起来电界面，不再只依赖设备本地调度：
+- 按推送通道分组，每批 PUSH_BATCH_SIZE 条，最多 PUSH_CONCURRENCY 批同时在途
+- 每个通道一个令牌桶，发送速率不超过该通道的配额
+- 网关返回可重试错误（限流、5xx、网络错误）时进入重试队列，指数退避，超过闹钟这一分钟后放弃
+- 网关报告令牌失效时批量停用 device_tokens 中的记录
+- HttpPushGateway 在单独的事件循环中复用少量 HTTP/2 连接，每批请求在连接上多路复用
+- LocalPushGateway 是进程内替身，可注入延迟、失效令牌与随机失败，用于测试和压测
+
+- 逐分钟推送由 PushScheduler 驱动：显式的分钟游标逐分钟推进，在整分钟前 PUSH_PREFETCH 秒预取闹钟与令牌；
+  某一分钟的发送（含重试）拖过下一个整分钟时不会跳过下一分钟，落后的分钟在推送过期前补发
+
+- PushSessionBackend 把推送作为 dispatcher.WakeDispatcher 的会话后端：每通电话在错峰后的启动时间推送，
+  同时受人设并发上限约束（--staggered 模式，与默认的整分钟推送二选一）
+
+用法:
+    python push.py              # 每分钟推送到点的闹钟
+    python push.py --staggered  # 到点前后 WAKE_DISPATCH_TOLERANCE 秒内错峰推送，按人设限制并发
+    python push.py --simulate 30000
+"""
+import argparse
+import asyncio
+import heapq
+import random
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+import httpx
+from admission import TokenBucket
+from config import Config
+from dao import AlarmDAO, DeviceTokenDAO
+from database import Database
+from dispatcher import SessionBackend, WakeCall, WakeDispatcher, parse_limits
+from models import Alarm, PUSH_PROVIDERS
+
+
+# 单条推送的结果
+DELIVERED = 'delivered'
+RETRY = 'retry'
+INVALID = 'invalid'
+FAILED = 'failed'
+
+
+class PushMessage:
+    """一条待发送的推送"""
+
+    def __init__(
+        self,
+        device_token: str,
+        provider: str,
+        payload: Dict[str, Any],
+        expires_at: float,
+        user_id: Optional[str] = None,
+        alarm_id: Optional[str] = None
+    ):
+        """
+        :param device_token: 设备令牌
+        :param provider: 推送通道 (apns_voip / apns / fcm)
+        :param payload: 推送内容
+        :param expires_at: 过期时间 (Unix 秒)，过期后不再重试
+        :param user_id: 所属用户
+        :param alarm_id: 对应的闹钟
+        """
+        self.device_token = device_token
+        self.provider = provider
+        self.payload = payload
+        self.expires_at = expires_at
+        self.user_id = user_id
+        self.alarm_id = alarm_id
+        self.attempts = 0
+
+
+class PushGateway:
+    """推送网关接口"""
+
+    def send_batch(self, provider: str, messages: Sequence[PushMessage]) -> List[str]:
+        """
+        发送一批同通道的推送
+        :param provider: 推送通道
+        :param messages: 推送列表
+        :return: 与 messages 一一对应的结果 (DELIVERED / RETRY / INVALID / FAILED)
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class LocalPushGateway(PushGateway):
+    """进程内的推送网关替身"""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        invalid_tokens: Sequence[str] = (),
+        failure_rate: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        """
+        :param latency: 每批的模拟往返耗时（秒）
+        :param invalid_tokens: 视为已失效的令牌
+        :param failure_rate: 每条推送返回可重试错误的概率
+        :param seed: 随机数种子
+        """
+        self.latency = latency
+        self.invalid_tokens = set(invalid_tokens)
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.delivered: Dict[str, List[PushMessage]] = {}
+        self.batches = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def send_batch(self, provider: str, messages: Sequence[PushMessage]) -> List[str]:
+        with self._lock:
+            self.batches += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            results = []
+            with self._lock:
+                for message in messages:
+                    if message.device_token in self.invalid_tokens:
+                        results.append(INVALID)
+                    elif self._random.random() < self.failure_rate:
+                        results.append(RETRY)
+                    else:
+                        self.delivered.setdefault(provider, []).append(message)
+                        results.append(DELIVERED)
+            return results
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class HttpPushGateway(PushGateway):
+    """APNs / FCM 的 HTTP/2 网关，所有请求在后台事件循环中复用连接池"""
+
+    def __init__(
+        self,
+        apns_url: str = Config.PUSH_APNS_URL,
+        apns_topic: str = Config.PUSH_APNS_TOPIC,
+        apns_auth_token: str = Config.PUSH_APNS_AUTH_TOKEN,
+        fcm_url: str = Config.PUSH_FCM_URL,
+        fcm_auth_token: str = Config.PUSH_FCM_AUTH_TOKEN,
+        connections: int = Config.PUSH_HTTP_CONNECTIONS,
+        streams: int = Config.PUSH_HTTP_STREAMS,
+        timeout: float = 5.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        """
+        :param apns_url: APNs 地址
+        :param apns_topic: APNs topic（App Bundle ID，VoIP 推送自动追加 .voip）
+        :param apns_auth_token: APNs 鉴权 JWT，由外部签发并定期轮换
+        :param fcm_url: FCM v1 messages:send 地址
+        :param fcm_auth_token: FCM OAuth 访问令牌
+        :param connections: 连接池大小
+        :param streams: 每个连接上的并发流数
+        :param timeout: 单次请求超时秒数
+        :param transport: 自定义传输层，用于测试
+        """
+        self.apns_url = apns_url.rstrip('/')
+        self.apns_topic = apns_topic
+        self.apns_auth_token = apns_auth_token
+        self.fcm_url = fcm_url
+        self.fcm_auth_token = fcm_auth_token
+        self.max_streams = connections * streams
+        self._client = httpx.AsyncClient(
+            http2=True,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+            transport=transport
+        )
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='push-gateway', daemon=True)
+        self._thread.start()
+        self._streams: Optional[asyncio.Semaphore] = None
+
+    def send_batch(self, provider: str, messages: Sequence[PushMessage]) -> List[str]:
+        return asyncio.run_coroutine_threadsafe(self._send_all(provider, messages), self._loop).result()
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _send_all(self, provider: str, messages: Sequence[PushMessage]) -> List[str]:
+        if self._streams is None:
+            self._streams = asyncio.Semaphore(self.max_streams)
+        return list(await asyncio.gather(*(self._send_one(provider, message) for message in messages)))
+
+    async def _send_one(self, provider: str, message: PushMessage) -> str:
+        url, headers, body = self._build_request(provider, message)
+        async with self._streams:
+            try:
+                response = await self._client.post(url, headers=headers, json=body)
+            except httpx.HTTPError:
+                return RETRY
+        return self._classify(provider, response)
+
+    def _build_request(self, provider: str, message: PushMessage) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """构造单条推送的请求地址、头和正文"""
+        if provider == 'fcm':
+            headers = {'authorization': f'Bearer {self.fcm_auth_token}'}
+            ttl = max(int(message.expires_at - time.time()), 0)
+            body = {'message': {
+                'token': message.device_token,
+                'data': {key: str(value) for key, value in message.payload.items()},
+                'android': {'priority': 'high', 'ttl': f'{ttl}s'}
+            }}
+            return self.fcm_url, headers, body
+
+        voip = provider == 'apns_voip'
+        headers = {
+            'authorization': f'bearer {self.apns_auth_token}',
+            'apns-topic': f'{self.apns_topic}.voip' if voip else self.apns_topic,
+            'apns-push-type': 'voip' if voip else 'alert',
+            'apns-priority': '10',
+            'apns-expiration': str(int(message.expires_at))
+        }
+        if voip:
+            body = dict(message.payload, aps={})
+        else:
+            body = dict(message.payload, aps={
+                'alert': {'title': message.payload.get('nameCaller', ''), 'body': message.payload.get('handle', '')},
+                'sound': 'default'
+            })
+        return f'{self.apns_url}/3/device/{message.device_token}', headers, body
+
+    @staticmethod
+    def _classify(provider: str, response: httpx.Response) -> str:
+        """将网关响应映射为推送结果"""
+        status = response.status_code
+        if status == 200:
+            return DELIVERED
+        if status == 429 or status >= 500:
+            return RETRY
+        if status == 410 or (provider == 'fcm' and status == 404):
+            return INVALID
+        if status == 400 and provider != 'fcm':
+            try:
+                reason = response.json().get('reason')
+            except ValueError:
+                reason = None
+            if reason in ('BadDeviceToken', 'DeviceTokenNotForTopic'):
+                return INVALID
+        return FAILED
+
+
+class PushDispatcher:
+    """按通道限速、分批并发、带重试队列的推送分发器"""
+
+    def __init__(
+        self,
+        gateway: PushGateway,
+        batch_size: int = Config.PUSH_BATCH_SIZE,
+        concurrency: int = Config.PUSH_CONCURRENCY,
+        max_attempts: int = Config.PUSH_MAX_ATTEMPTS,
+        retry_backoff: float = Config.PUSH_RETRY_BACKOFF,
+        rates: Optional[Dict[str, float]] = None,
+        default_rate: float = Config.PUSH_DEFAULT_RATE,
+        on_invalid: Callable[[Sequence[str]], Any] = DeviceTokenDAO.deactivate
+    ):
+        """
+        :param gateway: 推送网关
+        :param batch_size: 每批条数
+        :param concurrency: 同时在途的批数
+        :param max_attempts: 单条推送的最多发送次数
+        :param retry_backoff: 首次重试前的等待秒数，之后每次翻倍
+        :param rates: 按通道覆盖每秒发送上限，默认读取 PUSH_PROVIDER_RATES
+        :param default_rate: 未配置通道的每秒发送上限
+        :param on_invalid: 收到失效令牌后的回调
+        """
+        self.gateway = gateway
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.rates = parse_limits(Config.PUSH_PROVIDER_RATES) if rates is None else rates
+        self.default_rate = default_rate
+        self.on_invalid = on_invalid
+        # 桶容量至少容纳一整批，否则大批次永远拿不到令牌
+        self._buckets = {
+            provider: TokenBucket(rate, max(rate, batch_size))
+            for provider, rate in ((p, self.rates.get(p, default_rate)) for p in PUSH_PROVIDERS)
+        }
+        # 相邻两分钟的发送可能同时进行，共用通道的令牌桶
+        self._bucket_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='push')
+
+    def send(self, messages: Sequence[PushMessage]) -> Dict[str, Any]:
+        """
+        发送一组推送，直到全部完成或过期
+        :param messages: 推送列表
+        :return: 发送统计
+        """
+        started = time.monotonic()
+        ready: Dict[str, Deque[PushMessage]] = {}
+        for message in messages:
+            ready.setdefault(message.provider, deque()).append(message)
+        retries: List[Tuple[float, int, PushMessage]] = []
+        in_flight: Dict[Any, Tuple[str, List[PushMessage]]] = {}
+        counts = {DELIVERED: 0, RETRY: 0, INVALID: 0, FAILED: 0, 'expired': 0}
+        invalid_tokens: List[str] = []
+        seq = 0
+
+        while ready or retries or in_flight:
+            now = time.time()
+            while retries and retries[0][0] <= now:
+                _, _, message = heapq.heappop(retries)
+                ready.setdefault(message.provider, deque()).append(message)
+
+            # 丢弃已过期的推送：闹钟这一分钟过去之后再响铃已经没有意义
+            for provider in list(ready):
+                queue = ready[provider]
+                while queue and queue[0].expires_at <= now:
+                    queue.popleft()
+                    counts['expired'] += 1
+                if not queue:
+                    del ready[provider]
+
+            throttle_wait = None
+            for provider in list(ready):
+                queue = ready[provider]
+                while queue and len(in_flight) < self.concurrency:
+                    batch_len = min(self.batch_size, len(queue))
+                    with self._bucket_lock:
+                        allowed, wait_seconds = self._buckets[provider].try_acquire(time.monotonic(), batch_len)
+                    if not allowed:
+                        throttle_wait = wait_seconds if throttle_wait is None else min(throttle_wait, wait_seconds)
+                        break
+                    batch = [queue.popleft() for _ in range(batch_len)]
+                    for message in batch:
+                        message.attempts += 1
+                    future = self._executor.submit(self.gateway.send_batch, provider, batch)
+                    in_flight[future] = (provider, batch)
+                if not queue:
+                    del ready[provider]
+
+            timeout = 0.5
+            if throttle_wait is not None:
+                timeout = min(timeout, throttle_wait)
+            if retries:
+                timeout = min(timeout, max(retries[0][0] - time.time(), 0.0))
+            if not in_flight:
+                if ready or retries:
+                    time.sleep(timeout)
+                continue
+
+            done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider, batch = in_flight.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"推送批次发送失败 ({provider}, {len(batch)} 条): {e}")
+                    results = [RETRY] * len(batch)
+                for message, result in zip(batch, results):
+                    if result == RETRY:
+                        counts[RETRY] += 1
+                        retry_at = time.time() + self.retry_backoff * (2 ** (message.attempts - 1))
+                        if message.attempts >= self.max_attempts or retry_at >= message.expires_at:
+                            counts[FAILED] += 1
+                        else:
+                            seq += 1
+                            heapq.heappush(retries, (retry_at, seq, message))
+                    else:
+                        counts[result] += 1
+                        if result == INVALID:
+                            invalid_tokens.append(message.device_token)
+
+        if invalid_tokens:
+            try:
+                self.on_invalid(invalid_tokens)
+            except Exception as e:
+                print(f"停用失效令牌失败: {e}")
+
+        counts['total'] = len(messages)
+        counts['elapsed'] = round(time.monotonic() - started, 3)
+        return counts
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self.gateway.close()
+
+
+def build_wake_messages(alarms: Sequence[Alarm], fire_at: float, ttl: float = 60) -> List[PushMessage]:
+    """
+    为到点的闹钟生成推送，每个闹钟发往其用户的所有有效设备
+    :param alarms: 到点的闹钟
+    :param fire_at: 到点时间 (Unix 秒)
+    :param ttl: 推送有效期（秒）
+    :return: 推送列表
+    """
+    tokens = DeviceTokenDAO.get_active_for_users([alarm.user_id for alarm in alarms])
+    messages = []
+    for alarm in alarms:
+        for token in tokens.get(alarm.user_id, []):
+            # 字段与客户端 flutter_callkit_incoming 的 CallKitParams 一致
+            payload = {
+                'id': str(uuid.uuid5(uuid.NAMESPACE_URL, f'{alarm.alarm_id}@{int(fire_at)}')),
+                'nameCaller': alarm.alarm_name or 'AI 闹钟',
+                'handle': alarm.alarm_time,
+                'type': 1,
+                'duration': 30000,
+                'extra': {
+                    'alarmId': alarm.alarm_id,
+                    'personaId': alarm.ai_persona_id,
+                    'fireAt': int(fire_at)
+                }
+            }
+            messages.append(PushMessage(
+                token.device_token,
+                token.provider,
+                payload,
+                expires_at=fire_at + ttl,
+                user_id=alarm.user_id,
+                alarm_id=alarm.alarm_id
+            ))
+    return messages
+
+
+def create_gateway() -> PushGateway:
+    """
+    按 PUSH_GATEWAY 配置创建网关
+    :raises ValueError: 网关类型未知，或 http 网关未配置任何通道的凭据
+    """
+    if Config.PUSH_GATEWAY == 'http':
+        apns_ready = bool(Config.PUSH_APNS_TOPIC and Config.PUSH_APNS_AUTH_TOKEN)
+        fcm_ready = bool(Config.PUSH_FCM_URL and Config.PUSH_FCM_AUTH_TOKEN)
+        if not (apns_ready or fcm_ready):
+            raise ValueError("未配置 APNs (PUSH_APNS_TOPIC / PUSH_APNS_AUTH_TOKEN) 或 FCM (PUSH_FCM_URL / PUSH_FCM_AUTH_TOKEN) 凭据")
+        return HttpPushGateway()
+    if Config.PUSH_GATEWAY == 'local':
+        # 替身网关只记录推送，不会送达设备
+        print("警告: PUSH_GATEWAY=local，推送不会送达 APNs / FCM")
+        return LocalPushGateway()
+    raise ValueError(f"未知的 PUSH_GATEWAY: {Config.PUSH_GATEWAY}")
+
+
+def load_minute(minute_start: float) -> List[PushMessage]:
+    """
+    读取某一分钟到点的闹钟并生成推送
+    :param minute_start: 该分钟开始的 Unix 秒
+    :return: 推送列表
+    """
+    local = datetime.fromtimestamp(minute_start, timezone(timedelta(minutes=Config.ALARM_UTC_OFFSET_MINUTES)))
+    minute_of_day = local.hour * 60 + local.minute
+    # 两次查询共用一个连接
+    with Database.session():
+        alarms = AlarmDAO.get_enabled_in_window(minute_of_day, minute_of_day, local.date())
+        return build_wake_messages(alarms, minute_start)
+
+
+class PushScheduler:
+    """
+    逐分钟推送到点的闹钟
+    - 分钟游标每次加 60 秒，不从当前时间重新推算，单个分钟处理得再慢也不会跳过后面的分钟
+    - 整分钟前 prefetch 秒预取该分钟的推送，到点只剩发送
+    - 发送在后台线程进行，上一分钟的重试拖过整分钟时，下一分钟照常按时发送
+    - 落后（进程卡顿、预取失败）的分钟在推送有效期内补发，超过有效期才放弃并计入 skipped_minutes
+    """
+
+    def __init__(
+        self,
+        dispatcher: PushDispatcher,
+        prefetch: float = Config.PUSH_PREFETCH,
+        ttl: float = 60,
+        clock: Callable[[], float] = time.time,
+        load: Callable[[float], List[PushMessage]] = load_minute
+    ):
+        """
+        :param dispatcher: 推送分发器
+        :param prefetch: 整分钟前多少秒预取该分钟的推送
+        :param ttl: 推送有效期（秒），与 build_wake_messages 一致
+        :param clock: 返回 Unix 秒的时钟
+        :param load: 读取某一分钟的推送
+        """
+        self.dispatcher = dispatcher
+        self.prefetch = prefetch
+        self.ttl = ttl
+        self.clock = clock
+        self.load = load
+        # 下一个需要发送的整分钟
+        self._next_minute = (int(clock()) // 60 + 1) * 60
+        self._prefetched: Dict[float, List[PushMessage]] = {}
+        self._senders = ThreadPoolExecutor(max_workers=2, thread_name_prefix='push-minute')
+        self.dispatched = 0
+        # 整分钟过后 1 秒以上才发送的分钟数
+        self.late_minutes = 0
+        self.skipped_minutes = 0
+        self.load_failures = 0
+
+    def tick(self) -> None:
+        """预取即将到点的分钟，发送已到点的分钟"""
+        now = self.clock()
+        # 已过有效期的分钟不再读取，下面直接放弃
+        minute = max(self._next_minute, (now - self.ttl) // 60 * 60 + 60)
+        while minute - now <= self.prefetch:
+            if minute not in self._prefetched and not self._fetch(minute):
+                break
+            minute += 60
+
+        while self._next_minute <= now:
+            minute = self._next_minute
+            if now >= minute + self.ttl:
+                print(f"放弃推送 {datetime.fromtimestamp(minute)}: 已超过推送有效期")
+                self._prefetched.pop(minute, None)
+                self.skipped_minutes += 1
+                self._next_minute += 60
+                continue
+            # 预取失败的分钟在到点后重试，仍失败则留到下一轮
+            if minute not in self._prefetched and not self._fetch(minute):
+                break
+            if now - minute >= 1:
+                self.late_minutes += 1
+            messages = self._prefetched.pop(minute)
+            self._senders.submit(self._send, minute, messages)
+            self.dispatched += 1
+            self._next_minute += 60
+
+    def next_wakeup(self) -> float:
+        """距离下一次需要调度的秒数"""
+        target = self._next_minute
+        if self._next_minute not in self._prefetched:
+            target -= self.prefetch
+        return target - self.clock()
+
+    def run(self) -> None:
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                print(f"推送调度错误: {traceback.format_exc()}")
+            time.sleep(min(max(self.next_wakeup(), 0.05), 1.0))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'dispatched': self.dispatched,
+            'late_minutes': self.late_minutes,
+            'skipped_minutes': self.skipped_minutes,
+            'load_failures': self.load_failures
+        }
+
+    def close(self) -> None:
+        self._senders.shutdown(wait=True)
+
+    def _fetch(self, minute: float) -> bool:
+        try:
+            self._prefetched[minute] = self.load(minute)
+            return True
+        except Exception:
+            self.load_failures += 1
+            print(f"读取到点闹钟失败 {datetime.fromtimestamp(minute)}: {traceback.format_exc()}")
+            return False
+
+    def _send(self, minute: float, messages: Sequence[PushMessage]) -> None:
+        try:
+            print(f"推送统计 {datetime.fromtimestamp(minute)}: {self.dispatcher.send(messages)}")
+        except Exception:
+            print(f"推送分发错误 {datetime.fromtimestamp(minute)}: {traceback.format_exc()}")
+
+
+class PushSessionBackend(SessionBackend):
+    """
+    通过推送唤起设备来电的会话后端
+    WakeDispatcher 在错峰后的启动时间调用 start，后台线程每 flush_interval 秒把积攒的通话合并成一组推送发送；
+    通话何时结束由设备决定，服务端收不到回调，名额由 WakeDispatcher 在 call_seconds 后超时回收
+    """
+
+    def __init__(
+        self,
+        dispatcher: PushDispatcher,
+        flush_interval: float = 0.2,
+        build: Callable[[Sequence[Alarm], float], List[PushMessage]] = build_wake_messages
+    ):
+        """
+        :param dispatcher: 推送分发器
+        :param flush_interval: 合并发送的间隔秒数
+        :param build: 为同一到点时间的闹钟生成推送
+        """
+        self.dispatcher = dispatcher
+        self.flush_interval = flush_interval
+        self.build = build
+        self._lock = threading.Lock()
+        self._calls: List[WakeCall] = []
+        self._stop = threading.Event()
+        # 某组推送的重试拖长时，后面的组照常发送
+        self._senders = ThreadPoolExecutor(max_workers=4, thread_name_prefix='push-session')
+        self._flusher = threading.Thread(target=self._run, name='push-session-flush', daemon=True)
+        self._flusher.start()
+        self.sent = 0
+
+    def start(self, call: WakeCall) -> None:
+        with self._lock:
+            self._calls.append(call)
+
+    def flush(self) -> None:
+        """发送已积攒的通话"""
+        with self._lock:
+            calls, self._calls = self._calls, []
+        by_fire_at: Dict[float, List[Alarm]] = {}
+        for call in calls:
+            by_fire_at.setdefault(call.fire_at, []).append(call.alarm)
+        for fire_at, alarms in by_fire_at.items():
+            self._senders.submit(self._send, fire_at, alarms)
+
+    def close(self) -> None:
+        self._stop.set()
+        self._flusher.join()
+        self.flush()
+        self._senders.shutdown(wait=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _send(self, fire_at: float, alarms: List[Alarm]) -> None:
+        try:
+            with Database.session():
+                messages = self.build(alarms, fire_at)
+            self.dispatcher.send(messages)
+            self.sent += len(alarms)
+        except Exception:
+            print(f"叫醒推送失败 {datetime.fromtimestamp(fire_at)} ({len(alarms)} 个闹钟): {traceback.format_exc()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="叫醒推送分发")
+    parser.add_argument('--simulate', type=int, default=0, help="向本地替身网关发送指定条数的推送并输出统计")
+    parser.add_argument('--latency', type=float, default=0.05, help="模拟模式下每批的往返耗时（秒）")
+    parser.add_argument('--staggered', action='store_true', help="经 WakeDispatcher 错峰推送并限制人设并发")
+    args = parser.parse_args()
+
+    if args.simulate:
+        gateway = LocalPushGateway(latency=args.latency, failure_rate=0.01, seed=0)
+        dispatcher = PushDispatcher(gateway, on_invalid=lambda tokens: None)
+        expires_at = time.time() + 60
+        messages = [
+            PushMessage(f'token_{i}', PUSH_PROVIDERS[i % 2 * 2], {'id': str(i)}, expires_at)
+            for i in range(args.simulate)
+        ]
+        print(f"推送统计: {dispatcher.send(messages)}")
+        print(f"网关批次: {gateway.batches}，最大在途批数: {gateway.max_in_flight}")
+        dispatcher.close()
+        return
+
+    dispatcher = PushDispatcher(create_gateway())
+    if args.staggered:
+        backend = PushSessionBackend(dispatcher)
+        try:
+            WakeDispatcher(backend).run(threading.Event())
+        finally:
+            backend.close()
+            dispatcher.close()
+        return
+
+    scheduler = PushScheduler(dispatcher)
+    try:
+        scheduler.run()
+    finally:
+        scheduler.close()
+        dispatcher.close()
+
+
+if __name__ == '__main__':
+    main()
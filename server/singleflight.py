@@ -0,0 +1,107 @@
+"""
+并发请求合并 (Single-flight)
+
+相同 key 的并发读取只执行一次底层查询，结果（或异常）分发给所有等待者，
+用于削平闹钟高峰时大量客户端同时读取同一数据造成的数据库压力。
+
+发起查询的调用者拿到原始结果，每个等待者拿到各自的深拷贝（异常同样各自一份），
+调用方修改返回的对象不会影响其他请求。
+"""
+import copy
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    """一次进行中的查询"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+def _copy_error(error: BaseException) -> BaseException:
+    """为等待者复制异常，保留原始的调用栈与异常链；无法复制的异常原样返回"""
+    try:
+        clone = copy.copy(error)
+    except Exception:
+        return error
+    clone.__cause__ = error.__cause__
+    clone.__context__ = error.__context__
+    clone.__suppress_context__ = error.__suppress_context__
+    return clone.with_traceback(error.__traceback__)
+
+
+class SingleFlight:
+    """相同 key 的并发调用共享同一次执行"""
+
+    def __init__(self, timeout: float):
+        """
+        :param timeout: 等待者等待进行中查询的最长秒数
+        """
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """
+        执行 fn，若已有相同 key 的调用在进行中则等待其结果
+        :param key: 合并用的 key，需包含所有影响结果的参数
+        :param fn: 实际执行的查询函数
+        :param timeout: 等待超时秒数，默认使用构造时的配置
+        :return: fn 的返回值；合并到进行中查询的调用者得到其深拷贝
+        :raises TimeoutError: 等待进行中的查询超时
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    # forget() 之后同 key 可能已有新的调用，不能误删
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+                call.done.set()
+        elif not call.done.wait(self.timeout if timeout is None else timeout):
+            self.timeouts += 1
+            raise TimeoutError(f"等待合并查询超时: {key!r}")
+
+        if call.error is not None:
+            raise call.error if leader else _copy_error(call.error)
+        return call.result if leader else copy.deepcopy(call.result)
+
+    def forget(self) -> None:
+        """
+        丢弃所有进行中的调用记录，之后的请求会发起新的查询。
+        写操作提交后调用，避免新请求拿到写入之前开始的查询结果。
+        """
+        with self._lock:
+            self._calls.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """合并统计"""
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'timeouts': self.timeouts,
+            'in_flight': in_flight
+        }
@@ -0,0 +1,192 @@
+"""
+基于摘要的同步对账 (anti-entropy)
+
+客户端只上报每个闹钟的 (内容指纹, 版本)，服务端与库中存储的指纹比对，只返回有差异的部分：
+- download: 客户端缺少或落后的闹钟完整数据
+- upload_ids: 客户端应上传（POST / PUT）的闹钟
+- delete_ids: 服务端已删除、客户端应删除的闹钟
+- versions: 内容一致但版本号不同的闹钟，客户端更新本地记录的版本即可
+
+版本规则（替代按 createdAt 合并）：客户端记录的 version 是本地副本所基于的服务端版本
+- 服务端版本更高：服务端较新，下发；客户端在此期间也改过 (dirty) 时记入 conflict_ids，以服务端为准
+- 版本相同而指纹不同：客户端在该版本上做了修改，上传
+- 只在客户端且 version 为 0：客户端新建，上传；version > 0 说明曾同步过，服务端已删除
+- 服务端指纹为空（在线迁移回填之前）：无法比较内容，以服务端为准下发，dirty 时同样记入 conflict_ids
+
+闹钟很多时先按分桶摘要对账（类 Merkle 树的一层）：客户端上报每个非空桶的摘要，
+服务端返回摘要不同的桶，客户端再只上报这些桶内的闹钟。两种请求都走 POST /api/sync。
+"""
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from config import Config
+from dao import AlarmDAO
+from events import change_feed
+
+
+Digests = Dict[str, Tuple[str, int]]
+
+
+def bucket_of(alarm_id: str, bucket_count: int) -> int:
+    """闹钟所在的桶：alarm_id 的 SHA-256 前 4 字节（大端）对桶数取模"""
+    return int.from_bytes(hashlib.sha256(alarm_id.encode('utf-8')).digest()[:4], 'big') % bucket_count
+
+
+def bucket_digests(digests: Digests, bucket_count: int) -> Dict[int, str]:
+    """
+    每个非空桶的摘要：桶内按 alarm_id 排序后逐行拼接 "alarm_id:content_hash:version\\n"，
+    取 SHA-256 前 16 位十六进制
+    :param digests: {alarm_id: (content_hash, version)}
+    :param bucket_count: 桶数
+    :return: {桶号: 摘要}
+    """
+    buckets: Dict[int, List[str]] = {}
+    for alarm_id, (content_hash, version) in digests.items():
+        buckets.setdefault(bucket_of(alarm_id, bucket_count), []).append(f'{alarm_id}:{content_hash}:{version}\n')
+    return {
+        bucket: hashlib.sha256(''.join(sorted(lines)).encode('utf-8')).hexdigest()[:16]
+        for bucket, lines in buckets.items()
+    }
+
+
+def diff_buckets(server: Dict[int, str], client: Dict[int, str]) -> List[int]:
+    """摘要不同的桶（包括只有一方非空的桶）"""
+    return sorted(bucket for bucket in set(server) | set(client) if server.get(bucket) != client.get(bucket))
+
+
+def reconcile(
+    server: Digests,
+    client: Dict[str, Dict[str, Any]],
+    scope: Optional[Set[int]] = None,
+    bucket_count: int = 0
+) -> Dict[str, Any]:
+    """
+    逐条比对
+    :param server: 服务端 {alarm_id: (content_hash, version)}
+    :param client: 客户端 {alarm_id: {'hash': ..., 'version': ..., 'dirty': ...}}
+    :param scope: 只比对这些桶内的闹钟，None 表示全部
+    :param bucket_count: scope 对应的桶数
+    :return: download_ids / upload_ids / delete_ids / conflict_ids / versions / in_sync
+    """
+    if scope is not None:
+        server = {alarm_id: value for alarm_id, value in server.items() if bucket_of(alarm_id, bucket_count) in scope}
+        client = {alarm_id: entry for alarm_id, entry in client.items() if bucket_of(alarm_id, bucket_count) in scope}
+
+    download_ids: List[str] = []
+    upload_ids: List[str] = []
+    delete_ids: List[str] = []
+    conflict_ids: List[str] = []
+    versions: Dict[str, int] = {}
+    in_sync = 0
+
+    for alarm_id, entry in client.items():
+        remote = server.get(alarm_id)
+        version = entry['version']
+        if remote is None:
+            (upload_ids if version == 0 else delete_ids).append(alarm_id)
+            continue
+        content_hash, server_version = remote
+        if not content_hash:
+            download_ids.append(alarm_id)
+            if entry.get('dirty'):
+                conflict_ids.append(alarm_id)
+        elif content_hash == entry['hash']:
+            in_sync += 1
+            if server_version != version:
+                versions[alarm_id] = server_version
+        elif server_version > version:
+            download_ids.append(alarm_id)
+            if entry.get('dirty'):
+                conflict_ids.append(alarm_id)
+        else:
+            upload_ids.append(alarm_id)
+
+    download_ids.extend(alarm_id for alarm_id in server if alarm_id not in client)
+    return {
+        'download_ids': download_ids,
+        'upload_ids': upload_ids,
+        'delete_ids': delete_ids,
+        'conflict_ids': conflict_ids,
+        'versions': versions,
+        'in_sync': in_sync
+    }
+
+
+def _parse_bucket_count(value: Any) -> int:
+    bucket_count = Config.SYNC_BUCKETS if value is None else value
+    if not isinstance(bucket_count, int) or isinstance(bucket_count, bool) or not 1 <= bucket_count <= Config.SYNC_MAX_BUCKETS:
+        raise ValueError(f"bucket_count 必须是 1-{Config.SYNC_MAX_BUCKETS} 之间的整数")
+    return bucket_count
+
+
+def _parse_buckets(values: Iterable[Any], bucket_count: int) -> Set[int]:
+    buckets = set()
+    for value in values:
+        try:
+            bucket = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"桶号无效: {value}")
+        if not 0 <= bucket < bucket_count:
+            raise ValueError(f"桶号超出范围: {bucket}")
+        buckets.add(bucket)
+    return buckets
+
+
+def _parse_alarms(alarms: Any) -> Dict[str, Dict[str, Any]]:
+    if not isinstance(alarms, dict):
+        raise ValueError("alarms 必须是 {alarm_id: {hash, version}} 对象")
+    parsed = {}
+    for alarm_id, entry in alarms.items():
+        if not isinstance(entry, dict) or not isinstance(entry.get('hash'), str):
+            raise ValueError(f"闹钟 {alarm_id} 缺少 hash")
+        version = entry.get('version', 0)
+        if not isinstance(version, int) or isinstance(version, bool) or version < 0:
+            raise ValueError(f"闹钟 {alarm_id} 的 version 必须是非负整数")
+        parsed[alarm_id] = {'hash': entry['hash'], 'version': version, 'dirty': bool(entry.get('dirty'))}
+    return parsed
+
+
+def sync(user_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    处理一次同步请求
+    :param user_id: 用户ID
+    :param payload: 请求体，含 buckets（桶摘要对账）或 alarms（逐条对账，可带 scope 限定桶）
+    :return: 对账结果
+    :raises ValueError: 请求格式错误
+    """
+    bucket_count = _parse_bucket_count(payload.get('bucket_count'))
+    # 先取游标再读取，读取之后的变更可以通过变更流补齐
+    cursor = change_feed.cursor
+    server = AlarmDAO.get_digests(user_id)
+
+    if 'alarms' not in payload:
+        client_buckets = payload.get('buckets')
+        if not isinstance(client_buckets, dict):
+            raise ValueError("请求体需要 alarms 或 buckets")
+        client = {}
+        for key, digest in client_buckets.items():
+            bucket, = _parse_buckets([key], bucket_count)
+            if bucket in client:
+                raise ValueError(f"buckets 中存在重复的桶号: {bucket}")
+            client[bucket] = digest
+        mismatched = diff_buckets(bucket_digests(server, bucket_count), client)
+        return {
+            'bucket_count': bucket_count,
+            'mismatched_buckets': mismatched,
+            'total': len(server),
+            'cursor': cursor
+        }
+
+    client = _parse_alarms(payload['alarms'])
+    scope = None
+    if payload.get('scope') is not None:
+        if not isinstance(payload['scope'], list):
+            raise ValueError("scope 必须是桶号数组")
+        scope = _parse_buckets(payload['scope'], bucket_count)
+    result = reconcile(server, client, scope, bucket_count)
+
+    # 只读取需要下发的整行
+    download_ids = result.pop('download_ids')
+    result['download'] = [alarm.to_dict() for alarm in AlarmDAO.get_by_ids(user_id, download_ids)] if download_ids else []
+    result['compared'] = len(client)
+    result['cursor'] = cursor
+    return result
@@ -0,0 +1,170 @@
+"""
+sync.reconcile 与分桶对账的单元测试
+
+不访问数据库，在 server 目录下运行：
+    python -m unittest discover -s tests   # 或 python -m pytest tests
+"""
+import unittest
+from sync import bucket_digests, bucket_of, diff_buckets, reconcile
+
+
+def client_entry(content_hash: str, version: int, dirty: bool = False):
+    return {'hash': content_hash, 'version': version, 'dirty': dirty}
+
+
+EMPTY = {
+    'download_ids': [],
+    'upload_ids': [],
+    'delete_ids': [],
+    'conflict_ids': [],
+    'versions': {},
+    'in_sync': 0
+}
+
+
+class ReconcileTest(unittest.TestCase):
+    """每个分支一行：(名称, 服务端摘要, 客户端条目, 期望结果中与空结果不同的字段)"""
+
+    CASES = [
+        (
+            '内容与版本一致',
+            ('h1', 3), client_entry('h1', 3),
+            {'in_sync': 1}
+        ),
+        (
+            '内容一致、服务端版本更高：只更新版本',
+            ('h1', 5), client_entry('h1', 3),
+            {'in_sync': 1, 'versions': {'a': 5}}
+        ),
+        (
+            '内容一致、客户端版本更高：以服务端版本为准',
+            ('h1', 2), client_entry('h1', 3),
+            {'in_sync': 1, 'versions': {'a': 2}}
+        ),
+        (
+            '服务端较新、客户端未修改：下发',
+            ('h2', 4), client_entry('h1', 3),
+            {'download_ids': ['a']}
+        ),
+        (
+            '服务端较新、客户端也修改过：下发并记为冲突',
+            ('h2', 4), client_entry('h1', 3, dirty=True),
+            {'download_ids': ['a'], 'conflict_ids': ['a']}
+        ),
+        (
+            '版本相同、指纹不同：客户端修改过，上传',
+            ('h1', 3), client_entry('h2', 3, dirty=True),
+            {'upload_ids': ['a']}
+        ),
+        (
+            '客户端版本高于服务端、指纹不同：上传',
+            ('h1', 2), client_entry('h2', 3),
+            {'upload_ids': ['a']}
+        ),
+        (
+            '服务端指纹未回填、客户端未修改：下发',
+            ('', 1), client_entry('h1', 1),
+            {'download_ids': ['a']}
+        ),
+        (
+            '服务端指纹未回填、客户端修改过：下发并记为冲突',
+            ('', 1), client_entry('h1', 1, dirty=True),
+            {'download_ids': ['a'], 'conflict_ids': ['a']}
+        ),
+        (
+            '只在客户端、version 为 0：新建，上传',
+            None, client_entry('h1', 0, dirty=True),
+            {'upload_ids': ['a']}
+        ),
+        (
+            '只在客户端、version 大于 0：服务端已删除',
+            None, client_entry('h1', 3),
+            {'delete_ids': ['a']}
+        ),
+        (
+            '只在服务端：下发',
+            ('h1', 1), None,
+            {'download_ids': ['a']}
+        ),
+    ]
+
+    def test_branches(self):
+        for name, remote, local, changes in self.CASES:
+            with self.subTest(name):
+                server = {'a': remote} if remote is not None else {}
+                client = {'a': local} if local is not None else {}
+                self.assertEqual(reconcile(server, client), {**EMPTY, **changes})
+
+    def test_scope_limits_comparison(self):
+        server = {'a': ('h1', 1), 'b': ('h2', 1)}
+        client = {'a': client_entry('x', 1), 'b': client_entry('y', 1)}
+        scope = {bucket_of('a', 2)}
+        result = reconcile(server, client, scope, 2)
+        compared = {alarm_id for alarm_id in server if bucket_of(alarm_id, 2) in scope}
+        self.assertEqual(set(result['upload_ids']), compared)
+
+
+class BucketRoundTripTest(unittest.TestCase):
+    """bucket_digests → diff_buckets → 按桶限定的 reconcile 与全量 reconcile 结果一致"""
+
+    BUCKETS = 16
+
+    def setUp(self):
+        self.server = {f'alarm_{i:03d}': (f'hash_{i}', i % 4 + 1) for i in range(200)}
+        # 客户端与服务端一致的副本
+        self.client = {
+            alarm_id: client_entry(content_hash, version)
+            for alarm_id, (content_hash, version) in self.server.items()
+        }
+
+    def client_digests(self):
+        return {alarm_id: (entry['hash'], entry['version']) for alarm_id, entry in self.client.items()}
+
+    def round_trip(self):
+        mismatched = diff_buckets(
+            bucket_digests(self.server, self.BUCKETS),
+            bucket_digests(self.client_digests(), self.BUCKETS)
+        )
+        return mismatched, reconcile(self.server, self.client, set(mismatched), self.BUCKETS)
+
+    def test_bucket_of_is_stable(self):
+        # SHA-256("a") = ca978112...，客户端需要按同样的规则计算
+        self.assertEqual(bucket_of('a', 256), 0x12)
+        self.assertEqual(bucket_of('a', 1 << 32), 0xca978112)
+
+    def test_in_sync(self):
+        mismatched, result = self.round_trip()
+        self.assertEqual(mismatched, [])
+        self.assertEqual(result, EMPTY)
+
+    def test_digest_ignores_order(self):
+        reordered = dict(reversed(list(self.server.items())))
+        self.assertEqual(bucket_digests(reordered, self.BUCKETS), bucket_digests(self.server, self.BUCKETS))
+
+    def test_changes_are_found(self):
+        # 服务端更新、客户端修改、客户端新建、服务端删除、服务端新增、只有版本不同
+        self.server['alarm_001'] = ('hash_1_new', self.server['alarm_001'][1] + 1)
+        self.client['alarm_002'] = client_entry('hash_2_local', self.client['alarm_002']['version'], dirty=True)
+        self.client['alarm_new'] = client_entry('hash_new', 0, dirty=True)
+        del self.server['alarm_003']
+        self.server['alarm_server'] = ('hash_server', 1)
+        self.server['alarm_004'] = ('hash_4', self.server['alarm_004'][1] + 1)
+
+        mismatched, scoped = self.round_trip()
+        changed = ['alarm_001', 'alarm_002', 'alarm_new', 'alarm_003', 'alarm_server', 'alarm_004']
+        self.assertEqual(mismatched, sorted({bucket_of(alarm_id, self.BUCKETS) for alarm_id in changed}))
+
+        full = reconcile(self.server, self.client)
+        for field in ('download_ids', 'upload_ids', 'delete_ids', 'conflict_ids'):
+            self.assertEqual(sorted(scoped[field]), sorted(full[field]), field)
+        self.assertEqual(scoped['versions'], full['versions'])
+        self.assertEqual(sorted(full['download_ids']), ['alarm_001', 'alarm_server'])
+        self.assertEqual(sorted(full['upload_ids']), ['alarm_002', 'alarm_new'])
+        self.assertEqual(full['delete_ids'], ['alarm_003'])
+        self.assertEqual(full['versions'], {'alarm_004': self.server['alarm_004'][1]})
+        # 按桶限定时只比对不一致的桶，一致的桶不计入 in_sync
+        self.assertLess(scoped['in_sync'], full['in_sync'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,628 @@
+"""
+语音会话中继
+
+客户端接听 CallKit 来电时才去连接语音后端，TLS、鉴权和 hello 握手都落在用户等待的那一刻。
+中继部署在 API 旁边，在来电响铃期间提前准备好该设备的会话：
+- 上游会话始终使用客户端自己的身份（Device-Id / Client-Id / 访问令牌），中继不持有任何上游凭据，
+  上游按设备保存的状态（对话记忆、设备绑定、限额）与直连时完全一致，不同设备之间互不可见
+- 预热按设备进行：客户端收到来电推送（即该设备有闹钟到点）时请求 GET /prewarm，中继用该设备的身份
+  建立一条完成 hello 握手的上游会话；接听时客户端发来 hello，身份完全一致才取出这条会话并回放其 hello 应答
+- 没有预热会话（未预热、已过期、音频参数不同）时现场建立连接，与直连耗时相同
+- 上游会话有状态，用过即关闭；空闲超过 RELAY_POOL_MAX_IDLE 的预热会话关闭，预热总数不超过 RELAY_POOL_SIZE
+- Opus 帧不解码：收到的消息对象原样交给另一端发送，并关闭 permessage-deflate（Opus 本身不可压缩）
+- 背压：每个方向最多缓冲 RELAY_MAX_QUEUE 帧，对端发送变慢时停止读取，由 TCP 把压力传回发送方
+- StandInUpstream 是本地替身上游，模拟握手耗时并回送音频帧，用于开发和压测
+
+访问中继本身需要 RELAY_CLIENT_TOKEN（X-Relay-Token 头或 relay_token 参数），与上游的访问令牌分开：
+Authorization / access_token 仍是设备自己的上游令牌，由中继原样转发。监听非本机地址时必须设置
+RELAY_CLIENT_TOKEN，否则拒绝启动。
+
+用法:
+    python voice_relay.py                      # 按配置启动中继
+    python voice_relay.py --stand-in           # 同时启动本地替身上游，中继连向替身
+    python voice_relay.py --bench 200          # 本地替身 + 中继，对比直连与响铃时预热后经中继的接听握手耗时
+"""
+import argparse
+import asyncio
+import hmac
+import ipaddress
+import json
+import logging
+import time
+import uuid
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from websockets.asyncio.client import ClientConnection, connect
+from websockets.asyncio.server import ServerConnection, serve
+from websockets.exceptions import ConnectionClosed, InvalidHandshake, InvalidStatus
+from websockets.protocol import State
+from audio_cache import DEFAULT_CODEC
+from config import Config
+
+
+NORMAL_MODE = 'normal'
+REALTIME_MODE = 'realtime'
+MODES = (NORMAL_MODE, REALTIME_MODE)
+
+# 客户端 hello 的超时时间与上游握手超时时间（秒）
+HELLO_TIMEOUT = 10
+UPSTREAM_TIMEOUT = 10
+
+# 自定义关闭码
+CLOSE_UNAUTHORIZED = 4001
+CLOSE_UPSTREAM_UNAVAILABLE = 4002
+CLOSE_DEVICE_REQUIRED = 4003
+
+
+def default_hello() -> Dict[str, Any]:
+    """与 xiaozhi_service.dart 一致的 hello 消息"""
+    return {
+        'type': 'hello',
+        'version': 1,
+        'transport': 'websocket',
+        'features': {'mcp': True},
+        'audio_params': DEFAULT_CODEC.to_dict()
+    }
+
+
+def mode_for(path: str) -> str:
+    """客户端请求路径对应的会话模式"""
+    return REALTIME_MODE if 'realtime_chat' in urlsplit(path).path else NORMAL_MODE
+
+
+def query_params(request) -> Dict[str, str]:
+    return dict(parse_qsl(urlsplit(request.path).query))
+
+
+def bearer_token(request) -> str:
+    """上游访问令牌：优先 Authorization 头，其次 access_token 参数（Web 端无法设置 Header）"""
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        return auth[len('Bearer '):]
+    return query_params(request).get('access_token', '')
+
+
+def relay_token(request) -> str:
+    """访问中继的令牌：X-Relay-Token 头或 relay_token 参数"""
+    return request.headers.get('X-Relay-Token') or query_params(request).get('relay_token', '')
+
+
+def is_loopback(host: str) -> bool:
+    """监听地址是否只接受本机连接"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class _HttpResponseFilter(logging.Filter):
+    """websockets 13 把 process_request 返回的普通 HTTP 响应（/health、/prewarm）记为握手失败，过滤这类日志"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not (record.exc_info and isinstance(record.exc_info[1], InvalidStatus))
+
+
+class DeviceIdentity(NamedTuple):
+    """客户端的上游身份，原样用于该客户端的上游会话"""
+    device_id: str
+    client_id: str
+    access_token: str
+
+    @classmethod
+    def from_request(cls, request) -> Optional['DeviceIdentity']:
+        """
+        从客户端请求读取身份：Device-Id / Client-Id 头（Web 端为 device_id / client_id 参数）与上游访问令牌
+        :return: 身份，缺少 Device-Id 时返回 None
+        """
+        query = query_params(request)
+        device_id = request.headers.get('Device-Id') or query.get('device_id', '')
+        if not device_id:
+            return None
+        client_id = request.headers.get('Client-Id') or query.get('client_id', '')
+        return cls(device_id, client_id, bearer_token(request))
+
+
+class UpstreamSession:
+    """已完成 hello 握手的上游连接"""
+
+    def __init__(self, ws: ClientConnection, hello_text: str, mode: str):
+        """
+        :param ws: 上游连接
+        :param hello_text: 上游的 hello 应答原文，交给客户端时原样回放
+        :param mode: 会话模式
+        """
+        self.ws = ws
+        self.hello_text = hello_text
+        self.mode = mode
+        self.opened_at = time.monotonic()
+
+    def usable(self, now: float, max_idle: float) -> bool:
+        return self.ws.state is State.OPEN and now - self.opened_at < max_idle
+
+
+class UpstreamConnector:
+    """以客户端的身份建立上游连接并完成 hello 握手"""
+
+    def __init__(self, url: str, max_queue: int = 32, timeout: float = UPSTREAM_TIMEOUT):
+        """
+        :param url: 上游地址，例如 wss://api.tenclass.net/xiaozhi/v1/
+        :param max_queue: 每个连接最多缓冲的帧数
+        :param timeout: 连接与握手超时秒数
+        """
+        self.url = url
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+    def url_for(self, mode: str, access_token: str = '') -> str:
+        """与客户端相同的拼接规则：realtime 模式在原路径后追加 realtime_chat 并带上 sample_rate"""
+        parts = urlsplit(self.url)
+        query = dict(parse_qsl(parts.query))
+        path = parts.path
+        if access_token:
+            query['access_token'] = access_token
+        if mode == REALTIME_MODE:
+            path = (path if path.endswith('/') else path + '/') + 'realtime_chat'
+            query.setdefault('sample_rate', str(DEFAULT_CODEC.sample_rate))
+        return urlunsplit((parts.scheme, parts.netloc, path, urlencode(query), ''))
+
+    @staticmethod
+    def headers(identity: DeviceIdentity) -> Dict[str, str]:
+        headers = {
+            'Protocol-Version': '1',
+            'Device-Id': identity.device_id,
+            'Client-Id': identity.client_id
+        }
+        if identity.access_token:
+            headers['Authorization'] = f'Bearer {identity.access_token}'
+        return headers
+
+    async def open(self, identity: DeviceIdentity, mode: str, hello: Dict[str, Any]) -> UpstreamSession:
+        """
+        建立上游连接并完成 hello 握手
+        :param identity: 客户端身份
+        :param mode: 会话模式
+        :param hello: 发送给上游的 hello 消息
+        :return: 上游会话
+        :raises OSError / InvalidHandshake / TimeoutError: 连接或握手失败
+        """
+        ws = await connect(
+            self.url_for(mode, identity.access_token),
+            additional_headers=self.headers(identity),
+            compression=None,
+            open_timeout=self.timeout,
+            max_queue=self.max_queue
+        )
+        try:
+            await ws.send(json.dumps(hello))
+            async with asyncio.timeout(self.timeout):
+                while True:
+                    message = await ws.recv()
+                    if isinstance(message, str) and json.loads(message).get('type') == 'hello':
+                        return UpstreamSession(ws, message, mode)
+        except BaseException:
+            await ws.close()
+            raise
+
+
+WarmKey = Tuple[DeviceIdentity, str]
+
+
+class WarmSessions:
+    """按 (设备身份, 模式) 保存的预热会话，每个键最多一条"""
+
+    def __init__(self, connector: UpstreamConnector, size: int, max_idle: float):
+        """
+        :param connector: 上游连接器
+        :param size: 同时保持的预热会话总数上限
+        :param max_idle: 预热会话的最长保留秒数
+        """
+        self.connector = connector
+        self.size = size
+        self.max_idle = max_idle
+        # 进行中或已完成的预热，acquire 时可以直接等待进行中的握手
+        self._warm: Dict[WarmKey, asyncio.Task] = {}
+        self.prewarms = 0
+        self.rejected = 0
+        self.warm_hits = 0
+        self.cold_starts = 0
+        self.failures = 0
+        self.expired = 0
+
+    def prewarm(self, identity: DeviceIdentity, mode: str) -> bool:
+        """
+        为设备建立一条预热会话（已有则不重复建立）
+        :return: 是否已有或已开始预热；达到总数上限时返回 False
+        """
+        key = (identity, mode)
+        if key in self._warm:
+            return True
+        if len(self._warm) >= self.size:
+            self.rejected += 1
+            return False
+        self.prewarms += 1
+        self._warm[key] = asyncio.create_task(self.connector.open(identity, mode, default_hello()))
+        return True
+
+    async def acquire(
+        self,
+        identity: DeviceIdentity,
+        mode: str,
+        hello: Optional[Dict[str, Any]] = None
+    ) -> Tuple[UpstreamSession, bool]:
+        """
+        取出设备的上游会话
+        :param identity: 客户端身份，必须与预热时完全一致
+        :param mode: 会话模式
+        :param hello: 客户端的 hello 与预热参数不一致时传入，改为现场建立连接
+        :return: (上游会话, 是否命中预热会话)
+        """
+        task = self._warm.pop((identity, mode), None)
+        if task is not None:
+            if hello is None:
+                try:
+                    session = await task
+                except (OSError, InvalidHandshake, TimeoutError, ConnectionClosed) as e:
+                    self.failures += 1
+                    print(f"预热上游会话失败 ({mode}): {e}")
+                else:
+                    if session.usable(time.monotonic(), self.max_idle):
+                        self.warm_hits += 1
+                        return session, True
+                    self.expired += 1
+                    asyncio.create_task(session.ws.close())
+            else:
+                self._discard(task)
+        self.cold_starts += 1
+        return await self.connector.open(identity, mode, hello or default_hello()), False
+
+    async def run(self) -> None:
+        """后台维护：关闭过期与失效的预热会话"""
+        while True:
+            await asyncio.sleep(max(1.0, self.max_idle / 4))
+            self._evict()
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for key, task in list(self._warm.items()):
+            if not task.done():
+                continue
+            if task.cancelled() or task.exception() is not None:
+                self.failures += 1
+                print(f"预热上游会话失败 ({key[1]}): {task.exception() if not task.cancelled() else 'cancelled'}")
+                del self._warm[key]
+            elif not task.result().usable(now, self.max_idle):
+                self.expired += 1
+                del self._warm[key]
+                asyncio.create_task(task.result().ws.close())
+
+    def _discard(self, task: asyncio.Task) -> None:
+        """丢弃一条不再使用的预热会话"""
+        def close(done: asyncio.Task) -> None:
+            if not done.cancelled() and done.exception() is None:
+                asyncio.create_task(done.result().ws.close())
+        task.add_done_callback(close)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'warm': sum(1 for task in self._warm.values() if task.done()),
+            'pending': sum(1 for task in self._warm.values() if not task.done()),
+            'prewarms': self.prewarms,
+            'rejected': self.rejected,
+            'warm_hits': self.warm_hits,
+            'cold_starts': self.cold_starts,
+            'failures': self.failures,
+            'expired': self.expired
+        }
+
+
+class VoiceRelay:
+    """客户端与上游之间的语音会话中继"""
+
+    def __init__(self, connector: UpstreamConnector, pool_size: int, max_idle: float,
+                 max_queue: int = 32, client_token: str = ''):
+        """
+        :param connector: 上游连接器
+        :param pool_size: 同时保持的预热会话总数上限
+        :param max_idle: 预热会话的最长保留秒数
+        :param max_queue: 每个方向最多缓冲的帧数
+        :param client_token: 访问中继需携带的令牌，空字符串表示不校验
+        """
+        self.warm = WarmSessions(connector, pool_size, max_idle)
+        self.max_queue = max_queue
+        self.client_token = client_token
+        self.active = 0
+        self.sessions = 0
+        self.rejected = 0
+        self.frames = {'up': 0, 'down': 0}
+
+    def start(self) -> List[asyncio.Task]:
+        """启动预热会话的后台维护任务"""
+        return [asyncio.create_task(self.warm.run())]
+
+    async def serve(self, host: str, port: int):
+        logging.getLogger('websockets.server').addFilter(_HttpResponseFilter())
+        return await serve(
+            self.handle, host, port,
+            process_request=self.process_request,
+            compression=None,
+            max_queue=self.max_queue
+        )
+
+    def authorized(self, request) -> bool:
+        return not self.client_token or hmac.compare_digest(relay_token(request), self.client_token)
+
+    def process_request(self, connection: ServerConnection, request):
+        """
+        普通 HTTP 请求：
+        - GET /health 返回运行状态
+        - GET /prewarm?mode=normal|realtime 以请求携带的设备身份预热一条上游会话，客户端收到来电推送时调用
+        """
+        path = urlsplit(request.path).path
+        if path == '/health':
+            return connection.respond(200, json.dumps(self.stats()) + '\n')
+        if path == '/prewarm':
+            if not self.authorized(request):
+                self.rejected += 1
+                return connection.respond(401, 'unauthorized\n')
+            identity = DeviceIdentity.from_request(request)
+            if identity is None:
+                return connection.respond(400, 'Device-Id required\n')
+            mode = query_params(request).get('mode', NORMAL_MODE)
+            if mode not in MODES:
+                return connection.respond(400, f'mode must be one of {", ".join(MODES)}\n')
+            if not self.warm.prewarm(identity, mode):
+                return connection.respond(503, 'prewarm capacity exhausted\n')
+            return connection.respond(202, 'accepted\n')
+        return None
+
+    async def handle(self, client: ServerConnection) -> None:
+        if not self.authorized(client.request):
+            self.rejected += 1
+            await client.close(CLOSE_UNAUTHORIZED, 'unauthorized')
+            return
+        identity = DeviceIdentity.from_request(client.request)
+        if identity is None:
+            await client.close(CLOSE_DEVICE_REQUIRED, 'Device-Id required')
+            return
+        try:
+            async with asyncio.timeout(HELLO_TIMEOUT):
+                hello = json.loads(await client.recv())
+        except (TimeoutError, ConnectionClosed, ValueError, TypeError):
+            await client.close(1002, 'hello expected')
+            return
+        if not isinstance(hello, dict) or hello.get('type') != 'hello':
+            await client.close(1002, 'hello expected')
+            return
+
+        # 音频参数与预热会话不一致时，带着客户端自己的 hello 现场建立连接
+        custom = hello.get('audio_params') not in (None, DEFAULT_CODEC.to_dict())
+        try:
+            upstream, _ = await self.warm.acquire(identity, mode_for(client.request.path), hello if custom else None)
+        except (OSError, InvalidHandshake, TimeoutError, ConnectionClosed) as e:
+            print(f"上游连接失败: {e}")
+            await client.close(CLOSE_UPSTREAM_UNAVAILABLE, 'upstream unavailable')
+            return
+
+        self.sessions += 1
+        self.active += 1
+        try:
+            await client.send(upstream.hello_text)
+            await self._bridge(client, upstream.ws)
+        except ConnectionClosed:
+            pass
+        finally:
+            self.active -= 1
+            await upstream.ws.close()
+            await client.close()
+
+    async def _bridge(self, client: ServerConnection, upstream: ClientConnection) -> None:
+        """双向转发，任一方向结束即结束整个会话"""
+        tasks = [
+            asyncio.create_task(self._pump(client, upstream, 'up')),
+            asyncio.create_task(self._pump(upstream, client, 'down'))
+        ]
+        _, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _pump(self, source, target, direction: str) -> None:
+        try:
+            async for message in source:
+                # send 在对端写缓冲超过上限时等待，期间不再从 source 读取
+                await target.send(message)
+                self.frames[direction] += 1
+        except ConnectionClosed:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'active': self.active,
+            'sessions': self.sessions,
+            'rejected': self.rejected,
+            'frames': dict(self.frames),
+            'warm': self.warm.stats()
+        }
+
+
+def create_relay() -> VoiceRelay:
+    """
+    按配置创建中继
+    :raises ValueError: 监听非本机地址却未设置 RELAY_CLIENT_TOKEN（任何人都能借中继连接上游、占用预热名额）
+    """
+    if not Config.RELAY_CLIENT_TOKEN and not is_loopback(Config.RELAY_HOST):
+        raise ValueError(f"RELAY_HOST={Config.RELAY_HOST} 对外监听时必须设置 RELAY_CLIENT_TOKEN")
+    connector = UpstreamConnector(Config.RELAY_UPSTREAM_URL, max_queue=Config.RELAY_MAX_QUEUE)
+    return VoiceRelay(
+        connector,
+        pool_size=Config.RELAY_POOL_SIZE,
+        max_idle=Config.RELAY_POOL_MAX_IDLE,
+        max_queue=Config.RELAY_MAX_QUEUE,
+        client_token=Config.RELAY_CLIENT_TOKEN
+    )
+
+
+class StandInUpstream:
+    """
+    本地替身上游：hello 前等待 handshake_delay 模拟 OTA/TLS/鉴权耗时，回送收到的音频帧模拟 TTS 下行；
+    hello 应答带上连接的 Device-Id，便于确认会话属于哪台设备
+    """
+
+    def __init__(self, access_token: str = '', handshake_delay: float = 0.3):
+        """
+        :param access_token: 要求的访问令牌，空字符串表示不校验
+        :param handshake_delay: hello 应答前的等待秒数
+        """
+        self.access_token = access_token
+        self.handshake_delay = handshake_delay
+        self.sessions = 0
+
+    async def serve(self, host: str, port: int):
+        return await serve(self.handle, host, port, compression=None)
+
+    async def handle(self, ws: ServerConnection) -> None:
+        if self.access_token and bearer_token(ws.request) != self.access_token:
+            await ws.close(CLOSE_UNAUTHORIZED, 'unauthorized')
+            return
+        try:
+            async for message in ws:
+                if isinstance(message, bytes):
+                    await ws.send(message)
+                    continue
+                data = json.loads(message)
+                if data.get('type') == 'hello':
+                    await asyncio.sleep(self.handshake_delay)
+                    self.sessions += 1
+                    await ws.send(json.dumps({
+                        'type': 'hello',
+                        'transport': 'websocket',
+                        'session_id': uuid.uuid4().hex,
+                        'device_id': ws.request.headers.get('Device-Id', ''),
+                        'audio_params': data.get('audio_params') or DEFAULT_CODEC.to_dict()
+                    }))
+                elif data.get('type') == 'ping':
+                    await ws.send(json.dumps({'type': 'pong', 'timestamp': data.get('timestamp')}))
+        except ConnectionClosed:
+            pass
+
+
+def _bench_headers(device: int, relay_token_value: str = '') -> Dict[str, str]:
+    """压测中第 device 台设备的请求头：每台设备有自己的 Device-Id / Client-Id / 访问令牌"""
+    headers = {
+        'Protocol-Version': '1',
+        'Device-Id': f'bench-device-{device}',
+        'Client-Id': f'bench-client-{device}',
+        'Authorization': f'Bearer bench-token-{device}'
+    }
+    if relay_token_value:
+        headers['X-Relay-Token'] = relay_token_value
+    return headers
+
+
+async def _http_get(url: str, headers: Dict[str, str]) -> int:
+    """发送一个 HTTP GET，返回状态码"""
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port)
+    lines = [f'GET {parts.path}?{parts.query} HTTP/1.1', f'Host: {parts.netloc}', 'Connection: close']
+    lines += [f'{name}: {value}' for name, value in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+    status = int((await reader.readline()).split()[1])
+    writer.close()
+    await writer.wait_closed()
+    return status
+
+
+async def _bench_client(url: str, headers: Dict[str, str], frames: int) -> float:
+    """模拟一次接听：返回从发起连接到收到 hello 应答的秒数，并确认会话属于本设备"""
+    started = time.perf_counter()
+    async with connect(url, additional_headers=headers, compression=None) as ws:
+        await ws.send(json.dumps(default_hello()))
+        reply = json.loads(await ws.recv())
+        elapsed = time.perf_counter() - started
+        assert reply.get('type') == 'hello' and reply.get('session_id')
+        assert reply.get('device_id') == headers['Device-Id'], "上游会话不属于本设备"
+        frame = bytes(120)
+        for _ in range(frames):
+            await ws.send(frame)
+        for _ in range(frames):
+            assert await ws.recv() == frame
+    return elapsed
+
+
+async def _bench_call(relay_url: Optional[str], upstream_url: str, device: int, ring: float) -> float:
+    """
+    模拟一台设备的来电：经中继时先在收到推送时预热，响铃 ring 秒后接听
+    :param relay_url: 中继地址，None 表示直连上游
+    """
+    if relay_url is None:
+        await asyncio.sleep(ring)
+        return await _bench_client(upstream_url, _bench_headers(device), frames=20)
+    headers = _bench_headers(device, Config.RELAY_CLIENT_TOKEN)
+    parts = urlsplit(relay_url)
+    status = await _http_get(urlunsplit(('http', parts.netloc, '/prewarm', 'mode=normal', '')), headers)
+    assert status == 202, f"预热失败: {status}"
+    await asyncio.sleep(ring)
+    return await _bench_client(relay_url, headers, frames=20)
+
+
+def _percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def _bench(relay: VoiceRelay, upstream_url: str, relay_url: str, count: int, interval: float, ring: float) -> None:
+    for label, url in (('直连上游', None), ('经过中继', relay_url)):
+        calls = []
+        for device in range(count):
+            calls.append(asyncio.create_task(_bench_call(url, upstream_url, device, ring)))
+            await asyncio.sleep(interval)
+        latencies = await asyncio.gather(*calls)
+        print(f"{label}: p50 {_percentile(latencies, 0.5) * 1000:.1f} ms, "
+              f"p95 {_percentile(latencies, 0.95) * 1000:.1f} ms")
+    print(json.dumps(relay.stats(), ensure_ascii=False))
+
+
+async def _main(args) -> None:
+    if args.stand_in or args.bench:
+        stand_in = StandInUpstream(handshake_delay=args.handshake_delay)
+        await stand_in.serve('127.0.0.1', args.stand_in_port)
+        Config.RELAY_UPSTREAM_URL = f'ws://127.0.0.1:{args.stand_in_port}/xiaozhi/v1/'
+        print(f"本地替身上游: {Config.RELAY_UPSTREAM_URL}")
+
+    relay = create_relay()
+    server = await relay.serve(Config.RELAY_HOST, Config.RELAY_PORT)
+    relay.start()
+    print(f"语音中继已启动: ws://{Config.RELAY_HOST}:{Config.RELAY_PORT}/xiaozhi/v1/")
+
+    if args.bench:
+        await _bench(
+            relay,
+            UpstreamConnector(Config.RELAY_UPSTREAM_URL).url_for(NORMAL_MODE),
+            f'ws://127.0.0.1:{Config.RELAY_PORT}/xiaozhi/v1/',
+            args.bench,
+            args.interval,
+            args.ring
+        )
+        return
+    await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="语音会话中继")
+    parser.add_argument('--stand-in', action='store_true', help="启动本地替身上游并让中继连向它")
+    parser.add_argument('--stand-in-port', type=int, default=Config.RELAY_PORT + 1, help="替身上游端口")
+    parser.add_argument('--handshake-delay', type=float, default=0.3, help="替身上游的 hello 应答延迟（秒）")
+    parser.add_argument('--bench', type=int, default=0, help="压测：依次模拟 N 次接听")
+    parser.add_argument('--interval', type=float, default=0.05, help="压测中两次来电的间隔（秒）")
+    parser.add_argument('--ring', type=float, default=1.0, help="压测中从收到来电推送到接听的响铃秒数")
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()